@@ -0,0 +1,330 @@
+#!/usr/bin/python
+
+#############################################################################
+## Title: benchmarkMPileup.py
+## Description: Generate synthetic samtools mpileup files and benchmark
+##              the parsing of parseMPileup.py
+##
+## Author: Pascal Belleau and Astrid Deschenes
+## Creation: 2017-09-14
+## License: GPL-3
+#############################################################################
+
+##################
+## IMPORT
+##################
+
+import os
+import sys
+import time
+import json
+import getopt
+import random
+import shutil
+import platform
+import resource
+import tempfile
+import subprocess
+
+##################
+## CONSTANTS
+##################
+
+## Benchmarked configurations, the number of lines is computed so each
+## configuration contains about the same number of bases
+CONFIGURATIONS = (
+    dict([('name', "depth30"), ('depth', 30), ('indelRate', 0.01), ('startRate', 0.02), ('endRate', 0.02), ('skipRate', 0.0)]),
+    dict([('name', "depth500"), ('depth', 500), ('indelRate', 0.01), ('startRate', 0.02), ('endRate', 0.02), ('skipRate', 0.0)]),
+    dict([('name', "depth5000"), ('depth', 5000), ('indelRate', 0.01), ('startRate', 0.02), ('endRate', 0.02), ('skipRate', 0.0)]),
+    dict([('name', "indelHeavy"), ('depth', 500), ('indelRate', 0.25), ('startRate', 0.02), ('endRate', 0.02), ('skipRate', 0.0)]),
+    dict([('name', "readEnds"), ('depth', 500), ('indelRate', 0.01), ('startRate', 0.3), ('endRate', 0.3), ('skipRate', 0.0)]),
+    dict([('name', "referenceSkips"), ('depth', 500), ('indelRate', 0.01), ('startRate', 0.02), ('endRate', 0.02), ('skipRate', 0.3)]))
+
+## Functions that can be benchmarked
+FUNCTIONS = ("parsePileup", "extractCigarSeq")
+
+## Number of bases of each benchmarked configuration
+DEFAULT_BASES = 5000000
+
+## Fraction of the bases that differ from the reference
+MISMATCH_RATE = 0.05
+
+## Relative loss of throughput or gain of peak memory reported as a regression
+DEFAULT_TOLERANCE = 0.1
+
+def generatePileupLine(rand, chromosome, position, depth, indelRate, startRate, endRate, skipRate):
+    """
+    Generate a line of a samtools mpileup file containing the Mapq column
+    and return a tuple containing the line and the number of bases.
+
+    Keyword arguments:
+    rand -- the random generator
+    chromosome -- the name of the chromosome
+    position -- the position
+    depth -- the number of reads covering the position
+    indelRate -- the probability that a read has an indel after the position
+    startRate -- the probability that a read starts at the position ("^")
+    endRate -- the probability that a read ends at the position ("$")
+    skipRate -- the probability that a read skips the position ("<" or ">")
+    """
+    ref = rand.choice("ACGT")
+    sequence = list()
+    phred = list()
+    mapq = list()
+    for i in xrange(depth):
+        if rand.random() < startRate:
+            sequence.append("^" + chr(rand.randint(33, 93)))
+        draw = rand.random()
+        if draw < skipRate:
+            sequence.append(rand.choice("<>"))
+        elif draw < skipRate + MISMATCH_RATE:
+            sequence.append(rand.choice("ACGTNacgtn".replace(ref, "").replace(ref.lower(), "")))
+        else:
+            sequence.append(rand.choice(".,"))
+        phred.append(chr(rand.randint(35, 74)))
+        mapq.append(chr(rand.randint(33, 93)))
+        if rand.random() < indelRate:
+            length = rand.randint(1, 10)
+            sequence.append(rand.choice("+-") + str(length) + "".join([rand.choice("ACGTacgt") for j in xrange(length)]))
+        if rand.random() < endRate:
+            sequence.append("$")
+
+    if depth == 0:
+        return("%s\t%d\t%s\t0\t*\t*\t*\n" % (chromosome, position, ref), 0)
+    return("%s\t%d\t%s\t%d\t%s\t%s\t%s\n" % (chromosome, position, ref, depth, "".join(sequence), "".join(phred), "".join(mapq)), depth)
+
+def generatePileup(oFile, nbLines, depth, indelRate, startRate, endRate, skipRate, seed=1):
+    """
+    Write a synthetic samtools mpileup file and return the number of bases.
+    The depth of each position is drawn around the requested depth and the
+    same seed always generates the same file.
+
+    Keyword arguments:
+    oFile -- the output file pointer
+    nbLines -- the number of lines
+    depth -- the mean number of reads covering each position
+    indelRate -- the probability that a read has an indel after a position
+    startRate -- the probability that a read starts at a position ("^")
+    endRate -- the probability that a read ends at a position ("$")
+    skipRate -- the probability that a read skips a position ("<" or ">")
+    seed -- the seed of the random generator
+    """
+    rand = random.Random(seed)
+    nbBases = 0
+    for i in xrange(nbLines):
+        lineDepth = rand.randint(depth // 2, depth + depth // 2)
+        (line, lineBases) = generatePileupLine(rand, "chr1", i + 1, lineDepth, indelRate, startRate, endRate, skipRate)
+        oFile.write(line)
+        nbBases += lineBases
+    return(nbBases)
+
+def runFunction(function, inputFile, outputPrefix):
+    """
+    Run a benchmarked function on an input file and return the elapsed time
+    in seconds.
+
+    Keyword arguments:
+    function -- the name of the function, one of FUNCTIONS
+    inputFile -- the name of the input file
+    outputPrefix -- the prefix of the output files
+    """
+    import parseMPileup
+
+    start = time.time()
+    if function == "parsePileup":
+        parseMPileup.parsePileup(inputFile, outputPrefix, False)
+    else:
+        iFile = open(inputFile)
+        for line in iFile:
+            data = line.split("\t")
+            info = dict([('chr', data[0]), ('pos', data[1]), ('ref', data[2]), ('NB', data[3])])
+            parseMPileup.extractCigarSeq(data[4], data[5], data[6], info)
+        iFile.close()
+    return(time.time() - start)
+
+def benchmarkConfiguration(configuration, function, nbBases, seed, workDir):
+    """
+    Benchmark a function on a synthetic file generated with a configuration
+    and return a dictionary with the throughputs and the peak memory. The
+    function runs in a new process so its peak memory is measured alone.
+
+    Keyword arguments:
+    configuration -- a dictionary describing the synthetic file, from CONFIGURATIONS
+    function -- the name of the function, one of FUNCTIONS
+    nbBases -- the approximate number of bases of the synthetic file
+    seed -- the seed of the random generator
+    workDir -- the directory receiving the temporary files
+    """
+    inputFile = os.path.join(workDir, configuration['name'] + ".pileup")
+    nbLines = max(1, nbBases // configuration['depth'])
+    oFile = open(inputFile, 'w')
+    nbBases = generatePileup(oFile, nbLines, configuration['depth'], configuration['indelRate'],
+                             configuration['startRate'], configuration['endRate'], configuration['skipRate'], seed)
+    oFile.close()
+
+    command = [sys.executable, os.path.abspath(__file__), "run-one", function, inputFile, os.path.join(workDir, configuration['name'])]
+    child = subprocess.Popen(command, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    (stdout, stderr) = child.communicate()
+    if child.returncode != 0:
+        raise RuntimeError("Benchmark of %s failed" % (configuration['name']))
+    measure = json.loads(stdout.splitlines()[-1])
+
+    for name in os.listdir(workDir):
+        os.unlink(os.path.join(workDir, name))
+
+    return(dict([('configuration', configuration), ('function', function), ('seed', seed),
+                 ('lines', nbLines), ('bases', nbBases), ('seconds', measure['seconds']),
+                 ('linesPerSecond', nbLines / max(measure['seconds'], 1e-9)),
+                 ('basesPerSecond', nbBases / max(measure['seconds'], 1e-9)),
+                 ('peakRssKB', measure['peakRssKB'])]))
+
+def runBenchmarks(resultFile, functions=("parsePileup",), nbBases=DEFAULT_BASES, seed=1, names=None):
+    """
+    Benchmark the functions on each configuration, print a summary and
+    save the results in a JSON file.
+
+    Keyword arguments:
+    resultFile -- the name of the JSON file receiving the results
+    functions -- the names of the benchmarked functions
+    nbBases -- the approximate number of bases of each synthetic file
+    seed -- the seed of the random generator
+    names -- the names of the benchmarked configurations, None for all of them
+    """
+    workDir = tempfile.mkdtemp()
+    results = dict()
+    try:
+        for configuration in CONFIGURATIONS:
+            if names is not None and configuration['name'] not in names:
+                continue
+            for function in functions:
+                key = function + ":" + configuration['name']
+                results[key] = benchmarkConfiguration(configuration, function, nbBases, seed, workDir)
+                print "%-32s %12.0f lines/s %14.0f bases/s %10d KB" % (key, results[key]['linesPerSecond'],
+                                                                       results[key]['basesPerSecond'], results[key]['peakRssKB'])
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    oFile = open(resultFile, 'w')
+    json.dump(dict([('python', platform.python_version()), ('machine', platform.machine()),
+                    ('date', time.strftime("%Y-%m-%d %H:%M:%S")), ('results', results)]), oFile, indent=1, sort_keys=True)
+    oFile.close()
+    return(results)
+
+def compareResults(baseline, results, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare benchmark results with a baseline and return the list of the
+    regressions, as strings. A regression is a loss of throughput or a
+    gain of peak memory larger than the tolerance.
+
+    Keyword arguments:
+    baseline -- the dictionary of results of the baseline
+    results -- the dictionary of results to compare
+    tolerance -- the accepted relative difference
+    """
+    regressions = list()
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        for (measure, higherIsBetter) in (('linesPerSecond', True), ('basesPerSecond', True), ('peakRssKB', False)):
+            before = float(baseline[key][measure])
+            after = float(results[key][measure])
+            if before <= 0:
+                continue
+            change = (after - before) / before
+            if (higherIsBetter and change < -tolerance) or (not higherIsBetter and change > tolerance):
+                regressions.append("%s %s: %.0f -> %.0f (%+.1f%%)" % (key, measure, before, after, 100 * change))
+    return(regressions)
+
+def extractArguments():
+    """
+    Extract argument values as input by user and return a tuple containing
+    the command and a dictionary with the options.
+
+    Keyword arguments:
+    none
+    """
+    usage = """usage: benchmarkMPileup.py generate -o <outputFile> [-n <lines>] [-d <depth>] [--indel-rate <rate>] [--start-rate <rate>] [--end-rate <rate>] [--skip-rate <rate>] [--seed <seed>]
+       benchmarkMPileup.py run -o <resultFile> [-b <bases>] [--seed <seed>] [--function <parsePileup|extractCigarSeq>] [--configuration <name>]
+       benchmarkMPileup.py compare -b <baselineFile> -r <resultFile> [--tolerance <fraction>]"""
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("generate", "run", "compare"):
+        print usage
+        sys.exit(2)
+    command = sys.argv[1]
+
+    try:
+        opts, arg = getopt.getopt(sys.argv[2:], "ho:n:d:b:r:", ["help", "indel-rate=", "start-rate=", "end-rate=", "skip-rate=",
+                                                               "seed=", "function=", "configuration=", "tolerance="])
+    except getopt.GetoptError:
+        print usage
+        sys.exit(2)
+
+    options = dict([('lines', 10000), ('depth', 30), ('indelRate', 0.01), ('startRate', 0.02), ('endRate', 0.02),
+                    ('skipRate', 0.0), ('seed', 1), ('tolerance', DEFAULT_TOLERANCE), ('functions', list()), ('names', None)])
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print usage
+                sys.exit(0)
+            elif opt == "-o":
+                options['outputFile'] = arg
+            elif opt == "-n":
+                options['lines'] = int(arg)
+            elif opt == "-d":
+                options['depth'] = int(arg)
+            elif opt == "-b" and command == "compare":
+                options['baselineFile'] = arg
+            elif opt == "-b":
+                options['bases'] = int(arg)
+            elif opt == "-r":
+                options['resultFile'] = arg
+            elif opt in ("--indel-rate", "--start-rate", "--end-rate", "--skip-rate"):
+                options[opt[2:].split("-")[0] + "Rate"] = float(arg)
+            elif opt == "--seed":
+                options['seed'] = int(arg)
+            elif opt == "--function":
+                if arg not in FUNCTIONS:
+                    print usage
+                    sys.exit(2)
+                options['functions'].append(arg)
+            elif opt == "--configuration":
+                options['names'] = (options['names'] or list()) + [arg]
+            elif opt == "--tolerance":
+                options['tolerance'] = float(arg)
+    except ValueError:
+        print usage
+        sys.exit(2)
+
+    required = dict([('generate', ('outputFile',)), ('run', ('outputFile',)), ('compare', ('baselineFile', 'resultFile'))])
+    for name in required[command]:
+        if name not in options:
+            print usage
+            sys.exit(2)
+    return(command, options)
+
+if __name__ == "__main__":
+
+    if len(sys.argv) == 5 and sys.argv[1] == "run-one":
+        ## Internal command used to measure a function in a new process
+        seconds = runFunction(sys.argv[2], sys.argv[3], sys.argv[4])
+        print json.dumps(dict([('seconds', seconds), ('peakRssKB', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)]))
+        sys.exit(0)
+
+    (command, options) = extractArguments()
+    if command == "generate":
+        oFile = open(options['outputFile'], 'w')
+        generatePileup(oFile, options['lines'], options['depth'], options['indelRate'], options['startRate'],
+                       options['endRate'], options['skipRate'], options['seed'])
+        oFile.close()
+    elif command == "run":
+        runBenchmarks(options['outputFile'], options['functions'] or ("parsePileup",), options.get('bases', DEFAULT_BASES),
+                      options['seed'], options['names'])
+    else:
+        baseline = json.load(open(options['baselineFile']))['results']
+        results = json.load(open(options['resultFile']))['results']
+        regressions = compareResults(baseline, results, options['tolerance'])
+        for regression in regressions:
+            print "REGRESSION " + regression
+        if len(regressions) > 0:
+            sys.exit(1)
+        print "No regression"
@@ -13,14 +13,187 @@
 ## IMPORT
 ##################
 
+import os
+import io
 import sys
+import time
+import cProfile
 import getopt
+import re
+import zlib
+import gzip
+import struct
+import json
+import collections
+import itertools
+import bisect
+import hashlib
+import shutil
+import numpy
+import multiprocessing
+import threading
+import resource
+import Queue
+from multiprocessing.pool import ThreadPool
+from cStringIO import StringIO
 from re import split
 from re import match
+from stat import S_ISREG
+
+##################
+## CONSTANTS
+##################
+
+## Order of the alleles in the count arrays, the code of an allele is its index
+ALLELES = ('A', 'C', 'G', 'T', 'O', 'N')
+ALLELE_INDEX = dict([(letter, code) for code, letter in enumerate(ALLELES)])
+
+## Special codes used by the vectorized decoder
+REF_CODE = 6
+SKIP_CODE = 7
+INVALID_CODE = 255
+
+## Offset used to obtain the Phred and MPAQ values
+ASCII_OFFSET = 33
+
+## Number of columns of each sample of the pileup lines, without or with
+## the positions of the bases in the reads
+SAMPLE_WIDTHS = (4, 5)
+
+## Number of pileup lines decoded together
+BLOCK_SIZE = 10000
+
+## Maximum size, in bytes, of the pileup lines decoded together, a block
+## exceeds it only by its last line
+BLOCK_BYTES = 4 * 1024 * 1024
+
+## Number of bases decoded together when a block contains more bases, the
+## slices are merged into a histogram so the memory does not grow with the depth
+SLICE_BASES = 128 * 1024
+
+## Maximum number of blocks waiting between two stages of the pipelined mode
+QUEUE_SIZE = 4
+
+## Approximate size, in bytes, of the input chunks parsed by each process
+CHUNK_SIZE = 32 * 1024 * 1024
+
+## Number of lines of the input chunks when the input file cannot be split
+CHUNK_LINES = 100000
+
+## Size, in bytes, of the reads done on compressed input files
+READ_SIZE = 1024 * 1024
+
+## Size, in bytes, of the formatted text kept by the text outputs before it
+## is written, with a single write for each output file
+WRITE_BUFFER_SIZE = 16 * 1024 * 1024
+
+## First bytes of gzip and bgzip files
+GZIP_MAGIC = "\x1f\x8b"
+
+## Compressions available for the output files
+COMPRESSIONS = ("gzip", "bgzip")
+
+## Extension of the index of the input files and number of positions of each indexed block
+INDEX_EXTENSION = ".pidx"
+INDEX_BLOCK_SIZE = 10000
+
+## Number of input bytes parsed between two checkpoints and extension of
+## the checkpoint file added to the output prefix
+CHECKPOINT_SIZE = 256 * 1024 * 1024
+CHECKPOINT_EXTENSION = ".checkpoint.json"
+
+## Extension and version of the file recording the ranges covered by the
+## outputs, used to append new pileup lines to them
+RANGES_EXTENSION = ".ranges.json"
+RANGES_VERSION = 2
+
+## Stages timed and events counted by Statistics
+STAGES = ('read', 'cache', 'split', 'decode', 'count', 'write')
+COUNTERS = ('lines', 'bases', 'indels', 'readStarts', 'readEnds', 'referenceSkips')
+
+## Version of the histogram cache, the entries of other versions are rebuilt
+CACHE_VERSION = 2
+
+## Number of values used to encode a Phred or a Mapq character in the histogram cache
+NB_QUALITIES = 256
+
+## Formats available for the output files
+OUTPUT_FORMATS = ("text", "columns")
+
+## Headers of the global file and of the threshold files, written when
+## the files are not separated
+TEXT_HEADER = "Chromosome\tPosition\tA\tC\tG\tT\tOther\tN\n"
+THRESHOLD_HEADER = "Chromosome\tPosition\tA\tC\tG\tT\n"
+
+## Columns written by ColumnOutput
+COLUMNS = ('chromosome', 'position', 'counts', 'thresholds')
+COLUMN_DTYPE = numpy.uint32
+## Maximal number of rows of the columns of another output copied at once,
+## so the memory-mapped columns of large outputs are not loaded in memory
+COPY_ROWS = 1024 * 1024
+
+## Size of the header of the .npy files written by ColumnOutput
+NPY_HEADER_SIZE = 128
+
+## Maximum size of the uncompressed data of a BGZF block
+BGZF_BLOCK_SIZE = 0xff00
+
+## Empty BGZF block marking the end of a bgzip file
+BGZF_EOF = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+## Maximum number of groups of BGZF blocks of an output file waiting to be
+## compressed by the compression threads, which bounds the memory of the
+## pending blocks
+COMPRESS_QUEUE_SIZE = 8
+
+## Default Phred and Mapq thresholds used for the threshold files
+DEFAULT_PHREDS = (15, 20, 30, 25)
+DEFAULT_MAPQS = (0, 1, 5, 10)
+
+## Lookup table converting each character of the read bases into an allele code
+BASE_CODES = numpy.full(256, INVALID_CODE, dtype=numpy.uint8)
+for letter in ALLELES:
+    BASE_CODES[ord(letter)] = ALLELE_INDEX[letter]
+    BASE_CODES[ord(letter.lower())] = ALLELE_INDEX[letter]
+BASE_CODES[ord('.')] = REF_CODE
+BASE_CODES[ord(',')] = REF_CODE
+BASE_CODES[ord('<')] = SKIP_CODE
+BASE_CODES[ord('>')] = SKIP_CODE
+
+## Patterns used to remove the characters without Phred and Mapq values
+READ_START_PATTERN = re.compile(r"\^.", re.DOTALL)
+INDEL_PATTERN = re.compile(r"[+-](\d+)")
+
+## Characters of the simple columns, which only contain bases
+SIMPLE_BASES = ".,ACGTNO"
+
+## Translation table removing the ASCII offset from the quality characters
+QUALITY_OFFSET_TABLE = "".join([chr((i - ASCII_OFFSET) % 256) for i in range(256)])
+QUALITY_CHARACTERS = "".join([chr(i) for i in range(ASCII_OFFSET, 256)])
+
+## Translation tables marking the characters of each allele with a non-zero byte
+SELECTION_TABLES = dict([(letter, "".join([chr(int(chr(i) == letter)) for i in range(256)])) for letter in ALLELES])
+
+def extractThresholds(value):
+    """
+    Extract a list of thresholds from a comma separated string. Duplicated
+    thresholds are removed. A ValueError is raised when a threshold is not
+    an integer.
+
+    Keyword arguments:
+    value -- the comma separated string of thresholds
+    """
+    thresholds = list()
+    for threshold in value.split(","):
+        threshold = int(threshold)
+        if threshold not in thresholds:
+            thresholds.append(threshold)
+    return(tuple(thresholds))
 
 def extractArguments():
     """
-    Extract argument values as input by user.
+    Extract argument values as input by user. The extra options are
+    returned in a dictionary that can be passed to parsePileup.
 
     Keyword arguments:
     none
@@ -28,15 +201,46 @@ def extractArguments():
     
     inputFile = ''
     outputPrefix = ''
-    usage = 'usage: parsePileup.py -i <inputFile> -p <outputPrefix> [-s] [-h]'
+    usage = 'usage: parsePileup.py -i <inputFile> -p <outputPrefix> [-s] [-t <threads>] [-z <gzip|bgzip>] [-f <text|columns>] [-r <region>] [-b <bedFile>] [-x] [-c <cacheDir>] [--rebuild-cache] [--cache-limit <MB>] [--pipeline] [--queue-size <blocks>] [--memory] [--samples <number>] [--min-alt-count <count>] [--min-alt-fraction <fraction>] [--bin <size>] [--checkpoint <MB>] [--resume] [--append] [--stats <jsonFile>] [--progress <seconds>] [--profile <profileFile>] [--buffer-size <MB>] [--compress-threads <number>] [--phred <thresholds>] [--mapq <thresholds>] [-h]'
     
     ## Valid arguments are:
-    ## -i or --ifile for the input file
+    ## -i or --ifile for the input file, "-" for the standard input
     ## -p or --pfile for the prefix of the output file
     ## -s for the creation of separated files
+    ## -t or --threads for the number of processes
+    ## -z or --compress for the compression of the output files
+    ## -f or --format for the format of the output files
+    ## -r or --region for a region to parse, can be repeated
+    ## -b or --bed for a BED file containing the regions to parse
+    ## -x or --index to build the index of the input file
+    ## -c or --cache for the directory of the histogram cache
+    ## --rebuild-cache to rebuild the cache entry of the input file
+    ## --cache-limit for the maximum size of the cache, in MB
+    ## --pipeline to read, parse and write in concurrent stages
+    ## --queue-size for the number of blocks waiting between two stages
+    ## --memory to print the peak memory on the standard error
+    ## --samples for the number of samples of the pileup lines
+    ## --min-alt-count for the minimum number of non-reference bases of the written positions: non-reference bases >= count
+    ## --min-alt-fraction for the fraction of the depth exceeded by the non-reference bases of the written positions:
+    ##   non-reference bases > fraction * depth, with 0 <= fraction < 1
+    ## --bin for the size of the windows whose counts are written instead of the positions
+    ## --checkpoint for the size of input, in MB, parsed between two checkpoints
+    ## --resume to continue the parsing from the last checkpoint
+    ## --append to append the lines not covered by the existing outputs to them
+    ## --stats for the JSON file receiving the time of each stage and the counters of the parsing
+    ## --progress for the number of seconds between two progress lines printed on the standard error
+    ## --profile for the file receiving the cProfile statistics of the parsing
+    ## --buffer-size for the size, in MB, of the formatted text kept before being written
+    ## --compress-threads for the number of threads compressing the bgzip output files
+    ## --phred for the comma separated Phred thresholds
+    ## --mapq for the comma separated Mapq thresholds
     ## -h for help
     try:
-        opts, arg = getopt.getopt(sys.argv[1:], "hi:p:s", ["help", "ifile=", "pfile="])
+        opts, arg = getopt.getopt(sys.argv[1:], "hi:p:st:z:f:r:b:xc:", ["help", "ifile=", "pfile=", "threads=", "compress=", "format=", "region=", "bed=", "index",
+                                                                     "cache=", "rebuild-cache", "cache-limit=", "pipeline", "queue-size=", "memory", "samples=",
+                                                                     "min-alt-count=", "min-alt-fraction=", "bin=", "checkpoint=", "resume", "append",
+                                                                     "stats=", "progress=", "profile=", "buffer-size=", "compress-threads=",
+                                                                     "phred=", "mapq="])
     except getopt.GetoptError:
         print usage
         sys.exit(2)
@@ -49,6 +253,9 @@ def extractArguments():
         sys.exit(2)
     
     separatedFiles = False
+    options = dict([('phreds', DEFAULT_PHREDS), ('mapqs', DEFAULT_MAPQS)])
+    regions = list()
+    bedFile = None
     for opt, arg in opts:
         if opt in ("-h", "help"):
             print usage
@@ -59,44 +266,410 @@ def extractArguments():
             outputPrefix = arg
         elif opt in ("-s"):
             separatedFiles = True
+        elif opt in ("-t", "--threads"):
+            try:
+                options['threads'] = int(arg)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if options['threads'] < 1:
+                print usage
+                sys.exit(2)
+        elif opt in ("-z", "--compress"):
+            if arg not in COMPRESSIONS:
+                print usage
+                sys.exit(2)
+            options['compression'] = arg
+        elif opt in ("-f", "--format"):
+            if arg not in OUTPUT_FORMATS:
+                print usage
+                sys.exit(2)
+            options['outputFormat'] = arg
+        elif opt in ("-r", "--region"):
+            regions.append(arg)
+        elif opt in ("-b", "--bed"):
+            bedFile = arg
+        elif opt in ("-x", "--index"):
+            options['buildIndex'] = True
+        elif opt in ("-c", "--cache"):
+            options['cacheDir'] = arg
+        elif opt == "--rebuild-cache":
+            options['rebuildCache'] = True
+        elif opt == "--cache-limit":
+            try:
+                options['cacheLimit'] = int(float(arg) * 1024 * 1024)
+            except ValueError:
+                print usage
+                sys.exit(2)
+        elif opt == "--pipeline":
+            options['pipeline'] = True
+        elif opt == "--queue-size":
+            try:
+                options['queueSize'] = int(arg)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if options['queueSize'] < 1:
+                print usage
+                sys.exit(2)
+        elif opt == "--memory":
+            options['reportMemory'] = True
+        elif opt == "--samples":
+            try:
+                options['nbSamples'] = int(arg)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if options['nbSamples'] < 1:
+                print usage
+                sys.exit(2)
+        elif opt == "--min-alt-count":
+            try:
+                options['minAltCount'] = int(arg)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if options['minAltCount'] < 1:
+                print usage
+                sys.exit(2)
+        elif opt == "--min-alt-fraction":
+            try:
+                options['minAltFraction'] = float(arg)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if not 0.0 <= options['minAltFraction'] < 1.0:
+                print usage
+                sys.exit(2)
+        elif opt == "--bin":
+            try:
+                options['binSize'] = int(arg)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if options['binSize'] < 1:
+                print usage
+                sys.exit(2)
+        elif opt == "--checkpoint":
+            try:
+                options['checkpointSize'] = int(float(arg) * 1024 * 1024)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if options['checkpointSize'] < 1:
+                print usage
+                sys.exit(2)
+        elif opt == "--resume":
+            options['resume'] = True
+        elif opt == "--append":
+            options['append'] = True
+        elif opt == "--stats":
+            options['statsFile'] = arg
+        elif opt == "--progress":
+            try:
+                options['progressInterval'] = float(arg)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if options['progressInterval'] <= 0:
+                print usage
+                sys.exit(2)
+        elif opt == "--profile":
+            options['profileFile'] = arg
+        elif opt == "--buffer-size":
+            try:
+                options['bufferSize'] = int(float(arg) * 1024 * 1024)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if options['bufferSize'] < 0:
+                print usage
+                sys.exit(2)
+        elif opt == "--compress-threads":
+            try:
+                options['compressThreads'] = int(arg)
+            except ValueError:
+                print usage
+                sys.exit(2)
+            if options['compressThreads'] < 1:
+                print usage
+                sys.exit(2)
+        elif opt in ("--phred", "--mapq"):
+            try:
+                options[opt[2:] + "s"] = extractThresholds(arg)
+            except ValueError:
+                print usage
+                sys.exit(2)
+    
+    if options.get('outputFormat') == "columns" and 'compression' in options:
+        ## The columns are not compressed so they can be memory-mapped
+        print usage
+        sys.exit(2)
+    
+    if 'compressThreads' in options and options.get('compression') != "bgzip":
+        ## A gzip stream cannot be compressed by independent blocks
+        print usage
+        sys.exit(2)
+    
+    if 'binSize' in options and ('minAltCount' in options or 'minAltFraction' in options):
+        ## The windows are not filtered on their non-reference bases
+        print usage
+        sys.exit(2)
+    
+    if ('checkpointSize' in options or 'resume' in options) and (inputFile == "-" or options.get('compression') == "gzip" or
+                                                                  len(regions) > 0 or bedFile is not None or 'cacheDir' in options or
+                                                                  'pipeline' in options):
+        ## The checkpoints follow the byte offset of a plain input file and
+        ## continue the output files, which is not possible with gzip
+        print usage
+        sys.exit(2)
+    
+    if 'append' in options and (inputFile == "-" or options.get('compression') == "gzip" or len(regions) > 0 or bedFile is not None or
+                                'cacheDir' in options or 'checkpointSize' in options or 'resume' in options or 'binSize' in options):
+        ## The skipped lines are found by a first reading of a plain input
+        ## file and the output files are continued, which is not possible
+        ## with gzip or with the window pending at the end of binned outputs
+        print usage
+        sys.exit(2)
+    
+    if len(regions) > 0 or bedFile is not None:
+        try:
+            options['regions'] = extractRegions(regions, bedFile)
+        except ValueError as e:
+            print e
+            print usage
+            sys.exit(2)
          
     print 'Input file is "', inputFile, '"'
     print 'Output prefix file is "', outputPrefix, '"'
-    return(inputFile, outputPrefix, separatedFiles)
+    return(inputFile, outputPrefix, separatedFiles, options)
+
+
+class GzipReader(object):
+    """
+    Iterate on the lines of a gzip or bgzip stream. The stream is
+    decompressed by pieces so it does not need to be seekable and
+    concatenated gzip members, as found in bgzip files, are supported.
+    """
+    
+    def __init__(self, fileobj, head=""):
+        """
+        Keyword arguments:
+        fileobj -- the compressed file pointer
+        head    -- the first bytes of the stream already read from fileobj
+        """
+        self.fileobj = fileobj
+        self.head = head
+    
+    def __iter__(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = ""
+        data = self.head
+        while True:
+            if not data:
+                data = self.fileobj.read(READ_SIZE)
+                if not data:
+                    break
+            text = decompressor.decompress(data)
+            data = decompressor.unused_data
+            if data:
+                ## Beginning of the next gzip member
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if text:
+                lines = (pending + text).split("\n")
+                pending = lines.pop()
+                for line in lines:
+                    yield line + "\n"
+        if pending:
+            yield pending
+    
+    def close(self):
+        self.fileobj.close()
+
+class BgzfWriter(object):
+    """
+    Write data in the BGZF format used by bgzip. The data is compressed by
+    independent blocks so the file can be read by gzip and indexed by tabix.
+    When a thread pool is given, the blocks are compressed by its threads,
+    zlib releasing the GIL, and written in their order.
+    """
+    
+    def __init__(self, fileobj, pool=None):
+        """
+        Keyword arguments:
+        fileobj -- the file pointer receiving the compressed blocks
+        pool -- the ThreadPool compressing the blocks, None to compress them in the calling thread
+        """
+        self.fileobj = fileobj
+        self.pool = pool
+        self.buffer = list()
+        self.bufferSize = 0
+        ## Blocks sent to the pool, in the order of the file
+        self.compressed = collections.deque()
+    
+    def write(self, data):
+        self.buffer.append(data)
+        self.bufferSize += len(data)
+        if self.bufferSize >= BGZF_BLOCK_SIZE:
+            data = "".join(self.buffer)
+            end = len(data) - len(data) % BGZF_BLOCK_SIZE
+            self.writeBlocks(data[:end])
+            self.buffer = [data[end:]]
+            self.bufferSize = len(data) - end
+    
+    def writeBlocks(self, data):
+        """
+        Compress data into blocks and write them, or send them to the pool
+        as a single task. The blocks already compressed by the pool are
+        written.
+
+        Keyword arguments:
+        data -- the uncompressed data, whose size is a multiple of BGZF_BLOCK_SIZE except for the last block
+        """
+        if self.pool is None:
+            self.fileobj.write(compressBgzfBlocks(data))
+            return
+        compressed = self.compressed
+        compressed.append(self.pool.apply_async(compressBgzfBlocks, (data,)))
+        while len(compressed) > COMPRESS_QUEUE_SIZE or (compressed and compressed[0].ready()):
+            self.fileobj.write(compressed.popleft().get())
+    
+    def flush(self):
+        if self.bufferSize > 0:
+            self.writeBlocks("".join(self.buffer))
+            self.buffer = list()
+            self.bufferSize = 0
+        while self.compressed:
+            self.fileobj.write(self.compressed.popleft().get())
+        self.fileobj.flush()
+    
+    def close(self):
+        self.flush()
+        self.fileobj.write(BGZF_EOF)
+        self.fileobj.close()
+
+def compressBgzfBlocks(data):
+    """
+    Compress data into consecutive BGZF blocks and return the blocks.
+
+    Keyword arguments:
+    data -- the uncompressed data
+    """
+    return("".join([compressBgzfBlock(data[start:start + BGZF_BLOCK_SIZE]) for start in xrange(0, len(data), BGZF_BLOCK_SIZE)]))
 
+def compressBgzfBlock(data):
+    """
+    Compress data into a BGZF block and return the block.
+
+    Keyword arguments:
+    data -- the uncompressed data, at most BGZF_BLOCK_SIZE bytes
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    ## The BC extra field contains the size of the whole block minus one
+    header = struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+    trailer = struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+    return(header + deflated + trailer)
+
+def is_plain_file(inputfile):
+    """
+    Return True when the file is a regular file not compressed with gzip or
+    bgzip, which can be split and read again from any byte offset. The
+    standard input, pipes and other special files are not read, so none of
+    their bytes are consumed.
+    An IOError is raised when the file cannot be opened.
+    
+    Keyword arguments:
+    inputfile -- the name of the input file, "-" for the standard input
+    """
+    if inputfile == "-":
+        return(False)
+    try:
+        if not S_ISREG(os.stat(inputfile).st_mode):
+            return(False)
+        input_file = open(inputfile, 'rb')
+    except (IOError, OSError):
+        raise IOError("Cannot open file : %s \n\n" % (inputfile))
+    head = input_file.read(len(GZIP_MAGIC))
+    input_file.close()
+    return(head != GZIP_MAGIC)
 
 def open_read_file(inputfile):
     """
-    Open reading file and return file pointer.
+    Open reading file and return file pointer. The standard input is read
+    when the name is "-". Files compressed with gzip or bgzip are detected
+    and decompressed. The file is opened once and its first bytes are
+    peeked, so pipes can be read.
     An IOError is raised when the file cannot be opened.
     
     Keyword arguments:
-    inputfile -- the name of the input file
+    inputfile -- the name of the input file, "-" for the standard input
     """
-    try:    
-        input_file = open(inputfile, 'r')
-    except IOError:                     
+    try:
+        if inputfile == "-":
+            input_file = io.open(sys.stdin.fileno(), 'rb', closefd=False)
+        else:
+            input_file = io.open(inputfile, 'rb')
+    except (IOError, OSError):
         raise IOError("Cannot open file : %s \n\n" % (inputfile))
+    ## A buffered reader is used so the first bytes can be peeked
+    if input_file.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        input_file = GzipReader(input_file)
     return(input_file)
            
-def open_write_file(outputFile):
+def open_write_file(outputFile, compression=None, offset=None, pool=None):
     """
-    Open writing file and return file pointer.
+    Open writing file and return file pointer. When an offset is given,
+    the existing file is truncated at the offset and the writing continues
+    from there, which is not possible with gzip.
     An IOError is raised when the file cannot be opened.
     
     Keyword arguments:
     outputFile -- the name of the output file
+    compression -- the compression of the output file, None, "gzip" or "bgzip"
+    offset -- the size of the existing file to keep, None to create a new file
+    pool -- the ThreadPool compressing the blocks of a bgzip file, None to compress them in the calling thread
     """
+    if offset is not None and compression == "gzip":
+        raise IOError("Cannot continue gzip file : %s \n\n" % (outputFile))
     try:    
-        output_file = open(outputFile, 'w')
+        if offset is not None:
+            output_file = open(outputFile, 'r+b')
+            output_file.truncate(offset)
+            output_file.seek(offset)
+            if compression == "bgzip":
+                output_file = BgzfWriter(output_file, pool)
+        elif compression == "gzip":
+            output_file = gzip.open(outputFile, 'wb')
+        elif compression == "bgzip":
+            output_file = BgzfWriter(open(outputFile, 'wb'), pool)
+        else:
+            output_file = open(outputFile, 'w')
     except IOError:                     
         raise IOError("Cannot open file : %s \n\n" % (outputFile))
     return(output_file)
+
+def syncOutputFile(outputFile):
+    """
+    Write the buffered content of an output file on the disk and return
+    the size of the file. The pending data of a bgzip file are written as
+    a block of their own.
+
+    Keyword arguments:
+    outputFile -- the file pointer returned by open_write_file, not gzip
+    """
+    outputFile.flush()
+    if isinstance(outputFile, BgzfWriter):
+        outputFile = outputFile.fileobj
+    os.fsync(outputFile.fileno())
+    return(outputFile.tell())
       
 def extractCigarSeq(sequence, phred, mapq, info):
     """
-    Open writing file and return file pointer.
-    An IOError is raised when the file cannot be opened.
+    Extract the (Phred, Mapq) tuples of each allele from the read bases of
+    a position and return a dictionary containing the list of tuples of
+    each allele. Simple columns, which only contain bases, are aligned
+    directly to the quality strings; the other columns are tokenized.
         
     Keyword arguments:
     sequence -- the read bases aligned at a specific position
@@ -106,13 +679,51 @@ def extractCigarSeq(sequence, phred, mapq, info):
     """
         
     ref = info['ref']
+    sequence = sequence.upper()
+    
+    ## Columns with a character other than a base, or with missing or invalid qualities, are tokenized
+    length = len(sequence)
+    if sequence.translate(None, SIMPLE_BASES) or len(phred) < length or len(mapq) < length or \
+       phred[:length].translate(None, QUALITY_CHARACTERS) or mapq[:length].translate(None, QUALITY_CHARACTERS):
+        return(tokenizeCigarSeq(sequence, phred, mapq, ref))
+    
+    letters = dict([('A', list()), ('C', list()), ('G', list()), ('T', list()), ('N', list()), ('O', list())])
+    if "." in sequence or "," in sequence:
+        if ref not in letters:
+            raise KeyError(ref)
+        sequence = sequence.replace(".", ref).replace(",", ref)
+    
+    ## The qualities are aligned to the bases and each allele is selected in bulk,
+    ## extra characters (as the end of line) of the qualities are ignored
+    pairs = zip(bytearray(phred[:length].translate(QUALITY_OFFSET_TABLE)), bytearray(mapq[:length].translate(QUALITY_OFFSET_TABLE)))
+    for letter in letters:
+        count = sequence.count(letter)
+        if count == 0:
+            continue
+        elif count == length:
+            letters[letter] = pairs
+        else:
+            letters[letter] = list(itertools.compress(pairs, bytearray(sequence.translate(SELECTION_TABLES[letter]))))
+    
+    return(letters)
+
+def tokenizeCigarSeq(sequence, phred, mapq, ref):
+    """
+    Tokenize the upper case read bases of a position and return a dictionary
+    containing the list of (Phred, Mapq) tuples of each allele. Indels are
+    added to the "O" allele with (-1, -1) values.
+        
+    Keyword arguments:
+    sequence -- the upper case read bases aligned at a specific position
+    phred    -- the base qualities for the same position
+    mapq     -- the map qualities for the same position
+    ref      -- the reference base
+    """
     
     ## The dictionary that is going to contain all (Phred score, MPAQ) tuple for each base of the sequence
     letters = dict([('A', list()), ('C', list()), ('G', list()), ('T', list()), ('N', list()), ('O', list())])
     lettersKeys = letters.keys()
     
-    sequence = sequence.upper()
-    
     ## Offset used to obtain the Phred and MPAQ values
     asciiOffset = 33
     
@@ -138,7 +749,8 @@ def extractCigarSeq(sequence, phred, mapq, info):
             positionMapq += 1
         elif currentData == "+" or currentData == "-":
             letters['O'].append((-1, -1))
-            res = match(r"[+-](\d+)", sequence[positionSeq:len(sequence)])
+            ## The match starts at the current position, the rest of the sequence is not copied
+            res = INDEL_PATTERN.match(sequence, positionSeq)
             indelLength = res.groups()[0]
             positionSeq = positionSeq + 1 + len(indelLength) + int(indelLength)
             ## Not change in positionPhred because there is not Phred value for an indel
@@ -169,75 +781,2461 @@ def extractCigarSeq(sequence, phred, mapq, info):
             sys.exit(2)
     
     return(letters)
+
+def cleanCigarSeq(sequence):
+    """
+    Remove from the read bases all characters that do not have a Phred and
+    a Mapq value (start and end of reads, indels and deletion shadows) and
+    return a tuple containing the cleaned sequence and the number of indels.
+
+    Keyword arguments:
+    sequence -- the read bases aligned at a specific position
+    """
+    nbIndels = 0
+    
+    ## The Mapq character following "^" can be any character, so it must be removed first
+    if "^" in sequence:
+        sequence = READ_START_PATTERN.sub("", sequence)
+    
+    if "+" in sequence or "-" in sequence:
+        pieces = list()
+        positionSeq = 0
+        for res in INDEL_PATTERN.finditer(sequence):
+            ## The inserted or deleted bases do not contain "+" or "-" so the
+            ## next match always starts after the end of the current indel
+            pieces.append(sequence[positionSeq:res.start()])
+            positionSeq = res.end() + int(res.group(1))
+            nbIndels += 1
+        pieces.append(sequence[positionSeq:])
+        sequence = "".join(pieces)
     
-def parsePileup(inputFile, outputPrefix, separatedFiles):
+    if "$" in sequence or "*" in sequence:
+        sequence = sequence.translate(None, "$*")
+    
+    return(sequence, nbIndels)
+
+def cleanPileupColumns(sequences, phreds, mapqs):
     """
-    Extract argument values as input by user.
+    Clean a block of pileup columns with cleanCigarSeq and return a tuple
+    containing the cleaned read bases, the base qualities and the map
+    qualities of all columns, each joined in a single string, followed by
+    the number of bases and the number of indels of each column.
 
     Keyword arguments:
-    inputFile -- the name of the input file
-    outputPrefix -- the prefix of the output files
-    separatedFiles -- an boolean indicating if the position file should be created separately
+    sequences -- the read bases of each column
+    phreds    -- the base qualities of each column
+    mapqs     -- the map qualities of each column
     """
+    nbColumns = len(sequences)
     
-    ## Open input file
-    iFile = open_read_file(inputFile)
+    cleanedSeqs = list()
+    cleanedPhreds = list()
+    cleanedMapqs = list()
+    lengths = numpy.empty(nbColumns, dtype=numpy.intp)
+    indels = numpy.empty(nbColumns, dtype=numpy.int64)
+    
+    for i in xrange(nbColumns):
+        (sequence, nbIndels) = cleanCigarSeq(sequences[i])
+        length = len(sequence)
+        phred = phreds[i]
+        mapq = mapqs[i]
+        ## Extra characters (as the end of line) are ignored
+        if len(phred) != length:
+            phred = phred[:length]
+        if len(mapq) != length:
+            mapq = mapq[:length]
+        if len(phred) != length or len(mapq) != length:
+            print("Problem with quality strings: " + phreds[i] + " " + mapqs[i])
+            print("in this cigar string: " + sequences[i].upper())
+            sys.exit(2)
+        cleanedSeqs.append(sequence)
+        cleanedPhreds.append(phred)
+        cleanedMapqs.append(mapq)
+        lengths[i] = length
+        indels[i] = nbIndels
+    
+    return("".join(cleanedSeqs), "".join(cleanedPhreds), "".join(cleanedMapqs), lengths, indels)
+
+def decodeCleanedBases(cleaned, sequences, refs, start, end):
+    """
+    Decode the bases located between two offsets of the cleaned columns and
+    return a tuple containing the allele codes, the Phred values, the Mapq
+    values and the index of the column of each base. Bases from reference
+    skips are not returned.
+
+    Keyword arguments:
+    cleaned   -- the tuple returned by cleanPileupColumns
+    sequences -- the read bases of each column, used in the error messages
+    refs      -- the reference base of each column
+    start     -- the offset of the first decoded base
+    end       -- the offset following the last decoded base
+    """
+    (cleanedSeq, cleanedPhred, cleanedMapq, lengths, indels) = cleaned
+    
+    alleles = BASE_CODES[numpy.frombuffer(cleanedSeq[start:end], dtype=numpy.uint8)]
+    phredValues = numpy.frombuffer(cleanedPhred[start:end], dtype=numpy.uint8).astype(numpy.int16) - ASCII_OFFSET
+    mapqValues = numpy.frombuffer(cleanedMapq[start:end], dtype=numpy.uint8).astype(numpy.int16) - ASCII_OFFSET
+    
+    ## Only the columns overlapping the offsets are considered
+    ends = numpy.cumsum(lengths)
+    first = numpy.searchsorted(ends, start, side='right')
+    last = max(first, min(numpy.searchsorted(ends, end - 1, side='right') + 1, len(lengths)))
+    sliceLengths = numpy.minimum(ends[first:last], end) - numpy.maximum(ends[first:last] - lengths[first:last], start)
+    columns = numpy.repeat(numpy.arange(first, last), sliceLengths)
+    
+    invalid = numpy.flatnonzero(alleles == INVALID_CODE)
+    if len(invalid) > 0:
+        print("Problem with letter: " + cleanedSeq[start + invalid[0]].upper())
+        print("in this cigar string: " + sequences[columns[invalid[0]]].upper())
+        sys.exit(2)
+    
+    isRef = alleles == REF_CODE
+    if isRef.any():
+        refCodes = numpy.array([ALLELE_INDEX.get(ref, INVALID_CODE) for ref in refs[first:last]], dtype=numpy.uint8)
+        alleles[isRef] = refCodes[columns[isRef] - first]
+        missing = numpy.flatnonzero(alleles == INVALID_CODE)
+        if len(missing) > 0:
+            raise KeyError(refs[columns[missing[0]]])
+    
+    isSkip = alleles == SKIP_CODE
+    if isSkip.any():
+        keep = ~isSkip
+        alleles = alleles[keep]
+        phredValues = phredValues[keep]
+        mapqValues = mapqValues[keep]
+        columns = columns[keep]
+    
+    return(alleles, phredValues, mapqValues, columns)
+
+def decodePileupColumns(sequences, phreds, mapqs, refs):
+    """
+    Decode a block of pileup columns into NumPy arrays and return a tuple
+    containing the allele codes, the Phred values, the Mapq values and the
+    index of the column of each base, followed by the number of indels of
+    each column. Bases from reference skips are not returned.
+    The allele codes follow the order of ALLELES.
+
+    Keyword arguments:
+    sequences -- the read bases of each column
+    phreds    -- the base qualities of each column
+    mapqs     -- the map qualities of each column
+    refs      -- the reference base of each column
+    """
+    cleaned = cleanPileupColumns(sequences, phreds, mapqs)
+    return(decodeCleanedBases(cleaned, sequences, refs, 0, len(cleaned[0])) + (cleaned[4],))
+
+def decodePileupBlock(sequences, phreds, mapqs, refs, sliceSize=SLICE_BASES):
+    """
+    Decode a block of pileup columns and return a tuple containing the tuple
+    returned by decodePileupColumns and the number of bases of each decoded
+    value, None when each value is a single base. Blocks with more than
+    sliceSize bases are decoded by slices merged into a histogram, each
+    distinct column, allele, Phred and Mapq combination being decoded once,
+    so the memory used does not grow with the depth of the columns.
+
+    Keyword arguments:
+    sequences -- the read bases of each column
+    phreds    -- the base qualities of each column
+    mapqs     -- the map qualities of each column
+    refs      -- the reference base of each column
+    sliceSize -- the maximum number of bases decoded together
+    """
+    cleaned = cleanPileupColumns(sequences, phreds, mapqs)
+    nbBases = len(cleaned[0])
+    if nbBases <= sliceSize:
+        return(decodeCleanedBases(cleaned, sequences, refs, 0, nbBases) + (cleaned[4],), None)
+    
+    ## The distinct keys of each slice are counted, then merged once
+    sliceKeys = list()
+    sliceCounts = list()
+    for start in xrange(0, nbBases, sliceSize):
+        (alleles, phredValues, mapqValues, columns) = decodeCleanedBases(cleaned, sequences, refs, start, min(start + sliceSize, nbBases))
+        keys = columns.astype(numpy.int64) * len(ALLELES) + alleles
+        keys = (keys * NB_QUALITIES + phredValues + ASCII_OFFSET) * NB_QUALITIES + mapqValues + ASCII_OFFSET
+        (keys, counts) = numpy.unique(keys, return_counts=True)
+        sliceKeys.append(keys)
+        sliceCounts.append(counts)
+    (keys, inverse) = numpy.unique(numpy.concatenate(sliceKeys), return_inverse=True)
+    weights = numpy.bincount(inverse, weights=numpy.concatenate(sliceCounts)).astype(numpy.int64)
     
-    ## Open global output file
-    oFile = open_write_file(outputPrefix + ".txt")
+    mapqValues = (keys % NB_QUALITIES).astype(numpy.int16) - ASCII_OFFSET
+    phredValues = (keys // NB_QUALITIES % NB_QUALITIES).astype(numpy.int16) - ASCII_OFFSET
+    alleles = (keys // (NB_QUALITIES * NB_QUALITIES) % len(ALLELES)).astype(numpy.uint8)
+    columns = (keys // (NB_QUALITIES * NB_QUALITIES * len(ALLELES))).astype(numpy.intp)
+    return((alleles, phredValues, mapqValues, columns, cleaned[4]), weights)
+
+def countAlleles(decoded, nbColumns, weights=None):
+    """
+    Return an array with the number of A, C, G, T, Other and N for each column,
+    following the order of ALLELES. Indels are counted as Other.
+
+    Keyword arguments:
+    decoded   -- the tuple returned by decodePileupColumns
+    nbColumns -- the number of decoded columns
+    weights   -- the number of bases of each decoded value, None when each value is a single base
+    """
+    (alleles, phredValues, mapqValues, columns, indels) = decoded
+    if weights is None:
+        counts = numpy.bincount(columns * len(ALLELES) + alleles, minlength=nbColumns * len(ALLELES))
+    else:
+        counts = numpy.bincount(columns * len(ALLELES) + alleles, weights=weights, minlength=nbColumns * len(ALLELES)).astype(numpy.int64)
+    counts = counts.reshape((nbColumns, len(ALLELES)))
+    counts[:, ALLELE_INDEX['O']] += indels
+    return(counts)
+
+def countThresholds(decoded, nbColumns, phreds, mapqs, weights=None):
+    """
+    Return an array with the number of A, C, G and T for each column and
+    each combination of Phred and Mapq thresholds, considering only bases
+    with a Phred value lower than the Phred threshold and a Mapq value lower
+    than the Mapq threshold. The shape of the array is
+    (nbColumns, len(phreds), len(mapqs), 4).
     
-    if not separatedFiles:
-        ## Write header when no separated file is created
-        oFile.write("Chromosome\tPosition\tA\tC\tG\tT\tOther\tN\n")
+    The Phred and Mapq values are first binned between the sorted thresholds
+    to build a small Phred x Mapq grid for each allele of each column. The
+    counts of all thresholds are then obtained from the cumulative sums of
+    the grids.
+
+    Keyword arguments:
+    decoded   -- the tuple returned by decodePileupColumns
+    nbColumns -- the number of decoded columns
+    phreds    -- the Phred value thresholds
+    mapqs     -- the Mapq value thresholds
+    weights   -- the number of bases of each decoded value, None when each value is a single base
+    """
+    (alleles, phredValues, mapqValues, columns, indels) = decoded
+    sortedPhreds = numpy.unique(phreds)
+    sortedMapqs = numpy.unique(mapqs)
+    nbPhreds = len(sortedPhreds)
+    nbMapqs = len(sortedMapqs)
+    
+    ## Bin i contains the values between the thresholds i-1 and i, the
+    ## values greater or equal to the highest threshold are never counted
+    phredBins = numpy.searchsorted(sortedPhreds, phredValues, side='right')
+    mapqBins = numpy.searchsorted(sortedMapqs, mapqValues, side='right')
+    selected = (alleles < 4) & (phredBins < nbPhreds) & (mapqBins < nbMapqs)
+    
+    index = ((columns[selected] * 4 + alleles[selected]) * nbPhreds + phredBins[selected]) * nbMapqs + mapqBins[selected]
+    if weights is None:
+        grids = numpy.bincount(index, minlength=nbColumns * 4 * nbPhreds * nbMapqs)
     else:
-        ## Open separated file to contain information about position
-        posFile = open_write_file(outputPrefix + "_pos.txt")
+        grids = numpy.bincount(index, weights=weights[selected], minlength=nbColumns * 4 * nbPhreds * nbMapqs).astype(numpy.int64)
+    grids = grids.reshape((nbColumns, 4, nbPhreds, nbMapqs))
+    grids = grids.cumsum(axis=2).cumsum(axis=3)
+    
+    phredIndex = numpy.searchsorted(sortedPhreds, phreds)
+    mapqIndex = numpy.searchsorted(sortedMapqs, mapqs)
+    counts = grids[:, :, phredIndex, :][:, :, :, mapqIndex]
+    return(counts.transpose((0, 2, 3, 1)))
+
+def formatRows(counts, locations=None):
+    """
+    Return the text of the rows of a block of positions. The whole block is
+    formatted in a single operation instead of one operation for each row.
+
+    Keyword arguments:
+    counts -- a two dimensional array with the counts of each position
+    locations -- the "chromosome<tab>position<tab>" text of each position, None to write only the counts
+    """
+    (nbRows, nbCounts) = counts.shape
+    rowFormat = "\t".join(["%d"] * nbCounts) + "\n"
+    if locations is None:
+        return((rowFormat * nbRows) % tuple(counts.ravel().tolist()))
+    values = numpy.empty((nbRows, nbCounts + 1), dtype=object)
+    values[:, 0] = locations
+    values[:, 1:] = counts
+    return((("%s" + rowFormat) * nbRows) % tuple(values.ravel().tolist()))
+
+class TextOutput(object):
+    """
+    Write the counts of each position in the text output files: the global
+    file, the position file when the files are separated and one file for
+    each combination of Phred and Mapq thresholds. When no prefix is given,
+    the content of the files is kept in memory and returned by getChunk.
+    The text of each file is formatted by block and buffered, so each file
+    receives a single write when the buffer is full.
+    """
     
-    oExtraFile = dict()
-    for phred in (15, 20, 30, 25):
-        for mapq in (0, 1, 5, 10):
-            oExtraFile[str(phred) + str(mapq)] = open_write_file(outputPrefix + "_" + str(phred) + "_" + str(mapq) + ".txt")
-            if not separatedFiles:
-                ## Header only present when files are not separated
-                oExtraFile[str(phred) + str(mapq)].write("Chromosome\tPosition\tA\tC\tG\tT\n")
+    def __init__(self, separatedFiles, phreds, mapqs, outputPrefix=None, compression=None, header=True, state=None,
+                 bufferSize=WRITE_BUFFER_SIZE, compressionPool=None):
+        """
+        Keyword arguments:
+        separatedFiles -- an boolean indicating if the position file should be created separately
+        phreds -- the Phred value thresholds
+        mapqs -- the Mapq value thresholds
+        outputPrefix -- the prefix of the output files, None to keep the content in memory
+        compression -- the compression of the output files, None, "gzip" or "bgzip"
+        header -- an boolean indicating if the headers should be written, when the files are not separated
+        state -- the dictionary returned by getState to continue the existing files, None to create new files
+        bufferSize -- the number of bytes of formatted text kept before being written, 0 to write each block
+        compressionPool -- the ThreadPool compressing the blocks of the bgzip files, None to compress them in the calling thread
+        """
+        self.separatedFiles = separatedFiles
+        self.phreds = phreds
+        self.mapqs = mapqs
+        self.bufferSize = bufferSize
+        ## Formatted text waiting to be written in each file
+        self.pending = dict()
+        self.pendingSize = 0
         
-    for line in iFile:
-        data = split("\t", line)
-        info = dict([('chr', data[0]), ('pos', data[1]), ('ref', data[2]), ('NB', data[3])])
-        lettersCount = extractCigarSeq(data[4], data[5], data[6], info);
+        extension = ".txt"
+        if compression is not None:
+            extension = ".txt.gz"
+        
+        if outputPrefix is None:
+            self.oFile = StringIO()
+            self.posFile = StringIO()
+            self.oExtraFile = dict([((phred, mapq), StringIO()) for phred in phreds for mapq in mapqs])
+            return
         
-        ## Write information for all based aligned
+        offsets = dict()
+        if state is not None:
+            ## The headers are already written in the continued files
+            offsets = state['offsets']
+            header = False
+        
+        ## Open global output file
+        self.oFile = open_write_file(outputPrefix + extension, compression, offsets.get("global"), compressionPool)
+        
+        self.posFile = None
         if not separatedFiles:
-            oFile.write("%s\t%s\t%d\t%d\t%d\t%d\t%d\t%d\n" % (info['chr'], info['pos'], len(lettersCount['A']), len(lettersCount['C']), len(lettersCount['G']), len(lettersCount['T']), len(lettersCount['O']), len(lettersCount['N'])))
+            ## Write header when no separated file is created
+            if header:
+                self.oFile.write(TEXT_HEADER)
         else:
-            posFile.write("%s\t%s\n" % (info['chr'], info['pos']))
-            oFile.write("%d\t%d\t%d\t%d\t%d\t%d\n" % (len(lettersCount['A']), len(lettersCount['C']), len(lettersCount['G']), len(lettersCount['T']), len(lettersCount['O']), len(lettersCount['N'])))
-       
-        for phred in (15, 20, 30, 25):
-            for mapq in (0, 1, 5, 10):
-                outputF = oExtraFile[str(phred) + str(mapq)] 
-                if not separatedFiles:
-                    outputF.write("%s\t%s\t" % (info['chr'], info['pos']))
-                newCount = dict()
-                for letterNow in ('A', 'C', 'G', 'T'):
-                    newCount[letterNow] = len(filter(lambda g: g[0] < phred and g[1] < mapq, lettersCount[letterNow]))
-                outputF.write("%d\t%d\t%d\t%d\n" % (newCount['A'], newCount['C'], newCount['G'], newCount['T']))
+            ## Open separated file to contain information about position
+            self.posFile = open_write_file(outputPrefix + "_pos" + extension, compression, offsets.get("pos"), compressionPool)
+        
+        self.oExtraFile = dict()
+        for phred in phreds:
+            for mapq in mapqs:
+                key = str(phred) + "_" + str(mapq)
+                self.oExtraFile[(phred, mapq)] = open_write_file(outputPrefix + "_" + key + extension, compression, offsets.get(key),
+                                                                 compressionPool)
+                if not separatedFiles and header:
+                    ## Header only present when files are not separated
+                    self.oExtraFile[(phred, mapq)].write(THRESHOLD_HEADER)
     
-    ## Close all files
-    for phred in (15, 20, 30, 25):
-        for mapq in (0, 1, 5, 10):
-            outputF = oExtraFile[str(phred) + str(mapq)]
+    def write(self, chromosomes, positions, lettersCount, thresholdsCount, refs=None):
+        """
+        Write the counts of a block of positions.
+
+        Keyword arguments:
+        chromosomes -- the chromosome of each position
+        positions -- the positions, as found in the pileup lines
+        lettersCount -- the array returned by countAlleles
+        thresholdsCount -- the array returned by countThresholds
+        refs -- the reference base of each position, not written
+        """
+        oExtraFile = self.oExtraFile
+        locations = None
+        if not self.separatedFiles:
+            locations = ["%s\t%s\t" % location for location in zip(chromosomes, positions)]
+            self.bufferText(self.oFile, formatRows(lettersCount, locations))
+        else:
+            self.bufferText(self.posFile, "".join(["%s\t%s\n" % location for location in zip(chromosomes, positions)]))
+            self.bufferText(self.oFile, formatRows(lettersCount))
+        
+        for (p, phred) in enumerate(self.phreds):
+            for (m, mapq) in enumerate(self.mapqs):
+                self.bufferText(oExtraFile[(phred, mapq)], formatRows(thresholdsCount[:, p, m], locations))
+        if self.pendingSize >= self.bufferSize:
+            self.flush()
+    
+    def bufferText(self, outputF, text):
+        """
+        Add text at the end of the buffer of an output file.
+
+        Keyword arguments:
+        outputF -- the file pointer receiving the text
+        text -- the formatted text
+        """
+        if outputF in self.pending:
+            self.pending[outputF].append(text)
+        else:
+            self.pending[outputF] = [text]
+        self.pendingSize += len(text)
+    
+    def flush(self):
+        """
+        Write the buffered text, with a single write for each file.
+        """
+        for (outputF, texts) in self.pending.items():
+            outputF.write("".join(texts))
+        self.pending = dict()
+        self.pendingSize = 0
+    
+    def getChunk(self):
+        """
+        Return the content kept in memory, as a tuple containing the content
+        of the global file, of the position file and a dictionary with the
+        content of each threshold file.
+        """
+        self.flush()
+        return(self.oFile.getvalue(), self.posFile.getvalue(), dict([(key, value.getvalue()) for (key, value) in self.oExtraFile.items()]))
+    
+    def writeChunk(self, chunk):
+        """
+        Write the content returned by the getChunk method of another output.
+
+        Keyword arguments:
+        chunk -- the tuple returned by getChunk
+        """
+        (oText, posText, extraTexts) = chunk
+        self.bufferText(self.oFile, oText)
+        if self.posFile is not None:
+            self.bufferText(self.posFile, posText)
+        for (key, outputF) in self.oExtraFile.items():
+            self.bufferText(outputF, extraTexts[key])
+        if self.pendingSize >= self.bufferSize:
+            self.flush()
+    
+    def getState(self):
+        """
+        Write the content of the files on the disk and return a dictionary
+        with the size of each file, used to continue the files.
+        """
+        self.flush()
+        offsets = dict([("global", syncOutputFile(self.oFile))])
+        if self.posFile is not None:
+            offsets["pos"] = syncOutputFile(self.posFile)
+        for ((phred, mapq), outputF) in self.oExtraFile.items():
+            offsets[str(phred) + "_" + str(mapq)] = syncOutputFile(outputF)
+        return(dict([('offsets', offsets)]))
+    
+    def close(self):
+        """
+        Close all files.
+        """
+        self.flush()
+        for outputF in self.oExtraFile.values():
             outputF.close()
-             
-    oFile.close()
+        self.oFile.close()
+        if self.posFile is not None:
+            self.posFile.close()
+
+class ColumnOutput(object):
+    """
+    Write the counts of each position in NumPy .npy files, one file for
+    each column, that can be memory-mapped by loadColumns:
+    outputPrefix_chromosome.npy -- the chromosome id of each position (uint32)
+    outputPrefix_position.npy -- the position (uint32)
+    outputPrefix_counts.npy -- the counts of A, C, G, T, Other and N (uint32, n x 6)
+    outputPrefix_thresholds.npy -- the counts of A, C, G and T for each Phred
+                                   and Mapq thresholds (uint32, n x phreds x mapqs x 4)
+    outputPrefix_columns.json -- the chromosome names and the thresholds
+    When no prefix is given, the columns are kept in memory and returned by
+    getChunk.
+    """
+    
+    def __init__(self, phreds, mapqs, outputPrefix=None, state=None):
+        """
+        Keyword arguments:
+        phreds -- the Phred value thresholds
+        mapqs -- the Mapq value thresholds
+        outputPrefix -- the prefix of the output files, None to keep the columns in memory
+        state -- the dictionary returned by getState to continue the existing files, None to create new files
+        """
+        self.phreds = phreds
+        self.mapqs = mapqs
+        self.outputPrefix = outputPrefix
+        self.chromosomes = dict()
+        self.nbRows = 0
+        self.columns = dict()
+        if state is not None:
+            self.chromosomes = dict([(str(name), number) for (number, name) in enumerate(state['chromosomes'])])
+            self.nbRows = state['nbRows']
+        for name in COLUMNS:
+            if outputPrefix is None:
+                self.columns[name] = list()
+            elif state is not None:
+                self.columns[name] = open_write_file(outputPrefix + "_" + name + ".npy", offset=state['offsets'][name])
+            else:
+                self.columns[name] = open_write_file(outputPrefix + "_" + name + ".npy")
+                ## The header is written again with the final shape when closing
+                self.columns[name].write(npyHeader(COLUMN_DTYPE, (0,)))
+    
+    def write(self, chromosomes, positions, lettersCount, thresholdsCount, refs=None):
+        """
+        Write the counts of a block of positions.
+
+        Keyword arguments:
+        chromosomes -- the chromosome of each position
+        positions -- the positions, as found in the pileup lines
+        lettersCount -- the array returned by countAlleles
+        thresholdsCount -- the array returned by countThresholds
+        refs -- the reference base of each position, not written
+        """
+        ids = [self.chromosomes.setdefault(chromosome, len(self.chromosomes)) for chromosome in chromosomes]
+        self.writeColumns(dict([
+            ('chromosome', numpy.array(ids, dtype=COLUMN_DTYPE)),
+            ('position', numpy.array([int(position) for position in positions], dtype=COLUMN_DTYPE)),
+            ('counts', lettersCount.astype(COLUMN_DTYPE)),
+            ('thresholds', thresholdsCount.astype(COLUMN_DTYPE))]))
+    
+    def writeColumns(self, columns):
+        """
+        Append a block of rows to the columns.
+
+        Keyword arguments:
+        columns -- a dictionary containing an array for each column
+        """
+        self.nbRows += len(columns['position'])
+        for name in COLUMNS:
+            if self.outputPrefix is None:
+                self.columns[name].append(columns[name])
+            else:
+                self.columns[name].write(numpy.ascontiguousarray(columns[name], dtype=COLUMN_DTYPE).tostring())
+    
+    def getChunk(self):
+        """
+        Return the columns kept in memory, as a tuple containing the list of
+        chromosome names, ordered by id, and a dictionary with the array of
+        each column.
+        """
+        names = sorted(self.chromosomes, key=self.chromosomes.get)
+        shapes = dict([('counts', (0, len(ALLELES))), ('thresholds', (0, len(self.phreds), len(self.mapqs), 4))])
+        columns = dict()
+        for name in COLUMNS:
+            if len(self.columns[name]) > 0:
+                columns[name] = numpy.concatenate(self.columns[name])
+            else:
+                columns[name] = numpy.zeros(shapes.get(name, (0,)), dtype=COLUMN_DTYPE)
+        return(names, columns)
+    
+    def writeChunk(self, chunk):
+        """
+        Write the columns returned by the getChunk method of another output,
+        or loaded by loadColumns, by slices of COPY_ROWS rows.
+
+        Keyword arguments:
+        chunk -- the tuple returned by getChunk
+        """
+        (names, columns) = chunk
+        ## Convert the chromosome ids of the chunk into the ids of this output
+        ids = numpy.array([self.chromosomes.setdefault(name, len(self.chromosomes)) for name in names], dtype=COLUMN_DTYPE)
+        for start in xrange(0, len(columns['position']), COPY_ROWS):
+            rows = dict([(name, columns[name][start:start + COPY_ROWS]) for name in COLUMNS])
+            rows['chromosome'] = ids[rows['chromosome']]
+            self.writeColumns(rows)
+    
+    def getState(self):
+        """
+        Write the columns on the disk and return a dictionary with the size
+        of each file, the number of rows and the chromosome names, used to
+        continue the files.
+        """
+        offsets = dict([(name, syncOutputFile(self.columns[name])) for name in COLUMNS])
+        return(dict([('offsets', offsets), ('nbRows', self.nbRows), ('chromosomes', sorted(self.chromosomes, key=self.chromosomes.get))]))
+    
+    def close(self):
+        """
+        Write the final shape of each column and the description of the
+        columns and close all files.
+        """
+        if self.outputPrefix is None:
+            return
+        shapes = dict([('chromosome', (self.nbRows,)), ('position', (self.nbRows,)),
+                       ('counts', (self.nbRows, len(ALLELES))),
+                       ('thresholds', (self.nbRows, len(self.phreds), len(self.mapqs), 4))])
+        for name in COLUMNS:
+            self.columns[name].seek(0)
+            self.columns[name].write(npyHeader(COLUMN_DTYPE, shapes[name]))
+            self.columns[name].close()
+        
+        description = dict([('chromosomes', sorted(self.chromosomes, key=self.chromosomes.get)),
+                            ('alleles', list(ALLELES)), ('phreds', list(self.phreds)), ('mapqs', list(self.mapqs))])
+        oFile = open_write_file(self.outputPrefix + "_columns.json")
+        json.dump(description, oFile, indent=1)
+        oFile.close()
+
+def npyHeader(dtype, shape):
+    """
+    Return the header of a .npy file. The header always has the size
+    NPY_HEADER_SIZE so it can be written again once the shape is known.
+
+    Keyword arguments:
+    dtype -- the type of the array
+    shape -- the shape of the array
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (numpy.dtype(dtype).str, tuple(shape))
+    magic = numpy.lib.format.magic(1, 0)
+    header = header.ljust(NPY_HEADER_SIZE - len(magic) - 3) + "\n"
+    return(magic + struct.pack("<H", len(header)) + header)
+
+def loadColumns(outputPrefix, mmap=True):
+    """
+    Load the columns written by ColumnOutput and return a dictionary
+    containing the array of each column ('chromosome', 'position', 'counts'
+    and 'thresholds') as well as the list of chromosome names
+    ('chromosomes'), the order of the alleles in the counts ('alleles') and
+    the Phred ('phreds') and Mapq ('mapqs') thresholds.
+    An IOError is raised when a file cannot be opened.
+
+    Keyword arguments:
+    outputPrefix -- the prefix of the output files
+    mmap -- an boolean indicating if the arrays should be memory-mapped
+    """
+    iFile = open_read_file(outputPrefix + "_columns.json")
+    columns = json.load(iFile)
     iFile.close()
+    columns['chromosomes'] = [str(name) for name in columns['chromosomes']]
+    columns['alleles'] = tuple(str(allele) for allele in columns['alleles'])
+    columns['phreds'] = tuple(columns['phreds'])
+    columns['mapqs'] = tuple(columns['mapqs'])
     
-    if separatedFiles:
-        posFile.close()
+    mode = None
+    if mmap:
+        mode = 'r'
+    for name in COLUMNS:
+        try:
+            columns[name] = numpy.load(outputPrefix + "_" + name + ".npy", mmap_mode=mode)
+        except IOError:
+            raise IOError("Cannot open file : %s \n\n" % (outputPrefix + "_" + name + ".npy"))
+    return(columns)
+
+class SampleOutputs(object):
+    """
+    Write the counts of each sample of the pileup file in its own output.
+    The outputs are opened with the first block, when the number of samples
+    is known: a single sample is written with the output prefix, while
+    several samples are written with the prefixes outputPrefix_sample1,
+    outputPrefix_sample2, ...
+    """
     
-if __name__ == "__main__":
+    def __init__(self, outputFormat, separatedFiles, phreds, mapqs, outputPrefix=None, compression=None, nbSamples=None, header=True, state=None,
+                 bufferSize=WRITE_BUFFER_SIZE, compressionPool=None):
+        """
+        Keyword arguments:
+        outputFormat -- the format of the outputs, "text" or "columns"
+        separatedFiles -- an boolean indicating if the position file should be created separately
+        phreds -- the Phred value thresholds
+        mapqs -- the Mapq value thresholds
+        outputPrefix -- the prefix of the output files, None to keep the content in memory
+        compression -- the compression of the text output files, None, "gzip" or "bgzip"
+        nbSamples -- the number of samples, None to use the number of samples of the first block
+        header -- an boolean indicating if the headers of the text files should be written
+        state -- the dictionary returned by getState to continue the existing files, None to create new files
+        bufferSize -- the number of bytes of formatted text kept by each text output before being written
+        compressionPool -- the ThreadPool compressing the blocks of the bgzip files, None to compress them in the calling thread
+        """
+        self.outputFormat = outputFormat
+        self.separatedFiles = separatedFiles
+        self.phreds = phreds
+        self.mapqs = mapqs
+        self.outputPrefix = outputPrefix
+        self.compression = compression
+        self.header = header
+        self.bufferSize = bufferSize
+        self.compressionPool = compressionPool
+        self.outputs = None
+        if state is not None and state['outputs'] is not None:
+            self.open(len(state['outputs']), state['outputs'])
+        elif nbSamples is not None:
+            self.open(nbSamples)
     
-    # Extract arguments. Message shown when the number of arguments is not coherent
-    (inputFile, outputPrefix, separatedFiles) = extractArguments()
-    # Parsing pileup file
-    parsePileup(inputFile, outputPrefix, separatedFiles)
+    def open(self, nbSamples, states=None):
+        """
+        Open the output of each sample.
+
+        Keyword arguments:
+        nbSamples -- the number of samples
+        states -- the state of the output of each sample, None to create new files
+        """
+        self.outputs = list()
+        for sample in xrange(nbSamples):
+            outputPrefix = self.outputPrefix
+            if outputPrefix is not None and nbSamples > 1:
+                outputPrefix = "%s_sample%d" % (outputPrefix, sample + 1)
+            state = None
+            if states is not None:
+                state = states[sample]
+            if self.outputFormat == "columns":
+                self.outputs.append(ColumnOutput(self.phreds, self.mapqs, outputPrefix, state))
+            else:
+                self.outputs.append(TextOutput(self.separatedFiles, self.phreds, self.mapqs, outputPrefix, self.compression, self.header, state,
+                                               self.bufferSize, self.compressionPool))
+    
+    def checkSamples(self, nbSamples):
+        """
+        Open the outputs when needed and verify that a block contains the
+        same number of samples as the previous blocks.
+        A ValueError is raised when the number of samples is different.
+
+        Keyword arguments:
+        nbSamples -- the number of samples of the block
+        """
+        if self.outputs is None:
+            self.open(nbSamples)
+        elif nbSamples != len(self.outputs):
+            raise ValueError("Problem with the number of samples: %d instead of %d" % (nbSamples, len(self.outputs)))
+    
+    def write(self, chromosomes, positions, lettersCount, thresholdsCount, refs=None):
+        """
+        Write the counts of a block of positions.
+
+        Keyword arguments:
+        chromosomes -- the chromosome of each position
+        positions -- the positions, as found in the pileup lines
+        lettersCount -- the array returned by countAlleles, the rows of each sample following each other
+        thresholdsCount -- the array returned by countThresholds, the rows of each sample following each other
+        refs -- the reference base of each position
+        """
+        nbPositions = len(positions)
+        self.checkSamples(len(lettersCount) // nbPositions)
+        for (sample, output) in enumerate(self.outputs):
+            rows = slice(sample * nbPositions, (sample + 1) * nbPositions)
+            output.write(chromosomes, positions, lettersCount[rows], thresholdsCount[rows], refs)
+    
+    def getChunk(self):
+        """
+        Return the list of the contents returned by the getChunk method of
+        the output of each sample.
+        """
+        if self.outputs is None:
+            return(list())
+        return([output.getChunk() for output in self.outputs])
+    
+    def writeChunk(self, chunk):
+        """
+        Write the contents returned by the getChunk method of another output.
+
+        Keyword arguments:
+        chunk -- the list returned by getChunk
+        """
+        if len(chunk) == 0:
+            return
+        self.checkSamples(len(chunk))
+        for (output, sampleChunk) in zip(self.outputs, chunk):
+            output.writeChunk(sampleChunk)
+    
+    def getState(self):
+        """
+        Write the outputs on the disk and return a dictionary with the state
+        of the output of each sample, None when the outputs are not opened.
+        """
+        if self.outputs is None:
+            return(dict([('outputs', None)]))
+        return(dict([('outputs', [output.getState() for output in self.outputs])]))
+    
+    def close(self):
+        """
+        Close the output of each sample, an empty input file creates the
+        output of a single sample.
+        """
+        if self.outputs is None:
+            self.open(1)
+        for output in self.outputs:
+            output.close()
+
+class SparseOutput(object):
+    """
+    Write in another output only the positions with enough non-reference
+    bases. The non-reference bases are the A, C, G and T differing from
+    the reference base and the Other bases (indels); the N are only counted
+    in the depth. A position is written when its non-reference bases are at
+    least the minimum count and more than the fraction of the depth. With
+    several samples, a position is written when one of the samples has
+    enough non-reference bases.
+    """
+    
+    def __init__(self, output, minAltCount=None, minAltFraction=None):
+        """
+        Keyword arguments:
+        output -- the output receiving the selected positions
+        minAltCount -- the minimum number of non-reference bases, 1 when None
+        minAltFraction -- the fraction of the depth exceeded by the non-reference bases, 0 when None
+        """
+        self.output = output
+        self.minAltCount = minAltCount if minAltCount is not None else 1
+        self.minAltFraction = minAltFraction if minAltFraction is not None else 0.0
+    
+    def write(self, chromosomes, positions, lettersCount, thresholdsCount, refs=None):
+        """
+        Write the selected positions of a block of positions.
+
+        Keyword arguments:
+        chromosomes -- the chromosome of each position
+        positions -- the positions, as found in the pileup lines
+        lettersCount -- the array returned by countAlleles, the rows of each sample following each other
+        thresholdsCount -- the array returned by countThresholds, the rows of each sample following each other
+        refs -- the reference base of each position
+        """
+        nbPositions = len(positions)
+        if nbPositions == 0:
+            return
+        counts = lettersCount.reshape((-1, nbPositions, len(ALLELES)))
+        refCodes = numpy.array([ALLELE_INDEX.get(ref.upper(), len(ALLELES)) for ref in refs], dtype=numpy.intp)
+        ## A zero column gives the reference count of the positions without A, C, G or T reference
+        refCounts = numpy.concatenate((counts, numpy.zeros(counts.shape[:2] + (1,), dtype=counts.dtype)), axis=2)
+        refCounts = refCounts[:, numpy.arange(nbPositions), numpy.where(refCodes < 4, refCodes, len(ALLELES))]
+        altCounts = counts[:, :, :ALLELE_INDEX['N']].sum(axis=2) - refCounts
+        selected = (altCounts >= self.minAltCount) & (altCounts > self.minAltFraction * counts.sum(axis=2))
+        kept = numpy.flatnonzero(selected.any(axis=0))
+        if len(kept) == 0:
+            return
+        if len(kept) < nbPositions:
+            rows = (numpy.arange(len(counts))[:, numpy.newaxis] * nbPositions + kept).ravel()
+            (chromosomes, positions, refs) = ([chromosomes[i] for i in kept], [positions[i] for i in kept], [refs[i] for i in kept])
+            (lettersCount, thresholdsCount) = (lettersCount[rows], thresholdsCount[rows])
+        self.output.write(chromosomes, positions, lettersCount, thresholdsCount, refs)
+    
+    def getChunk(self):
+        """
+        Return the content returned by the getChunk method of the output.
+        """
+        return(self.output.getChunk())
+    
+    def writeChunk(self, chunk):
+        """
+        Write the content returned by the getChunk method of another output.
+
+        Keyword arguments:
+        chunk -- the content returned by getChunk
+        """
+        self.output.writeChunk(chunk)
+    
+    def getState(self):
+        """
+        Return the state returned by the getState method of the output.
+        """
+        return(self.output.getState())
+    
+    def close(self):
+        """
+        Close the output.
+        """
+        self.output.close()
+
+class BinnedOutput(object):
+    """
+    Write in another output the sum of the counts of the positions of each
+    window of binSize positions. The windows start at the positions 1,
+    binSize + 1, 2 * binSize + 1, ... of each chromosome and are written
+    with their first position; windows without any position are not
+    written. The last window of a block is kept until the next block shows
+    that it is complete.
+    """
+    
+    def __init__(self, output, binSize, pending=None):
+        """
+        Keyword arguments:
+        output -- the output receiving the counts of the windows
+        binSize -- the number of positions of each window
+        pending -- the last window, as saved by getState, None when no window is pending
+        """
+        self.output = output
+        self.binSize = binSize
+        ## Chromosome, window and counts of the last window seen
+        self.pending = None
+        if pending is not None:
+            (chromosome, window, counts, thresholds) = pending
+            self.pending = ((str(chromosome), window), numpy.array(counts, dtype=numpy.int64), numpy.array(thresholds, dtype=numpy.int64))
+    
+    def write(self, chromosomes, positions, lettersCount, thresholdsCount, refs=None):
+        """
+        Add the counts of a block of positions to their windows and write
+        the complete windows.
+
+        Keyword arguments:
+        chromosomes -- the chromosome of each position
+        positions -- the positions, as found in the pileup lines
+        lettersCount -- the array returned by countAlleles, the rows of each sample following each other
+        thresholdsCount -- the array returned by countThresholds, the rows of each sample following each other
+        refs -- the reference base of each position, not used
+        """
+        nbPositions = len(positions)
+        if nbPositions == 0:
+            return
+        bins = (numpy.array(positions).astype(numpy.int64) - 1) // self.binSize
+        names = numpy.array(chromosomes)
+        starts = numpy.flatnonzero(numpy.concatenate(([True], (bins[1:] != bins[:-1]) | (names[1:] != names[:-1]))))
+        
+        counts = lettersCount.reshape((-1, nbPositions) + lettersCount.shape[1:])
+        counts = numpy.add.reduceat(counts.astype(numpy.int64), starts, axis=1)
+        thresholds = thresholdsCount.reshape((-1, nbPositions) + thresholdsCount.shape[1:])
+        thresholds = numpy.add.reduceat(thresholds.astype(numpy.int64), starts, axis=1)
+        windows = [(chromosomes[i], bins[i]) for i in starts]
+        
+        if self.pending is not None:
+            if self.pending[0] == windows[0]:
+                counts[:, 0] += self.pending[1]
+                thresholds[:, 0] += self.pending[2]
+            else:
+                self.writeWindows([self.pending[0]], self.pending[1][:, numpy.newaxis], self.pending[2][:, numpy.newaxis])
+        
+        self.writeWindows(windows[:-1], counts[:, :-1], thresholds[:, :-1])
+        self.pending = (windows[-1], counts[:, -1], thresholds[:, -1])
+    
+    def writeWindows(self, windows, counts, thresholds):
+        """
+        Write the counts of complete windows.
+
+        Keyword arguments:
+        windows -- the list of (chromosome, window number) tuples
+        counts -- the allele counts, an array with a dimension for the samples and one for the windows
+        thresholds -- the threshold counts, an array with a dimension for the samples and one for the windows
+        """
+        if len(windows) == 0:
+            return
+        positions = [str(window * self.binSize + 1) for (chromosome, window) in windows]
+        self.output.write([chromosome for (chromosome, window) in windows], positions,
+                          counts.reshape((-1,) + counts.shape[2:]), thresholds.reshape((-1,) + thresholds.shape[2:]))
+    
+    def writeChunk(self, chunk):
+        """
+        Add the positions returned by the getChunk method of an output of
+        the columns format, as created by createOutput for the processes.
+
+        Keyword arguments:
+        chunk -- the list returned by getChunk
+        """
+        if len(chunk) == 0 or len(chunk[0][1]['position']) == 0:
+            return
+        (names, columns) = chunk[0]
+        chromosomes = [names[i] for i in columns['chromosome']]
+        self.write(chromosomes, columns['position'], numpy.concatenate([sampleColumns['counts'] for (sampleNames, sampleColumns) in chunk]),
+                   numpy.concatenate([sampleColumns['thresholds'] for (sampleNames, sampleColumns) in chunk]))
+    
+    def getState(self):
+        """
+        Write the complete windows on the disk and return a dictionary with
+        the state of the output and the counts of the pending window.
+        """
+        pending = None
+        if self.pending is not None:
+            ((chromosome, window), counts, thresholds) = self.pending
+            pending = [chromosome, int(window), counts.tolist(), thresholds.tolist()]
+        return(dict([('output', self.output.getState()), ('pending', pending)]))
+    
+    def close(self):
+        """
+        Write the last window and close the output.
+        """
+        if self.pending is not None:
+            self.writeWindows([self.pending[0]], self.pending[1][:, numpy.newaxis], self.pending[2][:, numpy.newaxis])
+            self.pending = None
+        self.output.close()
+
+def createOutput(outputFormat, separatedFiles, phreds, mapqs, outputPrefix=None, compression=None, nbSamples=None,
+                 minAltCount=None, minAltFraction=None, binSize=None, header=True, state=None, bufferSize=WRITE_BUFFER_SIZE,
+                 compressionPool=None):
+    """
+    Create and return the output receiving the counts of each position.
+
+    Keyword arguments:
+    outputFormat -- the format of the output, "text" or "columns"
+    separatedFiles -- an boolean indicating if the position file should be created separately
+    phreds -- the Phred value thresholds
+    mapqs -- the Mapq value thresholds
+    outputPrefix -- the prefix of the output files, None to keep the content in memory
+    compression -- the compression of the text output files, None, "gzip" or "bgzip"
+    nbSamples -- the number of samples, None to use the number of samples of the pileup lines
+    minAltCount -- the minimum number of non-reference bases of the written positions
+    minAltFraction -- the minimum fraction of non-reference bases of the written positions
+    binSize -- the number of positions of the windows whose counts are written, None to write each position
+    header -- an boolean indicating if the headers of the text files should be written
+    state -- the state returned by the getState method of the output to continue its files, None to create new files
+    bufferSize -- the number of bytes of formatted text kept by each text output before being written
+    compressionPool -- the ThreadPool compressing the blocks of the bgzip files, None to compress them in the calling thread
+    """
+    if binSize is not None:
+        if outputPrefix is None:
+            ## The positions of the processes are kept as columns, the
+            ## windows overlapping two chunks are summed by the main process
+            return(SampleOutputs("columns", separatedFiles, phreds, mapqs, None, None, nbSamples))
+        if state is None:
+            state = dict([('output', None), ('pending', None)])
+        return(BinnedOutput(SampleOutputs(outputFormat, separatedFiles, phreds, mapqs, outputPrefix, compression, nbSamples, header, state['output'],
+                                          bufferSize, compressionPool), binSize, state['pending']))
+    output = SampleOutputs(outputFormat, separatedFiles, phreds, mapqs, outputPrefix, compression, nbSamples, header, state, bufferSize,
+                           compressionPool)
+    if minAltCount is not None or minAltFraction is not None:
+        return(SparseOutput(output, minAltCount, minAltFraction))
+    return(output)
+
+def countSamples(nbColumns):
+    """
+    Return the number of samples of pileup lines from their number of
+    columns following the reference base. A single sample can have extra
+    columns, while several samples must all have the columns of one of the
+    SAMPLE_WIDTHS. A ValueError is raised when the number of columns does
+    not match a single layout: the number of samples must then be given.
+
+    Keyword arguments:
+    nbColumns -- the number of columns following the reference base
+    """
+    if nbColumns < 2 * min(SAMPLE_WIDTHS):
+        return(1)
+    layouts = [nbColumns // width for width in SAMPLE_WIDTHS if nbColumns % width == 0]
+    if len(layouts) != 1:
+        raise ValueError("Cannot detect the number of samples of the lines with %d columns, it must be given with --samples" % (nbColumns + 3))
+    return(layouts[0])
+
+def parseBlock(lines, phreds, mapqs, nbSamples=None, stats=None):
+    """
+    Decode a block of pileup lines and return a tuple containing the
+    chromosome, the position and the reference base of each line, the
+    array returned by countAlleles, the array returned by countThresholds
+    and the tuple returned by decodePileupBlock. The columns of all samples
+    are decoded together: the counts contain the rows of the first sample,
+    followed by the rows of the second sample, ...
+
+    Keyword arguments:
+    lines -- the pileup lines
+    phreds -- the Phred value thresholds
+    mapqs -- the Mapq value thresholds
+    nbSamples -- the number of samples, None to detect it from the number
+                 of columns of the first line with countSamples
+    stats -- the Statistics receiving the time of each stage and the counters, None to not collect statistics
+    """
+    if stats is not None:
+        start = time.time()
+    data = [split("\t", line) for line in lines]
+    nbColumns = len(data[0]) - 3
+    if nbSamples is None:
+        nbSamples = countSamples(nbColumns)
+    ## Extra columns of each sample (as the read positions) are ignored
+    width = nbColumns // nbSamples
+    if width < 4:
+        print("Problem with the number of samples: %d samples in this line: %s" % (nbSamples, lines[0].rstrip("\n")))
+        sys.exit(2)
+    
+    sequences = list()
+    phredSeqs = list()
+    mapqSeqs = list()
+    for sample in xrange(nbSamples):
+        column = 3 + sample * width
+        sequences.extend([d[column + 1] for d in data])
+        phredSeqs.extend([d[column + 2] for d in data])
+        mapqSeqs.extend([d[column + 3] for d in data])
+    refs = [d[2] for d in data]
+    if stats is not None:
+        start = stats.addTime('split', start)
+    
+    (decoded, weights) = decodePileupBlock(sequences, phredSeqs, mapqSeqs, refs * nbSamples)
+    if stats is not None:
+        start = stats.addTime('decode', start)
+    lettersCount = countAlleles(decoded, len(sequences), weights)
+    
+    thresholdsCount = countThresholds(decoded, len(sequences), phreds, mapqs, weights)
+    if stats is not None:
+        stats.addTime('count', start)
+        stats.countBlock(len(lines), sequences, lettersCount, decoded[4])
+    
+    return([d[0] for d in data], [d[1] for d in data], refs, lettersCount, thresholdsCount, (decoded, weights))
+
+def iterLineBlocks(lines, blockSize=BLOCK_SIZE, blockBytes=BLOCK_BYTES):
+    """
+    Generator returning the lines grouped in lists of blockSize lines. A
+    list is returned earlier when its lines reach blockBytes bytes, so deep
+    positions do not increase the memory used by a block.
+
+    Keyword arguments:
+    lines -- an iterable on the pileup lines
+    blockSize -- the maximum number of lines of each list
+    blockBytes -- the size, in bytes, of the lines ending a list
+    """
+    block = list()
+    size = 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if len(block) == blockSize or size >= blockBytes:
+            yield block
+            block = list()
+            size = 0
+    if len(block) > 0:
+        yield block
+
+def iterBlocks(lines, phreds=DEFAULT_PHREDS, mapqs=DEFAULT_MAPQS, blockSize=BLOCK_SIZE, nbSamples=None):
+    """
+    Generator decoding the pileup lines by blocks and returning the tuple
+    returned by parseBlock for each block. The counts of a block are NumPy
+    arrays with one row for each line and each sample.
+
+    Keyword arguments:
+    lines -- an iterable on the pileup lines
+    phreds -- the Phred value thresholds
+    mapqs -- the Mapq value thresholds
+    blockSize -- the number of lines of each block
+    nbSamples -- the number of samples, None to detect it from the pileup lines
+    """
+    for block in iterLineBlocks(lines, blockSize):
+        yield parseBlock(block, phreds, mapqs, nbSamples)
+
+class PileupRecord(object):
+    """
+    Counts of a position of the pileup file. The counts are views on the
+    arrays of the decoded block: counts contains the number of A, C, G, T,
+    Other and N and thresholdCounts contains, for each Phred and Mapq
+    threshold, the number of A, C, G and T under both thresholds. When the
+    pileup file contains several samples, both arrays have a first
+    dimension for the samples.
+    """
+    __slots__ = ('chromosome', 'position', 'ref', 'counts', 'thresholdCounts')
+    
+    def __init__(self, chromosome, position, ref, counts, thresholdCounts):
+        self.chromosome = chromosome
+        self.position = position
+        self.ref = ref
+        self.counts = counts
+        self.thresholdCounts = thresholdCounts
+    
+    def __repr__(self):
+        return("PileupRecord(%s, %d, %s, %s)" % (self.chromosome, self.position, self.ref, self.counts.tolist()))
+
+def iterPileup(inputFile, phreds=DEFAULT_PHREDS, mapqs=DEFAULT_MAPQS, regions=None, nbSamples=None):
+    """
+    Generator parsing a pileup file and returning a PileupRecord for each
+    position. No output file is written.
+
+    Keyword arguments:
+    inputFile -- the name of the input file, "-" for the standard input, or
+                 an iterable on the pileup lines, as an open file
+    phreds -- the Phred value thresholds of the threshold counts
+    mapqs -- the Mapq value thresholds of the threshold counts
+    regions -- the Regions to parse, as returned by extractRegions, None to parse the whole file
+    nbSamples -- the number of samples, None to detect it from the pileup lines
+    """
+    if isinstance(inputFile, basestring):
+        lines = readInputLines(inputFile, regions)
+    elif regions is not None:
+        lines = filterRegionLines(inputFile, regions)
+    else:
+        lines = inputFile
+    
+    for (chromosomes, positions, refs, lettersCount, thresholdsCount, histogram) in iterBlocks(lines, phreds, mapqs, nbSamples=nbSamples):
+        nbPositions = len(chromosomes)
+        if len(lettersCount) > nbPositions:
+            ## The rows of each sample are gathered by position
+            lettersCount = lettersCount.reshape((-1, nbPositions) + lettersCount.shape[1:]).swapaxes(0, 1)
+            thresholdsCount = thresholdsCount.reshape((-1, nbPositions) + thresholdsCount.shape[1:]).swapaxes(0, 1)
+        for i in xrange(nbPositions):
+            yield PileupRecord(chromosomes[i], int(positions[i]), refs[i], lettersCount[i], thresholdsCount[i])
+
+def writeBlock(block, output, cache=None, stats=None):
+    """
+    Write the counts of a decoded block of pileup lines in the output.
+
+    Keyword arguments:
+    block -- the tuple returned by parseBlock
+    output -- the output receiving the counts, as returned by createOutput
+    cache -- the CacheWriter receiving the histograms, None when no cache is built
+    stats -- the Statistics receiving the time of the writing, None to not collect statistics
+    """
+    if stats is not None:
+        start = time.time()
+    (chromosomes, positions, refs, lettersCount, thresholdsCount, (decoded, weights)) = block
+    output.write(chromosomes, positions, lettersCount, thresholdsCount, refs)
+    if cache is not None:
+        cache.write(chromosomes, positions, refs, lettersCount, decoded, weights)
+    if stats is not None:
+        stats.addTime('write', start)
+        stats.printProgress()
+
+def writeLines(lines, output, phreds, mapqs, cache=None, nbSamples=None, checkpoint=None, stats=None):
+    """
+    Decode the pileup lines by blocks and write the counts of each line in
+    the output.
+
+    Keyword arguments:
+    lines -- an iterable on the pileup lines
+    output -- the output receiving the counts, as returned by createOutput
+    phreds -- the Phred value thresholds
+    mapqs -- the Mapq value thresholds
+    cache -- the CacheWriter receiving the histograms, None when no cache is built
+    nbSamples -- the number of samples, None to detect it from the pileup lines
+    checkpoint -- the Checkpoint following the bytes of the written blocks, None when no checkpoint is written
+    stats -- the Statistics receiving the time of each stage and the counters, None to not collect statistics
+    """
+    start = time.time()
+    for blockLines in iterLineBlocks(lines):
+        if stats is not None:
+            stats.addTime('read', start)
+        writeBlock(parseBlock(blockLines, phreds, mapqs, nbSamples, stats), output, cache, stats)
+        if checkpoint is not None:
+            checkpoint.update(sum([len(line) for line in blockLines]), output)
+        start = time.time()
+
+class Statistics(object):
+    """
+    Collect the time spent in each stage of the parsing (reading the lines,
+    computing the counts from the cache, splitting the columns, decoding the
+    bases, counting the alleles and the thresholds and writing the outputs)
+    and counters on the parsed lines. The positions read from the cache are
+    counted as lines, their bases are not known. The statistics of the
+    processes are merged into the statistics of the main process, so their
+    stage times are summed over the processes. The threads of the pipeline
+    update the statistics under a lock.
+    """
+    
+    def __init__(self, progressInterval=None):
+        """
+        Keyword arguments:
+        progressInterval -- the number of seconds between two progress lines, None to not print progress lines
+        """
+        self.progressInterval = progressInterval
+        self.start = time.time()
+        self.lastProgress = self.start
+        self.timings = dict([(stage, 0.0) for stage in STAGES])
+        self.counters = dict([(counter, 0) for counter in COUNTERS])
+        self.lock = threading.Lock()
+    
+    def addTime(self, stage, start):
+        """
+        Add the time elapsed since start to a stage and return the current time.
+
+        Keyword arguments:
+        stage -- the name of the stage, among STAGES
+        start -- the time at the beginning of the stage
+        """
+        now = time.time()
+        with self.lock:
+            self.timings[stage] += now - start
+        return(now)
+    
+    def countBlock(self, nbLines, sequences, lettersCount, indels):
+        """
+        Add the counters of a decoded block of pileup lines.
+
+        Keyword arguments:
+        nbLines -- the number of lines of the block
+        sequences -- the read bases of each column
+        lettersCount -- the array returned by countAlleles
+        indels -- the number of indels of each column
+        """
+        sequence = "".join(sequences)
+        nbIndels = int(indels.sum())
+        ## The Mapq character following "^" can be "$", "<" or ">"
+        starts = READ_START_PATTERN.findall(sequence)
+        if len(starts) > 0:
+            sequence = READ_START_PATTERN.sub("", sequence)
+        with self.lock:
+            counters = self.counters
+            counters['lines'] += nbLines
+            ## countAlleles counts the indels as Other
+            counters['bases'] += int(lettersCount.sum()) - nbIndels
+            counters['indels'] += nbIndels
+            counters['readStarts'] += len(starts)
+            counters['readEnds'] += sequence.count("$")
+            counters['referenceSkips'] += sequence.count("<") + sequence.count(">")
+    
+    def countLines(self, nbLines):
+        """
+        Add lines whose bases are not known, such as the positions read from the cache.
+
+        Keyword arguments:
+        nbLines -- the number of lines
+        """
+        with self.lock:
+            self.counters['lines'] += nbLines
+    
+    def merge(self, state):
+        """
+        Add the statistics returned by the getState method of another Statistics.
+
+        Keyword arguments:
+        state -- the dictionary returned by getState
+        """
+        with self.lock:
+            for stage in STAGES:
+                self.timings[stage] += state['timings'][stage]
+            for counter in COUNTERS:
+                self.counters[counter] += state['counters'][counter]
+        self.printProgress()
+    
+    def getState(self):
+        """
+        Return a dictionary with the stage times and the counters.
+        """
+        return(dict([('timings', self.timings), ('counters', self.counters)]))
+    
+    def printProgress(self):
+        """
+        Print a progress line on the standard error when the progress
+        interval has elapsed since the previous line.
+        """
+        if self.progressInterval is None:
+            return
+        now = time.time()
+        if now - self.lastProgress >= self.progressInterval:
+            self.lastProgress = now
+            elapsed = now - self.start
+            sys.stderr.write("Parsed %d lines, %d bases in %.1f s: %.0f lines/s, %.0f bases/s\n" %
+                             (self.counters['lines'], self.counters['bases'], elapsed, self.counters['lines'] / elapsed,
+                              self.counters['bases'] / elapsed))
+    
+    def getSummary(self):
+        """
+        Return a dictionary with the elapsed time, the stage times, the
+        counters and the lines and bases parsed by second.
+        """
+        elapsed = time.time() - self.start
+        rates = dict([('linesPerSecond', self.counters['lines'] / elapsed), ('basesPerSecond', self.counters['bases'] / elapsed)])
+        return(dict([('elapsed', elapsed), ('timings', self.timings), ('counters', self.counters), ('rates', rates)]))
+    
+    def writeSummary(self, summaryFile):
+        """
+        Write the dictionary returned by getSummary in a JSON file.
+
+        Keyword arguments:
+        summaryFile -- the name of the JSON file
+        """
+        oFile = open_write_file(summaryFile)
+        json.dump(self.getSummary(), oFile, indent=1, sort_keys=True)
+        oFile.write("\n")
+        oFile.close()
+
+class Checkpoint(object):
+    """
+    Record the progress of a parsing in a checkpoint file so an interrupted
+    parsing can be resumed. The checkpoint contains the byte offset of the
+    next line to parse and the state of the output, saved once the output
+    files are written on the disk. The file is replaced atomically, so it
+    always describes a consistent state of the input and of the outputs.
+    """
+    
+    def __init__(self, checkpointFile, settings, interval=None):
+        """
+        Keyword arguments:
+        checkpointFile -- the name of the checkpoint file
+        settings -- a dictionary identifying the input file and the options of the parsing
+        interval -- the number of input bytes parsed between two checkpoints, None to use
+                    the interval of the resumed checkpoint or CHECKPOINT_SIZE
+        """
+        self.checkpointFile = checkpointFile
+        ## The settings are compared once read back from JSON
+        self.settings = json.loads(json.dumps(settings))
+        self.interval = interval
+        self.offset = 0
+        self.pending = 0
+    
+    def load(self):
+        """
+        Read the checkpoint file, set the offset of the next line to parse
+        and return the state of the output, None when there is no
+        checkpoint. The parsing stops when the checkpoint was written by
+        another parsing.
+        """
+        if not os.path.exists(self.checkpointFile):
+            print("No checkpoint found, the parsing starts at the beginning of the input file")
+        else:
+            iFile = open(self.checkpointFile)
+            checkpoint = json.load(iFile)
+            iFile.close()
+            if checkpoint['settings'] != self.settings:
+                print("The checkpoint %s does not match the input file or the options" % (self.checkpointFile))
+                sys.exit(2)
+            self.offset = checkpoint['offset']
+            if self.interval is None:
+                self.interval = checkpoint['interval']
+            return(checkpoint['state'])
+        return(None)
+    
+    def update(self, nbBytes, output):
+        """
+        Add the bytes of written lines and save a checkpoint when enough
+        bytes have been parsed since the previous one.
+
+        Keyword arguments:
+        nbBytes -- the number of bytes of the lines written in the output
+        output -- the output of the parsing
+        """
+        self.offset += nbBytes
+        self.pending += nbBytes
+        if self.pending >= (self.interval or CHECKPOINT_SIZE):
+            self.save(output)
+    
+    def save(self, output):
+        """
+        Write the output files on the disk, then the checkpoint file.
+
+        Keyword arguments:
+        output -- the output of the parsing
+        """
+        checkpoint = dict([('settings', self.settings), ('offset', self.offset), ('interval', self.interval or CHECKPOINT_SIZE),
+                           ('state', output.getState())])
+        oFile = open(self.checkpointFile + ".tmp", 'w')
+        json.dump(checkpoint, oFile)
+        oFile.flush()
+        os.fsync(oFile.fileno())
+        oFile.close()
+        os.rename(self.checkpointFile + ".tmp", self.checkpointFile)
+        self.pending = 0
+    
+    def remove(self):
+        """
+        Remove the checkpoint file once the parsing is complete.
+        """
+        if os.path.exists(self.checkpointFile):
+            os.remove(self.checkpointFile)
+
+class CoveredRanges(object):
+    """
+    Record, next to the outputs, the chromosome and position ranges they
+    cover, with the positions of their lines, and the state of the output,
+    so new pileup lines can be appended to them. The lines of an input file
+    already in the outputs are skipped and the other lines must follow the
+    written positions, so the outputs keep the order of the pileup files.
+    """
+    
+    def __init__(self, rangesFile, settings):
+        """
+        Keyword arguments:
+        rangesFile -- the name of the file recording the ranges
+        settings -- a dictionary with the options of the parsing
+        """
+        self.rangesFile = rangesFile
+        ## The settings are compared once read back from JSON
+        self.settings = json.loads(json.dumps(settings))
+        self.ranges = list()
+        self.nbSamples = None
+        self.offset = 0
+    
+    def load(self):
+        """
+        Read the ranges file and return the state of the output, None when
+        the outputs were not written yet. The parsing stops when the outputs
+        were written with other options.
+        """
+        if not os.path.exists(self.rangesFile):
+            return(None)
+        iFile = open(self.rangesFile)
+        content = json.load(iFile)
+        iFile.close()
+        if content['version'] != RANGES_VERSION or content['settings'] != self.settings:
+            print("The outputs described by %s were written with other options" % (self.rangesFile))
+            sys.exit(2)
+        self.ranges = content['ranges']
+        self.nbSamples = content['nbSamples']
+        return(content['state'])
+    
+    def scan(self, inputFile, nbSamples=None):
+        """
+        Read the chromosome and the position of each line of the input file,
+        set the byte offset of the first line not covered by the outputs and
+        add the ranges of the following lines. A range records the runs of
+        consecutive positions of its lines and the SHA-1 digest of the lines,
+        checked when the input file holds a whole range again. The parsing
+        stops when a line cannot be appended: it overlaps or precedes the
+        written positions, it falls between the positions of a range, the
+        lines of a range differ from those of the outputs or its number of
+        samples is not the number of samples of the outputs.
+
+        Keyword arguments:
+        inputFile -- the name of the plain input file
+        nbSamples -- the number of samples, None to detect it from the number of columns of the pileup lines
+        """
+        ## The runs of each chromosome, with the index of their range
+        covered = dict()
+        for (index, (chromosome, runs, digest)) in enumerate(self.ranges):
+            covered.setdefault(chromosome, (list(), list(), list()))
+            for (start, end) in runs:
+                covered[chromosome][0].append(start)
+                covered[chromosome][1].append(end)
+                covered[chromosome][2].append(index)
+        (lastChromosome, lastPosition) = (None, 0)
+        if len(self.ranges) > 0:
+            (lastChromosome, lastPosition) = (self.ranges[-1][0], self.ranges[-1][1][-1][1])
+        ## The chromosomes followed by another chromosome cannot get new positions
+        closed = set(covered) - set([lastChromosome])
+        
+        newRanges = list()
+        ## The range whose skipped lines are digested, from its first line
+        (checked, checkedDigest, checkedPosition) = (None, None, None)
+        offset = 0
+        iFile = open(inputFile)
+        for (number, line) in enumerate(iFile):
+            (chromosome, position) = line.split("\t", 2)[:2]
+            position = int(position)
+            if number == 0:
+                ## The skipped lines are also checked
+                try:
+                    lineSamples = nbSamples or countSamples(len(line.rstrip("\n").split("\t")) - 3)
+                except ValueError as e:
+                    print(e)
+                    sys.exit(2)
+                if self.nbSamples is not None and lineSamples != self.nbSamples:
+                    print("Cannot append %s: %d samples in the input file instead of %d in the outputs" % (inputFile, lineSamples, self.nbSamples))
+                    sys.exit(2)
+                self.nbSamples = lineSamples
+            if len(newRanges) == 0:
+                index = -1
+                if chromosome in covered:
+                    (starts, ends, indexes) = covered[chromosome]
+                    index = bisect.bisect_right(starts, position) - 1
+                if index >= 0 and position <= ends[index]:
+                    ## Already parsed
+                    if indexes[index] != checked:
+                        self.checkRange(inputFile, checked, checkedDigest, checkedPosition)
+                        (checked, checkedDigest) = (indexes[index], None)
+                        if position == self.ranges[checked][1][0][0]:
+                            checkedDigest = hashlib.sha1()
+                    if checkedDigest is not None:
+                        checkedDigest.update(line)
+                    checkedPosition = position
+                    offset += len(line)
+                    continue
+                if index >= 0 and position < self.ranges[indexes[index]][1][-1][1]:
+                    runs = self.ranges[indexes[index]][1]
+                    print("Cannot append line %d (%s:%d) of %s: it falls in the range %s:%d-%d of the outputs, which has no line at this position"
+                          % (number + 1, chromosome, position, inputFile, chromosome, runs[0][0], runs[-1][1]))
+                    sys.exit(2)
+                self.checkRange(inputFile, checked, checkedDigest, checkedPosition)
+                checked = None
+            if chromosome in closed or (chromosome == lastChromosome and position <= lastPosition):
+                print("Cannot append line %d (%s:%d) of %s: it does not follow the position %s:%d, already in the outputs or in the input file"
+                      % (number + 1, chromosome, position, inputFile, lastChromosome, lastPosition))
+                sys.exit(2)
+            if chromosome != lastChromosome and lastChromosome is not None:
+                closed.add(lastChromosome)
+            if len(newRanges) == 0 or newRanges[-1][0] != chromosome:
+                newRanges.append([chromosome, list(), hashlib.sha1()])
+            runs = newRanges[-1][1]
+            if len(runs) > 0 and runs[-1][1] == position - 1:
+                runs[-1][1] = position
+            else:
+                runs.append([position, position])
+            newRanges[-1][2].update(line)
+            (lastChromosome, lastPosition) = (chromosome, position)
+        iFile.close()
+        self.checkRange(inputFile, checked, checkedDigest, checkedPosition)
+        self.offset = offset
+        self.ranges.extend([[chromosome, runs, digest.hexdigest()] for (chromosome, runs, digest) in newRanges])
+    
+    def checkRange(self, inputFile, index, digest, position):
+        """
+        Stop the parsing when the skipped lines of the input file hold a
+        whole range of the outputs and differ from the lines of this range.
+
+        Keyword arguments:
+        inputFile -- the name of the plain input file
+        index -- the index of the range in the recorded ranges, None when no line was skipped
+        digest -- the SHA-1 digest of the skipped lines from the first position of the range, None when the input file does not hold it
+        position -- the position of the last skipped line
+        """
+        if index is None or digest is None:
+            return
+        (chromosome, runs, rangeDigest) = self.ranges[index]
+        if position == runs[-1][1] and digest.hexdigest() != rangeDigest:
+            print("Cannot append %s: its lines of the range %s:%d-%d differ from the lines of the outputs"
+                  % (inputFile, chromosome, runs[0][0], runs[-1][1]))
+            sys.exit(2)
+    
+    def save(self, output):
+        """
+        Write the output files on the disk, then the ranges file.
+
+        Keyword arguments:
+        output -- the output of the parsing
+        """
+        content = dict([('version', RANGES_VERSION), ('settings', self.settings), ('nbSamples', self.nbSamples), ('ranges', self.ranges),
+                        ('state', output.getState())])
+        oFile = open(self.rangesFile + ".tmp", 'w')
+        json.dump(content, oFile)
+        oFile.flush()
+        os.fsync(oFile.fileno())
+        oFile.close()
+        os.rename(self.rangesFile + ".tmp", self.rangesFile)
+
+def getCacheEntry(cacheDir, inputFile, nbSamples=None):
+    """
+    Return a tuple containing the directory of the cache entry of the input
+    file and a dictionary identifying the input file. The entry is keyed on
+    the path, the size and the modification time of the input file and on
+    the number of samples, the histograms of each sample being cached.
+
+    Keyword arguments:
+    cacheDir -- the directory of the histogram cache
+    inputFile -- the name of the input file
+    nbSamples -- the number of samples, None when it is detected from the pileup lines
+    """
+    path = os.path.abspath(inputFile)
+    stat = os.stat(path)
+    identity = dict([('path', path), ('size', stat.st_size), ('mtime', stat.st_mtime), ('nbSamples', nbSamples), ('version', CACHE_VERSION)])
+    key = hashlib.sha1("%s\t%d\t%r\t%r" % (path, stat.st_size, stat.st_mtime, nbSamples)).hexdigest()
+    return(os.path.join(cacheDir, key), identity)
+
+def readCacheEntry(entryDir, identity):
+    """
+    Return the list of the block files of a cache entry. None is returned
+    when the entry does not exist, is incomplete or was built from another
+    input file.
+
+    Keyword arguments:
+    entryDir -- the directory of the cache entry
+    identity -- the dictionary identifying the input file, as returned by getCacheEntry
+    """
+    try:
+        iFile = open_read_file(os.path.join(entryDir, "entry.json"))
+    except IOError:
+        return(None)
+    try:
+        entry = json.load(iFile)
+    except ValueError:
+        return(None)
+    finally:
+        iFile.close()
+    
+    for key in identity:
+        if entry.get(key) != identity[key]:
+            return(None)
+    blockFiles = [str(name) for name in entry['blocks']]
+    for name in blockFiles:
+        if not os.path.exists(os.path.join(entryDir, name)):
+            return(None)
+    return(blockFiles)
+
+def finishCacheEntry(entryDir, identity):
+    """
+    Write the description of a cache entry once all its blocks are written.
+    The entry is not valid before its description exists.
+
+    Keyword arguments:
+    entryDir -- the directory of the cache entry
+    identity -- the dictionary identifying the input file, as returned by getCacheEntry
+    """
+    entry = dict(identity)
+    entry['blocks'] = sorted([name for name in os.listdir(entryDir) if name.endswith(".npz")])
+    oFile = open_write_file(os.path.join(entryDir, "entry.json.tmp"))
+    json.dump(entry, oFile, indent=1)
+    oFile.close()
+    os.rename(os.path.join(entryDir, "entry.json.tmp"), os.path.join(entryDir, "entry.json"))
+
+def evictCacheEntries(cacheDir, sizeLimit, keep):
+    """
+    Remove the oldest entries of the cache until the size of the cache is
+    lower than the limit. The age of an entry is the last time it was built
+    or used.
+
+    Keyword arguments:
+    cacheDir -- the directory of the histogram cache
+    sizeLimit -- the maximum size of the cache, in bytes
+    keep -- the directory of an entry that must not be removed
+    """
+    entries = list()
+    total = 0
+    for name in os.listdir(cacheDir):
+        entryDir = os.path.join(cacheDir, name)
+        if not os.path.isdir(entryDir):
+            continue
+        size = sum([os.path.getsize(os.path.join(entryDir, f)) for f in os.listdir(entryDir)])
+        description = os.path.join(entryDir, "entry.json")
+        ## Incomplete entries are the first removed
+        age = 0
+        if os.path.exists(description):
+            age = os.path.getmtime(description)
+        entries.append((age, entryDir, size))
+        total += size
+    
+    for (age, entryDir, size) in sorted(entries):
+        if total <= sizeLimit:
+            break
+        if os.path.abspath(entryDir) == os.path.abspath(keep):
+            continue
+        shutil.rmtree(entryDir, ignore_errors=True)
+        total -= size
+
+class CacheWriter(object):
+    """
+    Write the blocks of a cache entry. Each block contains the positions,
+    their reference bases, the allele counts and the sparse histogram of the A, C, G and T of each
+    position by Phred and Mapq values.
+    """
+    
+    def __init__(self, entryDir, chunkNumber=0):
+        """
+        Keyword arguments:
+        entryDir -- the directory of the cache entry
+        chunkNumber -- the number of the chunk of the input file, used to order the blocks
+        """
+        self.entryDir = entryDir
+        self.chunkNumber = chunkNumber
+        self.blockNumber = 0
+    
+    def write(self, chromosomes, positions, refs, lettersCount, decoded, weights=None):
+        """
+        Write a block of positions.
+
+        Keyword arguments:
+        chromosomes -- the chromosome of each position
+        positions -- the positions, as found in the pileup lines
+        refs -- the reference base of each position
+        lettersCount -- the array returned by countAlleles
+        decoded -- the tuple returned by decodePileupColumns
+        weights -- the number of bases of each decoded value, None when each value is a single base
+        """
+        (alleles, phredValues, mapqValues, columns, indels) = decoded
+        selected = alleles < 4
+        keys = columns[selected].astype(numpy.int64) * 4 + alleles[selected]
+        keys = (keys * NB_QUALITIES + phredValues[selected] + ASCII_OFFSET) * NB_QUALITIES + mapqValues[selected] + ASCII_OFFSET
+        if weights is None:
+            (keys, weights) = numpy.unique(keys, return_counts=True)
+        else:
+            (keys, inverse) = numpy.unique(keys, return_inverse=True)
+            weights = numpy.bincount(inverse, weights=weights[selected]).astype(numpy.int64)
+        
+        name = "block_%06d_%06d.npz" % (self.chunkNumber, self.blockNumber)
+        oFile = open(os.path.join(self.entryDir, name), 'wb')
+        numpy.savez(oFile, chromosomes=numpy.array(chromosomes, dtype=str), positions=numpy.array(positions, dtype=str),
+                    refs=numpy.array(refs, dtype=str), counts=lettersCount, keys=keys, weights=weights)
+        oFile.close()
+        self.blockNumber += 1
+
+def writeCachedBlocks(entryDir, blockFiles, output, phreds, mapqs, regions=None, stats=None):
+    """
+    Compute the counts of each position from the blocks of a cache entry
+    and write them in the output, without reading the input file.
+
+    Keyword arguments:
+    entryDir -- the directory of the cache entry
+    blockFiles -- the list of block files, as returned by readCacheEntry
+    output -- the output receiving the counts, as returned by createOutput
+    phreds -- the Phred value thresholds
+    mapqs -- the Mapq value thresholds
+    regions -- the Regions to write, None to write all positions
+    stats -- the Statistics receiving the time of the cache and write stages and the number of positions, None to not collect statistics
+    """
+    for name in blockFiles:
+        start = time.time()
+        block = numpy.load(os.path.join(entryDir, name))
+        chromosomes = block['chromosomes'].tolist()
+        positions = block['positions'].tolist()
+        refs = block['refs'].tolist()
+        lettersCount = block['counts']
+        keys = block['keys']
+        weights = block['weights']
+        block.close()
+        
+        ## The counts contain a row for each position of each sample
+        rows = keys // (4 * NB_QUALITIES * NB_QUALITIES)
+        if regions is not None:
+            kept = numpy.array([regions.contains(chromosomes[i], int(positions[i])) for i in xrange(len(positions))], dtype=bool)
+            if not kept.any():
+                continue
+            keptRows = numpy.tile(kept, len(lettersCount) // len(positions))
+            newRows = numpy.cumsum(keptRows) - 1
+            selected = keptRows[rows]
+            (keys, weights, rows) = (keys[selected], weights[selected], newRows[rows[selected]])
+            chromosomes = [chromosomes[i] for i in numpy.flatnonzero(kept)]
+            positions = [positions[i] for i in numpy.flatnonzero(kept)]
+            refs = [refs[i] for i in numpy.flatnonzero(kept)]
+            lettersCount = lettersCount[keptRows]
+        
+        alleles = (keys // (NB_QUALITIES * NB_QUALITIES)) % 4
+        phredValues = (keys // NB_QUALITIES) % NB_QUALITIES - ASCII_OFFSET
+        mapqValues = keys % NB_QUALITIES - ASCII_OFFSET
+        decoded = (alleles, phredValues, mapqValues, rows, None)
+        thresholdsCount = countThresholds(decoded, len(lettersCount), phreds, mapqs, weights)
+        if stats is not None:
+            start = stats.addTime('cache', start)
+        output.write(chromosomes, positions, lettersCount, thresholdsCount, refs)
+        if stats is not None:
+            stats.addTime('write', start)
+            stats.countLines(len(positions))
+            stats.printProgress()
+
+class MonitoredQueue(Queue.Queue):
+    """
+    Bounded queue recording how full it is each time a block is added and
+    how often it is empty when a block is removed.
+    """
+    
+    def __init__(self, maxsize):
+        Queue.Queue.__init__(self, maxsize)
+        self.nbPuts = 0
+        self.nbFullPuts = 0
+        self.totalSize = 0
+        self.nbGets = 0
+        self.nbEmptyGets = 0
+    
+    def put(self, item):
+        size = self.qsize()
+        self.nbPuts += 1
+        self.totalSize += size
+        if size >= self.maxsize:
+            self.nbFullPuts += 1
+        Queue.Queue.put(self, item)
+    
+    def get(self):
+        self.nbGets += 1
+        if self.empty():
+            self.nbEmptyGets += 1
+        return(Queue.Queue.get(self))
+    
+    def report(self):
+        """
+        Return a dictionary containing the mean number of blocks found in the
+        queue when adding a block, the fraction of the additions that found
+        the queue full and the fraction of the removals that found it empty.
+        """
+        return(dict([('size', self.maxsize),
+                     ('meanFill', float(self.totalSize) / max(self.nbPuts, 1)),
+                     ('fullPuts', float(self.nbFullPuts) / max(self.nbPuts, 1)),
+                     ('emptyGets', float(self.nbEmptyGets) / max(self.nbGets, 1))]))
+
+def pipelineLines(lines, output, phreds, mapqs, cache=None, queueSize=QUEUE_SIZE, nbSamples=None, stats=None):
+    """
+    Decode the pileup lines by blocks and write the counts of each line in
+    the output using three stages running at the same time: a reader thread
+    building the blocks, the parser, running in the calling thread, and a
+    writer thread. The stages are connected by bounded queues so the memory
+    stays capped. Return a dictionary with the report of each queue: a
+    queue often full shows that the next stage is the bottleneck while a
+    queue often empty shows that the previous stage is the bottleneck.
+
+    Keyword arguments:
+    lines -- an iterable on the pileup lines
+    output -- the output receiving the counts, as returned by createOutput
+    phreds -- the Phred value thresholds
+    mapqs -- the Mapq value thresholds
+    cache -- the CacheWriter receiving the histograms, None when no cache is built
+    queueSize -- the maximum number of blocks in each queue
+    nbSamples -- the number of samples, None to detect it from the pileup lines
+    stats -- the Statistics receiving the time of each stage and the counters, None to not collect statistics
+    """
+    readQueue = MonitoredQueue(queueSize)
+    writeQueue = MonitoredQueue(queueSize)
+    errors = list()
+    
+    def reader():
+        try:
+            start = time.time()
+            for block in iterLineBlocks(lines):
+                if stats is not None:
+                    stats.addTime('read', start)
+                readQueue.put(block)
+                start = time.time()
+        except BaseException:
+            errors.append(sys.exc_info())
+        readQueue.put(None)
+    
+    def writer():
+        try:
+            while True:
+                result = writeQueue.get()
+                if result is None:
+                    break
+                writeBlock(result, output, cache, stats)
+        except BaseException:
+            errors.append(sys.exc_info())
+            ## The remaining blocks are consumed so the parser is not blocked
+            while writeQueue.get() is not None:
+                pass
+    
+    ## The reader does not prevent the program from exiting on a parsing problem
+    readerThread = threading.Thread(target=reader)
+    readerThread.daemon = True
+    readerThread.start()
+    writerThread = threading.Thread(target=writer)
+    writerThread.start()
+    
+    try:
+        while True:
+            block = readQueue.get()
+            if block is None:
+                break
+            writeQueue.put(parseBlock(block, phreds, mapqs, nbSamples, stats))
+    finally:
+        ## The blocks already parsed are written before leaving
+        writeQueue.put(None)
+        writerThread.join()
+    
+    readerThread.join()
+    if len(errors) > 0:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    
+    return(dict([('reader -> parser', readQueue.report()), ('parser -> writer', writeQueue.report())]))
+
+def printQueueReport(report):
+    """
+    Print the report of the queues of the pipelined mode on the standard error.
+
+    Keyword arguments:
+    report -- the dictionary returned by pipelineLines
+    """
+    for name in ('reader -> parser', 'parser -> writer'):
+        queue = report[name]
+        sys.stderr.write("Queue %s: mean fill %.1f/%d blocks, full on %.0f%% of puts, empty on %.0f%% of gets\n" %
+                         (name, queue['meanFill'], queue['size'], 100 * queue['fullPuts'], 100 * queue['emptyGets']))
+
+def printPeakMemory():
+    """
+    Print on the standard error the peak resident memory of the program and
+    the largest peak resident memory of its terminated processes.
+
+    Keyword arguments:
+    none
+    """
+    sys.stderr.write("Peak memory: %d KB, processes: %d KB\n" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                                                 resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+
+def readLines(iFile, start, end):
+    """
+    Generator returning the lines of the input file located between two
+    byte offsets. The offsets must be at the beginning of a line.
+
+    Keyword arguments:
+    iFile -- the input file pointer
+    start -- the byte offset of the first line
+    end   -- the byte offset following the last line
+    """
+    iFile.seek(start)
+    position = start
+    while position < end:
+        line = iFile.readline()
+        if not line:
+            break
+        position += len(line)
+        yield line
+
+def splitInputFile(inputFile, nbChunks):
+    """
+    Split the input file into byte ranges aligned on the beginning of the
+    lines and return a list of (start, end) tuples. Fewer ranges than
+    requested are returned when the file contains fewer lines.
+
+    Keyword arguments:
+    inputFile -- the name of the input file
+    nbChunks  -- the number of requested ranges
+    """
+    size = os.path.getsize(inputFile)
+    iFile = open_read_file(inputFile)
+    
+    boundaries = [0]
+    for i in xrange(1, nbChunks):
+        offset = size * i // nbChunks
+        if offset <= boundaries[-1]:
+            continue
+        ## Move to the beginning of the next line
+        iFile.seek(offset - 1)
+        iFile.readline()
+        offset = iFile.tell()
+        if boundaries[-1] < offset < size:
+            boundaries.append(offset)
+    boundaries.append(size)
+    iFile.close()
+    
+    return([(boundaries[i], boundaries[i + 1]) for i in xrange(len(boundaries) - 1) if boundaries[i] < boundaries[i + 1]])
+
+def parseChunk(arguments):
+    """
+    Parse a chunk of the input file and return a tuple containing the
+    content of the outputs, as returned by the getChunk method of the
+    outputs, and the state of the statistics of the chunk, None when no
+    statistics are collected. None is returned when the chunk cannot be
+    parsed.
+    Used by the processes of parsePileup.
+
+    Keyword arguments:
+    arguments -- a tuple containing the chunk, the number of the chunk,
+                 the output format, the separatedFiles boolean, the Phred
+                 and Mapq thresholds, the directory of the cache entry to
+                 build (or None), the number of samples (or None), the
+                 minAltCount, minAltFraction and binSize options and an
+                 boolean indicating if statistics are collected. The
+                 chunk is either a list of lines or a tuple with the name
+                 of the input file and a byte range
+    """
+    (chunk, chunkNumber, outputFormat, separatedFiles, phreds, mapqs, cacheEntry, nbSamples, minAltCount, minAltFraction, binSize, collectStats) = arguments
+    
+    output = createOutput(outputFormat, separatedFiles, phreds, mapqs, nbSamples=nbSamples,
+                          minAltCount=minAltCount, minAltFraction=minAltFraction, binSize=binSize)
+    cache = None
+    if cacheEntry is not None:
+        cache = CacheWriter(cacheEntry, chunkNumber)
+    stats = None
+    if collectStats:
+        stats = Statistics()
+    
+    iFile = None
+    try:
+        if isinstance(chunk, list):
+            lines = chunk
+        else:
+            (inputFile, start, end) = chunk
+            iFile = open_read_file(inputFile)
+            lines = readLines(iFile, start, end)
+        writeLines(lines, output, phreds, mapqs, cache, nbSamples, stats=stats)
+    except SystemExit:
+        ## The problem has already been printed, the main process must stop
+        return(None)
+    except ValueError as e:
+        print(e)
+        return(None)
+    finally:
+        if iFile is not None:
+            iFile.close()
+    
+    if stats is not None:
+        return(output.getChunk(), stats.getState())
+    return(output.getChunk(), None)
+
+class Regions(object):
+    """
+    Sorted and merged genomic intervals of each chromosome. The positions
+    are 1-based and the intervals include both ends.
+    """
+    
+    def __init__(self):
+        self.starts = dict()
+        self.ends = dict()
+    
+    def add(self, chromosome, start, end):
+        """
+        Add an interval and merge it with the overlapping or adjacent intervals.
+
+        Keyword arguments:
+        chromosome -- the name of the chromosome
+        start -- the first position of the interval
+        end -- the last position of the interval
+        """
+        starts = self.starts.setdefault(chromosome, list())
+        ends = self.ends.setdefault(chromosome, list())
+        ## Intervals ending before start - 1 and starting after end + 1 are kept
+        first = bisect.bisect_left(ends, start - 1)
+        last = bisect.bisect_right(starts, end + 1)
+        if first < last:
+            start = min(start, starts[first])
+            end = max(end, ends[last - 1])
+        starts[first:last] = [start]
+        ends[first:last] = [end]
+    
+    def contains(self, chromosome, position):
+        """
+        Return True when the position is located in one of the intervals.
+
+        Keyword arguments:
+        chromosome -- the name of the chromosome
+        position -- the position
+        """
+        starts = self.starts.get(chromosome)
+        if starts is None:
+            return(False)
+        i = bisect.bisect_right(starts, position) - 1
+        return(i >= 0 and position <= self.ends[chromosome][i])
+    
+    def intervals(self, chromosome):
+        """
+        Return the list of (start, end) intervals of a chromosome.
+
+        Keyword arguments:
+        chromosome -- the name of the chromosome
+        """
+        return(zip(self.starts.get(chromosome, list()), self.ends.get(chromosome, list())))
+
+def extractRegions(regions, bedFile=None):
+    """
+    Create and return the Regions containing the regions given as strings
+    and the intervals of a BED file.
+    A ValueError is raised when a region cannot be parsed.
+
+    Keyword arguments:
+    regions -- a list of regions formatted as "chr", "chr:start" or "chr:start-end"
+    bedFile -- the name of a BED file, the intervals are 0-based and exclude the end
+    """
+    result = Regions()
+    for region in regions:
+        res = match(r"^(.+?)(?::([\d,]+)(?:-([\d,]+))?)?$", region)
+        if res is None:
+            raise ValueError("Cannot parse region : %s" % (region))
+        (chromosome, start, end) = res.groups()
+        start = int(start.replace(",", "")) if start else 1
+        end = int(end.replace(",", "")) if end else sys.maxint
+        if start > end:
+            raise ValueError("Cannot parse region : %s" % (region))
+        result.add(chromosome, start, end)
+    
+    if bedFile is not None:
+        iFile = open_read_file(bedFile)
+        for line in iFile:
+            if line.startswith("#") or line.startswith("track") or line.startswith("browser") or not line.strip():
+                continue
+            data = line.rstrip("\r\n").split("\t")
+            try:
+                (start, end) = (int(data[1]) + 1, int(data[2]))
+            except (IndexError, ValueError):
+                raise ValueError("Cannot parse BED line : %s" % (line.rstrip("\r\n")))
+            if start <= end:
+                result.add(data[0], start, end)
+        iFile.close()
+    return(result)
+
+def buildIndex(inputFile, blockSize=INDEX_BLOCK_SIZE):
+    """
+    Write the index of the input file in a file with the INDEX_EXTENSION
+    extension. The index contains the byte offset of the first line of each
+    chromosome and of each block of blockSize positions.
+    An IOError is raised when the input file is compressed.
+
+    Keyword arguments:
+    inputFile -- the name of the input file
+    blockSize -- the number of positions of each block
+    """
+    if not is_plain_file(inputFile):
+        raise IOError("Cannot index compressed file, pipe or standard input : %s \n\n" % (inputFile))
+    
+    iFile = open_read_file(inputFile)
+    oFile = open_write_file(inputFile + INDEX_EXTENSION)
+    stat = os.stat(inputFile)
+    oFile.write("#size\t%d\tmtime\t%d\tblock\t%d\n" % (stat.st_size, int(stat.st_mtime), blockSize))
+    
+    offset = 0
+    previous = (None, None)
+    line = iFile.readline()
+    while line:
+        data = line.split("\t", 2)
+        current = (data[0], int(data[1]) // blockSize)
+        if current != previous:
+            oFile.write("%s\t%d\t%d\n" % (current[0], current[1], offset))
+            previous = current
+        offset += len(line)
+        line = iFile.readline()
+    
+    oFile.close()
+    iFile.close()
+
+def readIndex(inputFile):
+    """
+    Read the index of the input file and return a tuple containing the
+    block size, the list of chromosomes in the order of the file and a
+    dictionary with, for each chromosome, the list of indexed blocks and
+    the list of their offsets. None is returned when the index does not
+    exist or does not match the input file.
+
+    Keyword arguments:
+    inputFile -- the name of the input file
+    """
+    if inputFile == "-" or not os.path.exists(inputFile + INDEX_EXTENSION):
+        return(None)
+    
+    iFile = open_read_file(inputFile + INDEX_EXTENSION)
+    header = iFile.readline().rstrip("\n").split("\t")
+    stat = os.stat(inputFile)
+    if int(header[1]) != stat.st_size or int(header[3]) != int(stat.st_mtime):
+        sys.stderr.write("The index %s does not match the input file and is ignored\n" % (inputFile + INDEX_EXTENSION))
+        iFile.close()
+        return(None)
+    
+    chromosomes = list()
+    blocks = dict()
+    for line in iFile:
+        (chromosome, block, offset) = line.rstrip("\n").split("\t")
+        if chromosome not in blocks:
+            chromosomes.append(chromosome)
+            blocks[chromosome] = (list(), list())
+        blocks[chromosome][0].append(int(block))
+        blocks[chromosome][1].append(int(offset))
+    iFile.close()
+    
+    return(int(header[5]), chromosomes, blocks)
+
+def readIndexedLines(iFile, index, regions):
+    """
+    Generator returning the lines of the input file located in the regions,
+    in the order of the file. The index is used to seek directly to the
+    block containing the beginning of each interval.
+
+    Keyword arguments:
+    iFile -- the input file pointer
+    index -- the tuple returned by readIndex
+    regions -- the Regions to extract
+    """
+    (blockSize, chromosomes, blocks) = index
+    for chromosome in chromosomes:
+        (blockNumbers, offsets) = blocks[chromosome]
+        offset = None
+        for (start, end) in regions.intervals(chromosome):
+            i = bisect.bisect_right(blockNumbers, start // blockSize) - 1
+            blockOffset = offsets[max(i, 0)]
+            ## Lines located before the current offset have already been read
+            if offset is None or blockOffset > offset:
+                offset = blockOffset
+                iFile.seek(offset)
+            while True:
+                line = iFile.readline()
+                if not line:
+                    break
+                data = line.split("\t", 2)
+                position = int(data[1])
+                if data[0] != chromosome or position > end:
+                    ## The line may belong to the next interval
+                    iFile.seek(offset)
+                    break
+                offset += len(line)
+                if position >= start:
+                    yield line
+
+def filterRegionLines(lines, regions):
+    """
+    Generator returning the pileup lines located in the regions.
+
+    Keyword arguments:
+    lines -- an iterable on the pileup lines
+    regions -- the Regions to extract
+    """
+    for line in lines:
+        data = line.split("\t", 2)
+        if regions.contains(data[0], int(data[1])):
+            yield line
+
+def readInputLines(inputFile, regions=None):
+    """
+    Generator returning the lines of the input file. When regions are
+    given, only the lines located in the regions are returned and the
+    index of the input file is used, when available, to avoid reading the
+    whole file.
+
+    Keyword arguments:
+    inputFile -- the name of the input file, "-" for the standard input
+    regions -- the Regions to extract, None to return all lines
+    """
+    iFile = open_read_file(inputFile)
+    try:
+        if regions is None:
+            for line in iFile:
+                yield line
+        else:
+            index = None
+            if not isinstance(iFile, GzipReader):
+                index = readIndex(inputFile)
+            if index is not None:
+                for line in readIndexedLines(iFile, index, regions):
+                    yield line
+            else:
+                for line in filterRegionLines(iFile, regions):
+                    yield line
+    finally:
+        iFile.close()
+
+def readChunks(inputFile, threads, regions=None, offset=0):
+    """
+    Generator returning the chunks of the input file parsed by the
+    processes of parsePileup. Plain files are split into byte ranges while
+    the standard input, compressed files and regions are split into lists
+    of lines.
+
+    Keyword arguments:
+    inputFile -- the name of the input file, "-" for the standard input
+    threads -- the number of processes, the minimum number of byte ranges
+    regions -- the Regions to extract, None to parse all lines
+    offset -- the byte offset of the first line to parse in a plain file
+    """
+    if regions is None and is_plain_file(inputFile):
+        nbChunks = max(threads, os.path.getsize(inputFile) // CHUNK_SIZE)
+        ## The ranges do not depend on the offset, so a resumed parsing
+        ## gets the chunks of an uninterrupted parsing
+        for (start, end) in splitInputFile(inputFile, nbChunks):
+            if end > offset:
+                yield (inputFile, max(start, offset), end)
+    else:
+        for chunk in iterLineBlocks(readInputLines(inputFile, regions), CHUNK_LINES, CHUNK_SIZE):
+            yield chunk
+
+def writeChunkResult(pending, output, checkpoint=None, stats=None):
+    """
+    Wait for the result of a chunk parsed by a process and write it in the
+    output. The program stops when the chunk cannot be parsed.
+
+    Keyword arguments:
+    pending -- a tuple containing the chunk and the result of parseChunk
+    output -- the output of the parsing
+    checkpoint -- the Checkpoint following the bytes of the written chunks, None when no checkpoint is written
+    stats -- the Statistics receiving the statistics of the chunk, None to not collect statistics
+    """
+    (chunk, result) = pending
+    result = result.get()
+    if result is None:
+        sys.exit(2)
+    (content, chunkStats) = result
+    start = time.time()
+    output.writeChunk(content)
+    if stats is not None:
+        stats.addTime('write', start)
+        stats.merge(chunkStats)
+    if checkpoint is not None:
+        (inputFile, start, end) = chunk
+        checkpoint.update(end - start, output)
+
+def parsePileup(inputFile, outputPrefix, separatedFiles, phreds=DEFAULT_PHREDS, mapqs=DEFAULT_MAPQS, threads=1, compression=None, outputFormat="text", regions=None,
+                cacheDir=None, rebuildCache=False, cacheLimit=None, pipeline=False, queueSize=QUEUE_SIZE, nbSamples=None,
+                minAltCount=None, minAltFraction=None, binSize=None, checkpointSize=None, resume=False, stats=None, bufferSize=WRITE_BUFFER_SIZE,
+                compressThreads=None, append=False):
+    """
+    Parse the pileup file and write the counts of each position in the
+    output files.
+
+    Keyword arguments:
+    inputFile -- the name of the input file, "-" for the standard input
+    outputPrefix -- the prefix of the output files
+    separatedFiles -- an boolean indicating if the position file should be created separately
+    phreds -- the Phred value thresholds used for the threshold files
+    mapqs -- the Mapq value thresholds used for the threshold files
+    threads -- the number of processes used to parse the input file
+    compression -- the compression of the text output files, None, "gzip" or "bgzip"
+    outputFormat -- the format of the output files, "text" or "columns"
+    regions -- the Regions to parse, as returned by extractRegions, None to parse the whole file
+    cacheDir -- the directory of the histogram cache, None to not use a cache
+    rebuildCache -- an boolean indicating if the cache entry of the input file should be rebuilt
+    cacheLimit -- the maximum size of the cache directory, in bytes, None for no limit
+    pipeline -- an boolean indicating if the reading, the parsing and the writing should run
+                in concurrent stages, used when a single process parses the file
+    queueSize -- the maximum number of blocks waiting between two stages of the pipelined mode
+    nbSamples -- the number of samples, None to detect it from the number of columns of the pileup lines
+    minAltCount -- the minimum number of non-reference bases of the written positions, None for no minimum
+    minAltFraction -- the minimum fraction of non-reference bases of the written positions, None for no minimum
+    binSize -- the number of positions of the windows whose counts are written instead of the positions, None to write each position
+    checkpointSize -- the number of input bytes parsed between two checkpoints, None to not write checkpoints.
+                      The checkpoints need a plain input file parsed without regions, cache or pipeline
+    resume -- an boolean indicating if the parsing should continue from the last checkpoint
+    stats -- the Statistics receiving the time of each stage and the counters, None to not collect statistics
+    bufferSize -- the number of bytes of formatted text kept before being written in the text output files
+    compressThreads -- the number of threads compressing the blocks of the bgzip output files, None to compress them in the main thread
+    append -- an boolean indicating if the lines not covered by the existing outputs should be appended to them.
+              The appended lines need a plain input file parsed without regions, cache, checkpoints or bins
+    """
+    
+    checkpoint = None
+    ranges = None
+    state = None
+    offset = None
+    if append:
+        if not is_plain_file(inputFile):
+            print("Cannot append compressed file, pipe or standard input : %s" % (inputFile))
+            sys.exit(2)
+        settings = dict([('separatedFiles', separatedFiles), ('phreds', phreds), ('mapqs', mapqs), ('compression', compression),
+                         ('outputFormat', outputFormat), ('minAltCount', minAltCount), ('minAltFraction', minAltFraction)])
+        ranges = CoveredRanges(outputPrefix + RANGES_EXTENSION, settings)
+        state = ranges.load()
+        ranges.scan(inputFile, nbSamples)
+        offset = ranges.offset
+        if state is not None and offset == os.path.getsize(inputFile):
+            print("All the lines of %s are already in the outputs" % (inputFile))
+            return
+    elif os.path.exists(outputPrefix + RANGES_EXTENSION):
+        ## The outputs are written again, the recorded ranges no longer describe them
+        os.remove(outputPrefix + RANGES_EXTENSION)
+    
+    if checkpointSize is not None or resume:
+        if not is_plain_file(inputFile):
+            print("Cannot checkpoint compressed file, pipe or standard input : %s" % (inputFile))
+            sys.exit(2)
+        stat = os.stat(inputFile)
+        settings = dict([('input', os.path.abspath(inputFile)), ('size', stat.st_size), ('mtime', int(stat.st_mtime)),
+                         ('separatedFiles', separatedFiles), ('phreds', phreds), ('mapqs', mapqs), ('compression', compression),
+                         ('outputFormat', outputFormat), ('nbSamples', nbSamples), ('minAltCount', minAltCount),
+                         ('minAltFraction', minAltFraction), ('binSize', binSize)])
+        checkpoint = Checkpoint(outputPrefix + CHECKPOINT_EXTENSION, settings, checkpointSize)
+        if resume:
+            state = checkpoint.load()
+        offset = checkpoint.offset
+    
+    compressionPool = None
+    if compressThreads is not None and compression == "bgzip":
+        ## The blocks of all output files are compressed by the same threads
+        compressionPool = ThreadPool(compressThreads)
+    
+    ## Open all output files
+    output = createOutput(outputFormat, separatedFiles, phreds, mapqs, outputPrefix, compression, nbSamples, minAltCount, minAltFraction, binSize,
+                          state=state, bufferSize=bufferSize, compressionPool=compressionPool)
+    
+    blockFiles = None
+    cacheEntry = None
+    ## The content of a pipe is not identified by its size and modification time
+    if cacheDir is not None and inputFile != "-" and os.path.isfile(inputFile):
+        (entryDir, identity) = getCacheEntry(cacheDir, inputFile, nbSamples)
+        if not rebuildCache:
+            blockFiles = readCacheEntry(entryDir, identity)
+        if blockFiles is None and regions is None:
+            ## The entry is only built when the whole file is parsed
+            shutil.rmtree(entryDir, ignore_errors=True)
+            os.makedirs(entryDir)
+            cacheEntry = entryDir
+    
+    try:
+        if blockFiles is not None:
+            ## The histograms of the cache are used instead of the input file
+            writeCachedBlocks(entryDir, blockFiles, output, phreds, mapqs, regions, stats)
+            os.utime(os.path.join(entryDir, "entry.json"), None)
+            if cacheLimit is not None:
+                evictCacheEntries(cacheDir, cacheLimit, entryDir)
+        elif threads > 1:
+            ## Each process parses a chunk of the input file, the chunks are
+            ## written in the order of the file. The number of pending chunks
+            ## is limited so the memory stays bounded when reading a stream
+            pool = multiprocessing.Pool(threads)
+            try:
+                pending = collections.deque()
+                for (chunkNumber, chunk) in enumerate(readChunks(inputFile, threads, regions, offset or 0)):
+                    pending.append((chunk, pool.apply_async(parseChunk, ((chunk, chunkNumber, outputFormat, separatedFiles, phreds, mapqs, cacheEntry,
+                                                                          nbSamples, minAltCount, minAltFraction, binSize, stats is not None),))))
+                    while len(pending) >= 2 * threads or (pending and pending[0][1].ready()):
+                        writeChunkResult(pending.popleft(), output, checkpoint, stats)
+                while pending:
+                    writeChunkResult(pending.popleft(), output, checkpoint, stats)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            cache = None
+            if cacheEntry is not None:
+                cache = CacheWriter(cacheEntry)
+            if pipeline and offset is not None:
+                iFile = open_read_file(inputFile)
+                printQueueReport(pipelineLines(readLines(iFile, offset, os.path.getsize(inputFile)), output, phreds, mapqs, cache, queueSize, nbSamples,
+                                               stats))
+                iFile.close()
+            elif pipeline:
+                printQueueReport(pipelineLines(readInputLines(inputFile, regions), output, phreds, mapqs, cache, queueSize, nbSamples, stats))
+            elif offset is not None:
+                iFile = open_read_file(inputFile)
+                writeLines(readLines(iFile, offset, os.path.getsize(inputFile)), output, phreds, mapqs, cache, nbSamples, checkpoint, stats)
+                iFile.close()
+            else:
+                writeLines(readInputLines(inputFile, regions), output, phreds, mapqs, cache, nbSamples, stats=stats)
+    except ValueError as e:
+        ## The output files are left incomplete
+        print(e)
+        sys.exit(2)
+    
+    if cacheEntry is not None:
+        finishCacheEntry(cacheEntry, identity)
+        if cacheLimit is not None:
+            evictCacheEntries(cacheDir, cacheLimit, cacheEntry)
+    
+    if ranges is not None:
+        ranges.save(output)
+    
+    ## Close all files
+    output.close()
+    if compressionPool is not None:
+        compressionPool.close()
+        compressionPool.join()
+    if checkpoint is not None:
+        checkpoint.remove()
+    
+if __name__ == "__main__":
+    
+    # Extract arguments. Message shown when the number of arguments is not coherent
+    (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+    reportMemory = options.pop('reportMemory', False)
+    statsFile = options.pop('statsFile', None)
+    progressInterval = options.pop('progressInterval', None)
+    profileFile = options.pop('profileFile', None)
+    if statsFile is not None or progressInterval is not None:
+        options['stats'] = Statistics(progressInterval)
+    if options.pop('buildIndex', False):
+        # Indexing pileup file
+        buildIndex(inputFile)
+    elif profileFile is not None:
+        # Parsing pileup file, the profile only contains the main process and thread
+        cProfile.run("parsePileup(inputFile, outputPrefix, separatedFiles, **options)", profileFile)
+    else:
+        # Parsing pileup file
+        parsePileup(inputFile, outputPrefix, separatedFiles, **options)
+    if statsFile is not None:
+        options['stats'].writeSummary(statsFile)
+    if reportMemory:
+        printPeakMemory()
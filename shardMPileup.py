@@ -0,0 +1,513 @@
+#!/usr/bin/python
+
+#############################################################################
+## Title: shardMPileup.py
+## Description: Split the parsing of a samtools mpileup file into shards
+##              processed independently, on several nodes, and merge the
+##              outputs of the shards into the outputs of parseMPileup.py
+##
+## Author: Pascal Belleau and Astrid Deschenes
+## Creation: 2017-09-14
+## License: GPL-3
+#############################################################################
+
+##################
+## IMPORT
+##################
+
+import os
+import sys
+import json
+import getopt
+import shutil
+
+from parseMPileup import BGZF_EOF
+from parseMPileup import COLUMNS
+from parseMPileup import COMPRESSIONS
+from parseMPileup import DEFAULT_MAPQS
+from parseMPileup import DEFAULT_PHREDS
+from parseMPileup import OUTPUT_FORMATS
+from parseMPileup import READ_SIZE
+from parseMPileup import TEXT_HEADER
+from parseMPileup import THRESHOLD_HEADER
+from parseMPileup import ColumnOutput
+from parseMPileup import compressBgzfBlock
+from parseMPileup import countSamples
+from parseMPileup import createOutput
+from parseMPileup import extractThresholds
+from parseMPileup import is_plain_file
+from parseMPileup import loadColumns
+from parseMPileup import open_read_file
+from parseMPileup import open_write_file
+from parseMPileup import readIndex
+from parseMPileup import readLines
+from parseMPileup import splitInputFile
+from parseMPileup import writeLines
+
+##################
+## CONSTANTS
+##################
+
+## Version of the manifest, a manifest of another version is refused
+MANIFEST_VERSION = 1
+
+## Ways of splitting the input file
+SPLITS = ("lines", "chromosomes")
+
+## Options of parsePileup recorded in the manifest and used by all shards
+SHARD_OPTIONS = ('separatedFiles', 'phreds', 'mapqs', 'outputFormat', 'compression', 'nbSamples',
+                 'minAltCount', 'minAltFraction', 'binSize')
+
+def getInputIdentity(inputFile):
+    """
+    Return a dictionary identifying the input file, so a shard is not run
+    on a file modified after the plan.
+
+    Keyword arguments:
+    inputFile -- the name of the input file
+    """
+    stat = os.stat(inputFile)
+    return(dict([('path', os.path.abspath(inputFile)), ('size', stat.st_size), ('mtime', int(stat.st_mtime))]))
+
+def splitChromosomes(inputFile, nbShards):
+    """
+    Split the input file into byte ranges starting with the first line of
+    a chromosome and return a list of (start, end) tuples. The ranges are
+    balanced on their size, fewer ranges than requested are returned when
+    the file contains fewer chromosomes. The index of the file is used when
+    it exists.
+
+    Keyword arguments:
+    inputFile -- the name of the input file
+    nbShards  -- the number of requested ranges
+    """
+    size = os.path.getsize(inputFile)
+    index = readIndex(inputFile)
+    if index is not None:
+        (blockSize, chromosomes, blocks) = index
+        starts = [blocks[chromosome][1][0] for chromosome in chromosomes]
+    else:
+        starts = list()
+        previous = None
+        offset = 0
+        iFile = open_read_file(inputFile)
+        for line in iFile:
+            chromosome = line.split("\t", 1)[0]
+            if chromosome != previous:
+                starts.append(offset)
+                previous = chromosome
+            offset += len(line)
+        iFile.close()
+
+    ## Each boundary is the start of the chromosome closest to an equal split
+    boundaries = [0]
+    for i in xrange(1, nbShards):
+        target = size * i // nbShards
+        candidates = [start for start in starts if start > boundaries[-1]]
+        if len(candidates) == 0:
+            break
+        boundary = min(candidates, key=lambda start: abs(start - target))
+        if boundary < size:
+            boundaries.append(boundary)
+    boundaries.append(size)
+
+    return([(boundaries[i], boundaries[i + 1]) for i in xrange(len(boundaries) - 1) if boundaries[i] < boundaries[i + 1]])
+
+def detectSamples(inputFile):
+    """
+    Return the number of samples of the first line of the input file,
+    1 when the file is empty. A ValueError is raised when the number of
+    samples cannot be detected.
+
+    Keyword arguments:
+    inputFile -- the name of the input file
+    """
+    iFile = open_read_file(inputFile)
+    line = iFile.readline()
+    iFile.close()
+    return(countSamples(len(line.rstrip("\n").split("\t")) - 3))
+
+def writeJson(fileName, content):
+    """
+    Write a JSON file atomically: the content is written in a temporary
+    file renamed once complete.
+
+    Keyword arguments:
+    fileName -- the name of the JSON file
+    content -- the content to write
+    """
+    oFile = open(fileName + ".tmp", 'w')
+    json.dump(content, oFile, indent=1, sort_keys=True)
+    oFile.close()
+    os.rename(fileName + ".tmp", fileName)
+
+def planShards(inputFile, outputPrefix, manifestFile, nbShards, split="lines", **options):
+    """
+    Split the input file into shards and write the manifest describing
+    them. Return the manifest.
+
+    Keyword arguments:
+    inputFile -- the name of the input file, not compressed
+    outputPrefix -- the prefix of the merged output files
+    manifestFile -- the name of the manifest file
+    nbShards -- the number of requested shards
+    split -- "lines" to split the file anywhere between two lines or
+             "chromosomes" to keep each chromosome in a single shard
+    options -- the parsePileup options used by all shards, among SHARD_OPTIONS
+    """
+    if not is_plain_file(inputFile):
+        print("Cannot split compressed file, pipe or standard input : %s" % (inputFile))
+        sys.exit(2)
+    if options.get('binSize') is not None and split != "chromosomes":
+        ## A window split between two shards would be written twice
+        print("The binned mode needs shards split along the chromosomes")
+        sys.exit(2)
+
+    shardOptions = dict([('separatedFiles', False), ('phreds', DEFAULT_PHREDS), ('mapqs', DEFAULT_MAPQS), ('outputFormat', "text"),
+                         ('compression', None), ('nbSamples', None), ('minAltCount', None), ('minAltFraction', None), ('binSize', None)])
+    shardOptions.update(options)
+    if shardOptions['nbSamples'] is None:
+        ## The shards must all write the same number of samples, even when empty
+        try:
+            shardOptions['nbSamples'] = detectSamples(inputFile)
+        except ValueError as e:
+            print(e)
+            sys.exit(2)
+
+    if split == "chromosomes":
+        ranges = splitChromosomes(inputFile, nbShards)
+    else:
+        ranges = splitInputFile(inputFile, nbShards)
+    if len(ranges) == 0:
+        ## An empty input file gives a single empty shard
+        ranges = [(0, 0)]
+
+    manifest = dict([('version', MANIFEST_VERSION), ('input', getInputIdentity(inputFile)), ('outputPrefix', os.path.abspath(outputPrefix)),
+                     ('split', split), ('options', shardOptions),
+                     ('shards', [dict([('shard', shard), ('start', start), ('end', end)]) for (shard, (start, end)) in enumerate(ranges)])])
+    writeJson(manifestFile, manifest)
+    return(manifest)
+
+def readManifest(manifestFile):
+    """
+    Read and verify a manifest written by planShards. The problems are
+    printed and the program stops.
+
+    Keyword arguments:
+    manifestFile -- the name of the manifest file
+    """
+    try:
+        iFile = open(manifestFile)
+        manifest = json.load(iFile)
+        iFile.close()
+    except (IOError, ValueError):
+        print("Cannot read manifest : %s" % (manifestFile))
+        sys.exit(2)
+    if manifest.get('version') != MANIFEST_VERSION:
+        print("Unknown version of manifest : %s" % (manifestFile))
+        sys.exit(2)
+
+    ## The shards must cover the whole input file, without gap or overlap
+    end = 0
+    for (shard, entry) in enumerate(manifest['shards']):
+        if entry['shard'] != shard:
+            print("Problem with the manifest: shard %d is missing" % (shard))
+            sys.exit(2)
+        if entry['start'] != end:
+            print("Problem with the manifest: shard %d starts at %d instead of %d" % (shard, entry['start'], end))
+            sys.exit(2)
+        end = entry['end']
+    if end != manifest['input']['size']:
+        print("Problem with the manifest: the shards end at %d instead of %d" % (end, manifest['input']['size']))
+        sys.exit(2)
+
+    options = manifest['options']
+    options['phreds'] = tuple(options['phreds'])
+    options['mapqs'] = tuple(options['mapqs'])
+    for name in ('outputFormat', 'compression'):
+        if options[name] is not None:
+            options[name] = str(options[name])
+    manifest['input']['path'] = str(manifest['input']['path'])
+    manifest['outputPrefix'] = str(manifest['outputPrefix'])
+    return(manifest)
+
+def getShardPrefix(manifest, shard):
+    """
+    Return the prefix of the output files of a shard.
+
+    Keyword arguments:
+    manifest -- the manifest returned by readManifest
+    shard -- the number of the shard
+    """
+    return("%s_shard%04d" % (manifest['outputPrefix'], shard))
+
+def runShard(manifestFile, shard):
+    """
+    Parse the lines of a shard and write its outputs, without headers. A
+    file recording the completion of the shard is written last.
+
+    Keyword arguments:
+    manifestFile -- the name of the manifest file
+    shard -- the number of the shard
+    """
+    manifest = readManifest(manifestFile)
+    if not 0 <= shard < len(manifest['shards']):
+        print("Problem with the shard: %d is not between 0 and %d" % (shard, len(manifest['shards']) - 1))
+        sys.exit(2)
+    inputFile = manifest['input']['path']
+    if getInputIdentity(inputFile) != manifest['input']:
+        print("The input file %s has changed since the plan" % (inputFile))
+        sys.exit(2)
+
+    entry = manifest['shards'][shard]
+    options = manifest['options']
+    shardPrefix = getShardPrefix(manifest, shard)
+    output = createOutput(options['outputFormat'], options['separatedFiles'], options['phreds'], options['mapqs'], shardPrefix,
+                          options['compression'], options['nbSamples'], options['minAltCount'], options['minAltFraction'],
+                          options['binSize'], header=False)
+    iFile = open_read_file(inputFile)
+    try:
+        writeLines(readLines(iFile, entry['start'], entry['end']), output, options['phreds'], options['mapqs'], nbSamples=options['nbSamples'])
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    iFile.close()
+    output.close()
+
+    writeJson(shardPrefix + "_shard.json", dict([('input', manifest['input']), ('shard', entry)]))
+
+def getOutputFiles(options, outputPrefix):
+    """
+    Return the list of the output files written with a prefix, as tuples
+    containing the name of the file and its header, None when the file has
+    no header.
+
+    Keyword arguments:
+    options -- the options of the manifest
+    outputPrefix -- the prefix of the output files
+    """
+    if options['outputFormat'] == "columns":
+        return([(outputPrefix + "_" + name + ".npy", None) for name in COLUMNS] + [(outputPrefix + "_columns.json", None)])
+
+    extension = ".txt"
+    if options['compression'] is not None:
+        extension = ".txt.gz"
+    if options['separatedFiles']:
+        files = [(outputPrefix + extension, None), (outputPrefix + "_pos" + extension, None)]
+    else:
+        files = [(outputPrefix + extension, TEXT_HEADER)]
+    for phred in options['phreds']:
+        for mapq in options['mapqs']:
+            files.append((outputPrefix + "_" + str(phred) + "_" + str(mapq) + extension, None if options['separatedFiles'] else THRESHOLD_HEADER))
+    return(files)
+
+def mergeTextFile(outputFile, header, shardFiles, compression=None):
+    """
+    Write an output file with its header followed by the content of the
+    files of the shards. The compressed files are concatenated without
+    being decompressed: gzip members follow each other and the end of file
+    block of bgzip is only written at the end.
+
+    Keyword arguments:
+    outputFile -- the name of the output file
+    header -- the header of the file, None when the file has no header
+    shardFiles -- the names of the files of the shards, in order
+    compression -- the compression of the files, None, "gzip" or "bgzip"
+    """
+    if header is not None and compression == "gzip":
+        ## The header is a gzip member of its own
+        oFile = open_write_file(outputFile, compression)
+        oFile.write(header)
+        oFile.close()
+        oFile = open(outputFile, 'ab')
+    else:
+        oFile = open(outputFile, 'wb')
+        if header is not None and compression == "bgzip":
+            oFile.write(compressBgzfBlock(header))
+        elif header is not None:
+            oFile.write(header)
+
+    for shardFile in shardFiles:
+        iFile = open(shardFile, 'rb')
+        if compression == "bgzip":
+            ## The shard is copied by pieces up to its end of file block
+            iFile.seek(0, os.SEEK_END)
+            size = iFile.tell()
+            if size >= len(BGZF_EOF):
+                iFile.seek(size - len(BGZF_EOF))
+                if iFile.read() == BGZF_EOF:
+                    size -= len(BGZF_EOF)
+            iFile.seek(0)
+            while size > 0:
+                data = iFile.read(min(READ_SIZE, size))
+                if not data:
+                    break
+                oFile.write(data)
+                size -= len(data)
+        else:
+            shutil.copyfileobj(iFile, oFile)
+        iFile.close()
+
+    if compression == "bgzip":
+        oFile.write(BGZF_EOF)
+    oFile.close()
+
+def mergeShards(manifestFile, removeShards=False):
+    """
+    Merge the outputs of the shards into the outputs of a single run of
+    parsePileup. Every shard of the manifest must be complete.
+
+    Keyword arguments:
+    manifestFile -- the name of the manifest file
+    removeShards -- an boolean indicating if the outputs of the shards should be removed once merged
+    """
+    manifest = readManifest(manifestFile)
+    options = manifest['options']
+
+    for entry in manifest['shards']:
+        statusFile = getShardPrefix(manifest, entry['shard']) + "_shard.json"
+        try:
+            iFile = open(statusFile)
+            status = json.load(iFile)
+            iFile.close()
+        except (IOError, ValueError):
+            print("Problem with the shards: shard %d is not complete" % (entry['shard']))
+            sys.exit(2)
+        if status['input'] != manifest['input'] or status['shard'] != entry:
+            print("Problem with the shards: shard %d does not match the manifest" % (entry['shard']))
+            sys.exit(2)
+
+    suffixes = [""]
+    if options['nbSamples'] > 1:
+        suffixes = ["_sample%d" % (sample + 1) for sample in xrange(options['nbSamples'])]
+    shardFiles = list()
+    for suffix in suffixes:
+        outputPrefix = manifest['outputPrefix'] + suffix
+        shardPrefixes = [getShardPrefix(manifest, entry['shard']) + suffix for entry in manifest['shards']]
+        if options['outputFormat'] == "columns":
+            output = ColumnOutput(options['phreds'], options['mapqs'], outputPrefix)
+            for shardPrefix in shardPrefixes:
+                ## The memory-mapped columns are copied by slices of rows
+                columns = loadColumns(shardPrefix)
+                output.writeChunk((columns['chromosomes'], dict([(name, columns[name]) for name in COLUMNS])))
+            output.close()
+        else:
+            for (outputFile, header) in getOutputFiles(options, outputPrefix):
+                files = [shardPrefix + outputFile[len(outputPrefix):] for shardPrefix in shardPrefixes]
+                mergeTextFile(outputFile, header, files, options['compression'])
+        for shardPrefix in shardPrefixes:
+            shardFiles.extend([shardFile for (shardFile, header) in getOutputFiles(options, shardPrefix)])
+
+    if removeShards:
+        for shardFile in shardFiles:
+            os.remove(shardFile)
+        for entry in manifest['shards']:
+            os.remove(getShardPrefix(manifest, entry['shard']) + "_shard.json")
+
+def extractArguments():
+    """
+    Extract argument values as input by user and return a tuple containing
+    the command and a dictionary with the options.
+
+    Keyword arguments:
+    none
+    """
+    usage = """usage: shardMPileup.py plan -i <inputFile> -p <outputPrefix> -m <manifestFile> -n <shards> [--split <lines|chromosomes>] [-s] [-z <gzip|bgzip>] [-f <text|columns>] [--samples <number>] [--min-alt-count <count>] [--min-alt-fraction <fraction>] [--bin <size>] [--phred <thresholds>] [--mapq <thresholds>]
+       shardMPileup.py run-shard -m <manifestFile> -k <shard>
+       shardMPileup.py merge -m <manifestFile> [--remove-shards]"""
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("plan", "run-shard", "merge"):
+        print usage
+        sys.exit(2)
+    command = sys.argv[1]
+
+    try:
+        opts, arg = getopt.getopt(sys.argv[2:], "hi:p:m:n:k:sz:f:", ["help", "split=", "samples=", "min-alt-count=", "min-alt-fraction=",
+                                                                    "bin=", "phred=", "mapq=", "remove-shards"])
+    except getopt.GetoptError:
+        print usage
+        sys.exit(2)
+
+    options = dict([('parseOptions', dict()), ('split', "lines"), ('removeShards', False)])
+    parseOptions = options['parseOptions']
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print usage
+                sys.exit(0)
+            elif opt == "-i":
+                options['inputFile'] = arg
+            elif opt == "-p":
+                options['outputPrefix'] = arg
+            elif opt == "-m":
+                options['manifestFile'] = arg
+            elif opt == "-n":
+                options['shards'] = int(arg)
+                if options['shards'] < 1:
+                    raise ValueError(arg)
+            elif opt == "-k":
+                options['shard'] = int(arg)
+            elif opt == "--split":
+                if arg not in SPLITS:
+                    raise ValueError(arg)
+                options['split'] = arg
+            elif opt == "--remove-shards":
+                options['removeShards'] = True
+            elif opt == "-s":
+                parseOptions['separatedFiles'] = True
+            elif opt == "-z":
+                if arg not in COMPRESSIONS:
+                    raise ValueError(arg)
+                parseOptions['compression'] = arg
+            elif opt == "-f":
+                if arg not in OUTPUT_FORMATS:
+                    raise ValueError(arg)
+                parseOptions['outputFormat'] = arg
+            elif opt == "--samples":
+                parseOptions['nbSamples'] = int(arg)
+                if parseOptions['nbSamples'] < 1:
+                    raise ValueError(arg)
+            elif opt == "--min-alt-count":
+                parseOptions['minAltCount'] = int(arg)
+                if parseOptions['minAltCount'] < 1:
+                    raise ValueError(arg)
+            elif opt == "--min-alt-fraction":
+                parseOptions['minAltFraction'] = float(arg)
+                if not 0.0 <= parseOptions['minAltFraction'] < 1.0:
+                    raise ValueError(arg)
+            elif opt == "--bin":
+                parseOptions['binSize'] = int(arg)
+                if parseOptions['binSize'] < 1:
+                    raise ValueError(arg)
+            elif opt in ("--phred", "--mapq"):
+                parseOptions[opt[2:] + "s"] = extractThresholds(arg)
+    except ValueError:
+        print usage
+        sys.exit(2)
+
+    if parseOptions.get('outputFormat') == "columns" and 'compression' in parseOptions:
+        print usage
+        sys.exit(2)
+    if 'binSize' in parseOptions and ('minAltCount' in parseOptions or 'minAltFraction' in parseOptions):
+        print usage
+        sys.exit(2)
+
+    required = dict([('plan', ('inputFile', 'outputPrefix', 'manifestFile', 'shards')), ('run-shard', ('manifestFile', 'shard')),
+                     ('merge', ('manifestFile',))])
+    for name in required[command]:
+        if name not in options:
+            print usage
+            sys.exit(2)
+    return(command, options)
+
+if __name__ == "__main__":
+
+    (command, options) = extractArguments()
+    if command == "plan":
+        manifest = planShards(options['inputFile'], options['outputPrefix'], options['manifestFile'], options['shards'],
+                              options['split'], **options['parseOptions'])
+        print "%d shards written in %s" % (len(manifest['shards']), options['manifestFile'])
+    elif command == "run-shard":
+        runShard(options['manifestFile'], options['shard'])
+    else:
+        mergeShards(options['manifestFile'], options['removeShards'])
@@ -0,0 +1,87 @@
+import unittest
+import os
+import shutil
+import tempfile
+import StringIO
+
+from benchmarkMPileup import generatePileup
+from benchmarkMPileup import compareResults
+from benchmarkMPileup import runBenchmarks
+from parseMPileup import extractCigarSeq
+from parseMPileup import decodePileupColumns
+from parseMPileup import countAlleles
+from parseMPileup import ALLELES
+
+class BenchmarkMPileupTestCase(unittest.TestCase):
+    """Tests for `benchmarkMPileup.py`."""
+
+    def test_generatePileup_same_seed(self):
+        """Test that the same seed generates the same file"""
+        output01 = StringIO.StringIO()
+        output02 = StringIO.StringIO()
+        output03 = StringIO.StringIO()
+        generatePileup(output01, 200, 40, 0.1, 0.1, 0.1, 0.1, 7)
+        generatePileup(output02, 200, 40, 0.1, 0.1, 0.1, 0.1, 7)
+        generatePileup(output03, 200, 40, 0.1, 0.1, 0.1, 0.1, 8)
+        self.assertEqual(output01.getvalue(), output02.getvalue())
+        self.assertNotEqual(output01.getvalue(), output03.getvalue())
+
+    def test_generatePileup_rates(self):
+        """Test that the rates control the generated symbols"""
+        output = StringIO.StringIO()
+        nbBases = generatePileup(output, 300, 30, 0.0, 0.0, 0.0, 0.0, 3)
+        sequences = [line.split("\t")[4] for line in output.getvalue().splitlines()]
+        self.assertEqual(300, len(sequences))
+        self.assertEqual(nbBases, sum([len(sequence) for sequence in sequences]))
+        for symbol in "^$<>+-":
+            self.assertFalse(any([symbol in sequence for sequence in sequences]))
+        output = StringIO.StringIO()
+        generatePileup(output, 300, 30, 0.2, 0.2, 0.2, 0.2, 3)
+        for symbol in "^$<>+-":
+            self.assertTrue(symbol in output.getvalue())
+
+    def test_generatePileup_parsed(self):
+        """Test that the generated lines are parsed the same way by both decoders"""
+        output = StringIO.StringIO()
+        generatePileup(output, 100, 50, 0.2, 0.2, 0.2, 0.2, 5)
+        lines = [line.split("\t") for line in output.getvalue().splitlines()]
+        expected = list()
+        for data in lines:
+            info = dict([('chr', data[0]), ('pos', data[1]), ('ref', data[2]), ('NB', data[3])])
+            counts = extractCigarSeq(data[4], data[5], data[6], info)
+            expected.append([len(counts[allele]) for allele in ALLELES])
+        decoded = decodePileupColumns([data[4] for data in lines], [data[5] for data in lines],
+                                      [data[6] for data in lines], [data[2] for data in lines])
+        self.assertEqual(expected, countAlleles(decoded, len(lines)).tolist())
+
+    def test_compareResults(self):
+        """Test the regressions reported against a baseline"""
+        baseline = dict([('parsePileup:depth30', dict([('linesPerSecond', 1000), ('basesPerSecond', 30000), ('peakRssKB', 20000)])),
+                         ('parsePileup:depth500', dict([('linesPerSecond', 100), ('basesPerSecond', 50000), ('peakRssKB', 20000)]))])
+        results = dict([('parsePileup:depth30', dict([('linesPerSecond', 950), ('basesPerSecond', 28500), ('peakRssKB', 30000)])),
+                        ('parsePileup:depth500', dict([('linesPerSecond', 50), ('basesPerSecond', 25000), ('peakRssKB', 20000)])),
+                        ('parsePileup:depth5000', dict([('linesPerSecond', 1), ('basesPerSecond', 1), ('peakRssKB', 1)]))])
+        regressions = compareResults(baseline, results, 0.1)
+        self.assertEqual(3, len(regressions))
+        self.assertTrue(regressions[0].startswith("parsePileup:depth30 peakRssKB"))
+        self.assertTrue(regressions[1].startswith("parsePileup:depth500 linesPerSecond"))
+        self.assertTrue(regressions[2].startswith("parsePileup:depth500 basesPerSecond"))
+        self.assertEqual([], compareResults(baseline, baseline, 0.1))
+
+    def test_runBenchmarks(self):
+        """Test that the benchmark saves a result per function and configuration"""
+        tempDir = tempfile.mkdtemp()
+        try:
+            resultFile = os.path.join(tempDir, "results.json")
+            results = runBenchmarks(resultFile, ("parsePileup", "extractCigarSeq"), 2000, 1, ["depth30"])
+            self.assertEqual(["extractCigarSeq:depth30", "parsePileup:depth30"], sorted(results))
+            for result in results.values():
+                self.assertTrue(result['bases'] > 0)
+                self.assertTrue(result['peakRssKB'] > 0)
+            self.assertTrue(os.path.isfile(resultFile))
+        finally:
+            shutil.rmtree(tempDir)
+
+
+if __name__ == '__main__':
+    unittest.main()
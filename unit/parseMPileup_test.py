@@ -3,11 +3,43 @@ import sys
 import StringIO
 import os
 import re
+import gzip
+import numpy
+import shutil
+import tempfile
+import random
+import subprocess
+import collections
+import json
+import threading
 
 from parseMPileup import extractArguments
 from parseMPileup import extractCigarSeq
+from parseMPileup import tokenizeCigarSeq
 from parseMPileup import parsePileup
+from parseMPileup import decodePileupColumns
+from parseMPileup import countAlleles
+from parseMPileup import countThresholds
+from parseMPileup import ALLELES
+from parseMPileup import splitInputFile
+from parseMPileup import open_read_file
+from parseMPileup import is_plain_file
+from parseMPileup import BgzfWriter
+from parseMPileup import loadColumns
+from parseMPileup import extractRegions
+from parseMPileup import buildIndex
+from parseMPileup import readInputLines
+from parseMPileup import INDEX_EXTENSION
+from parseMPileup import evictCacheEntries
+from parseMPileup import iterPileup
+from parseMPileup import PileupRecord
+from parseMPileup import decodePileupBlock
+from parseMPileup import createOutput
+from parseMPileup import Statistics
+from parseMPileup import formatRows
+from parseMPileup import countSamples
 from tempfile import NamedTemporaryFile
+from multiprocessing.pool import ThreadPool
 
 class ParseMPileupTestCase(unittest.TestCase):
     """Tests for `parseMPileup.py`."""
@@ -180,6 +212,68 @@ class ParseMPileupTestCase(unittest.TestCase):
         self.assertTrue(lettersCount['N'] == [])
         self.assertTrue(lettersCount['O'] == [(-1, -1), (-1, -1), (-1, -1)])
     
+    def test_extractCigarSeq_simple_same_as_tokenized(self):
+        """Test that the simple columns give the same tuples as the tokenized columns"""
+        rand = random.Random(11)
+        for i in range(500):
+            length = rand.randint(0, 60)
+            ref = rand.choice("ACGTN")
+            sequence = "".join([rand.choice(".,,..ACGTNacgtnOo") for j in range(length)])
+            phred = "".join([chr(rand.randint(33, 90)) for j in range(length + rand.randint(0, 2))])
+            mapq = "".join([chr(rand.randint(33, 90)) for j in range(length + rand.randint(0, 2))])
+            info = dict([('chr', "1"), ('pos', "10"), ('ref', ref), ('NB', str(length))])
+            self.assertEqual(tokenizeCigarSeq(sequence.upper(), phred, mapq, ref), extractCigarSeq(sequence, phred, mapq, info))
+    
+    def test_extractCigarSeq_long_indels(self):
+        """Test the tokenization of a column dense in indels"""
+        sequence = "".join([".+12ACGTACGTACGT,-3acg" for i in range(1000)])
+        info = dict([('chr', "1"), ('pos', "10"), ('ref', "G"), ('NB', "2000")])
+        lettersCount = extractCigarSeq(sequence, "I" * 2000, "]" * 2000, info)
+        self.assertEqual(2000, len(lettersCount['G']))
+        self.assertEqual(2000, len(lettersCount['O']))
+        self.assertEqual((-1, -1), lettersCount['O'][0])
+        self.assertEqual((40, 60), lettersCount['G'][-1])
+    
+    def test_decodePileupColumns_same_as_extractCigarSeq(self):
+        """Test that the vectorized decoder gives the same counts as extractCigarSeq"""
+        columns = [(".,,.", "DF!D", "]]ac", "A"), (".AG.,", "!F!DG", "]hacb", "T"),
+                   (".+2AC+1T,", "EI", "[K", "T"), ("+2CT-1T$.-2AT$,", "UT", "!!", "G"),
+                   ("+3CTT-1T$.^D-4ATAT$a", "UB", "![", "C"), ("<.>N*$", "!EE#", "!!F!", "C"),
+                   ("", "", "", "A")]
+        decoded = decodePileupColumns([c[0] for c in columns], [c[1] for c in columns],
+                                      [c[2] for c in columns], [c[3] for c in columns])
+        counts = countAlleles(decoded, len(columns))
+        for i in range(len(columns)):
+            info = dict([('chr', "2"), ('pos', "3423"), ('ref', columns[i][3]), ('NB', "4")])
+            lettersCount = extractCigarSeq(columns[i][0], columns[i][1], columns[i][2], info)
+            for code in range(len(ALLELES)):
+                self.assertEqual(counts[i][code], len(lettersCount[ALLELES[code]]))
+            phreds = (15, 60, 20, 40)
+            mapqs = (70, 0, 40, 1)
+            under = countThresholds(decoded, len(columns), phreds, mapqs)
+            for (p, phred) in enumerate(phreds):
+                for (m, mapq) in enumerate(mapqs):
+                    for code in range(4):
+                        expected = len(filter(lambda g: g[0] < phred and g[1] < mapq, lettersCount[ALLELES[code]]))
+                        self.assertEqual(under[i][p][m][code], expected)
+    
+    def test_decodePileupColumns_values(self):
+        """Test the arrays returned by the vectorized decoder"""
+        (alleles, phreds, mapqs, columns, indels) = decodePileupColumns([".+2AC,", "^!T>c"], ["EI", "g!6"], ["[\\", "]]!"], ["T", "A"])
+        self.assertEqual(list(alleles), [3, 3, 3, 1])
+        self.assertEqual(list(phreds), [36, 40, 70, 21])
+        self.assertEqual(list(mapqs), [58, 59, 60, 0])
+        self.assertEqual(list(columns), [0, 0, 1, 1])
+        self.assertEqual(list(indels), [1, 0])
+    
+    def test_decodePileupColumns_wrong_letter(self):
+        """Test that the vectorized decoder exits when an unknown letter is present"""
+        capturedOutput = StringIO.StringIO()
+        sys.stdout = capturedOutput
+        with self.assertRaises(SystemExit):
+            decodePileupColumns([".,", ".X"], ["!!", "!!"], ["!!", "!!"], ["A", "A"])
+        self.assertEqual(capturedOutput.getvalue(), "Problem with letter: X\nin this cigar string: .X\n")
+    
     def test_extractArguments_wrong_args(self):
         """Test extraction of arguments when undefined argument passed to function"""
         sys.argv = ["prog", "-d"]
@@ -195,7 +289,7 @@ class ParseMPileupTestCase(unittest.TestCase):
     def test_extractArguments_goods_args(self):
         """Test extraction of arguments when undefined argument passed to function"""
         sys.argv = ["prog", "-i", "toto.txt", "-p", "titi_"]
-        (inputA, outputB, separatedFiles) = extractArguments()
+        (inputA, outputB, separatedFiles, options) = extractArguments()
         self.assertTrue(inputA == "toto.txt")
         self.assertTrue(outputB == "titi_")
         self.assertFalse(separatedFiles, "test_extractArguments_goods_args: The separatedFiles argument doesn't have the expected value.")
@@ -203,11 +297,174 @@ class ParseMPileupTestCase(unittest.TestCase):
     def test_extractArguments_with_s_arg(self):
         """Test extraction of arguments when undefined argument passed to function"""
         sys.argv = ["prog", "-i", "effect.txt", "-p", "oneTest_", "-s"]
-        (inputA, outputB, separatedFiles) = extractArguments()
+        (inputA, outputB, separatedFiles, options) = extractArguments()
         self.assertTrue(inputA == "effect.txt")
         self.assertTrue(outputB == "oneTest_")
         self.assertTrue(separatedFiles, "test_extractArguments_with_s_arg: The separatedFiles argument doesn't have the expected value.")
     
+    def test_extractArguments_with_thresholds(self):
+        """Test extraction of arguments when Phred and Mapq thresholds are passed to function"""
+        sys.argv = ["prog", "-i", "effect.txt", "-p", "oneTest_", "--phred", "30,10,30", "--mapq=5"]
+        (inputA, outputB, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['phreds'], (30, 10))
+        self.assertEqual(options['mapqs'], (5,))
+    
+    def test_extractArguments_with_default_thresholds(self):
+        """Test extraction of arguments when no threshold is passed to function"""
+        sys.argv = ["prog", "-i", "effect.txt", "-p", "oneTest_"]
+        (inputA, outputB, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['phreds'], (15, 20, 30, 25))
+        self.assertEqual(options['mapqs'], (0, 1, 5, 10))
+    
+    def test_extractArguments_with_threads(self):
+        """Test extraction of arguments when the number of processes is passed to function"""
+        sys.argv = ["prog", "-i", "effect.txt", "-p", "oneTest_", "-t", "4"]
+        (inputA, outputB, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['threads'], 4)
+    
+    def test_extractArguments_with_wrong_threads(self):
+        """Test extraction of arguments when the number of processes is not valid"""
+        sys.argv = ["prog", "-i", "effect.txt", "-p", "oneTest_", "--threads", "0"]
+        with self.assertRaises(SystemExit):
+            extractArguments()
+    
+    def test_extractArguments_with_compression(self):
+        """Test extraction of arguments when the compression of the output files is passed to function"""
+        sys.argv = ["prog", "-i", "-", "-p", "oneTest_", "-z", "bgzip"]
+        (inputA, outputB, separatedFiles, options) = extractArguments()
+        self.assertEqual(inputA, "-")
+        self.assertEqual(options['compression'], "bgzip")
+    
+    def test_extractArguments_with_wrong_compression(self):
+        """Test extraction of arguments when the compression of the output files is not valid"""
+        sys.argv = ["prog", "-i", "-", "-p", "oneTest_", "--compress", "zip"]
+        with self.assertRaises(SystemExit):
+            extractArguments()
+    
+    def test_extractArguments_with_format(self):
+        """Test extraction of arguments when the format of the output files is passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--format", "columns"]
+        (inputA, outputB, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['outputFormat'], "columns")
+    
+    def test_extractArguments_with_compressed_columns(self):
+        """Test extraction of arguments when the columns format is used with a compression"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "-f", "columns", "-z", "gzip"]
+        with self.assertRaises(SystemExit):
+            extractArguments()
+    
+    def test_extractArguments_with_regions(self):
+        """Test extraction of arguments when regions are passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "-r", "chr1:10-20", "--region", "chr2"]
+        (inputA, outputB, separatedFiles, options) = extractArguments()
+        self.assertTrue(options['regions'].contains("chr1", 10))
+        self.assertFalse(options['regions'].contains("chr1", 21))
+        self.assertTrue(options['regions'].contains("chr2", 1000000))
+    
+    def test_extractArguments_with_wrong_region(self):
+        """Test extraction of arguments when a region is not valid"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "-r", "chr1:20-10"]
+        with self.assertRaises(SystemExit):
+            extractArguments()
+    
+    def test_extractArguments_with_cache(self):
+        """Test extraction of arguments when the cache options are passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "-c", "cacheDir", "--rebuild-cache", "--cache-limit", "1.5"]
+        (inputA, outputB, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['cacheDir'], "cacheDir")
+        self.assertTrue(options['rebuildCache'])
+        self.assertEqual(options['cacheLimit'], 1572864)
+    
+    def test_extractArguments_with_memory(self):
+        """Test extraction of arguments when the memory report is passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--memory"]
+        (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+        self.assertTrue(options['reportMemory'])
+    
+    def test_extractArguments_with_samples(self):
+        """Test extraction of arguments when the number of samples is passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--samples", "96"]
+        (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['nbSamples'], 96)
+    
+    def test_extractArguments_with_sparse_and_bin(self):
+        """Test extraction of arguments when the sparse or binned modes are passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--min-alt-count", "3", "--min-alt-fraction", "0.1"]
+        (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['minAltCount'], 3)
+        self.assertEqual(options['minAltFraction'], 0.1)
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--bin", "1000"]
+        (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['binSize'], 1000)
+        for arguments in (["--bin", "1000", "--min-alt-count", "3"], ["--bin", "0"], ["--min-alt-fraction", "1"]):
+            sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_"] + arguments
+            with self.assertRaises(SystemExit):
+                extractArguments()
+    
+    def test_extractArguments_with_checkpoint(self):
+        """Test extraction of arguments when the checkpoint options are passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--checkpoint", "64", "--resume"]
+        (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['checkpointSize'], 64 * 1024 * 1024)
+        self.assertTrue(options['resume'])
+        for arguments in (["-i", "-"], ["-z", "gzip"], ["--pipeline"], ["-r", "chr1"]):
+            sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--resume"] + arguments
+            with self.assertRaises(SystemExit):
+                extractArguments()
+    
+    def test_extractArguments_with_append(self):
+        """Test extraction of arguments when the append option is passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--append", "-z", "bgzip"]
+        (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+        self.assertTrue(options['append'])
+        for arguments in (["-i", "-"], ["-z", "gzip"], ["-r", "chr1"], ["--bin", "100"], ["--checkpoint", "64"], ["-c", "cache"]):
+            sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--append"] + arguments
+            with self.assertRaises(SystemExit):
+                extractArguments()
+    
+    def test_extractArguments_with_stats(self):
+        """Test extraction of arguments when the instrumentation options are passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--stats", "stats.json", "--progress", "30", "--profile", "parse.prof"]
+        (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['statsFile'], "stats.json")
+        self.assertEqual(options['progressInterval'], 30.0)
+        self.assertEqual(options['profileFile'], "parse.prof")
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--progress", "0"]
+        with self.assertRaises(SystemExit):
+            extractArguments()
+    
+    def test_extractArguments_with_buffer_size(self):
+        """Test extraction of arguments when the buffer size is passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--buffer-size", "0.5"]
+        (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['bufferSize'], 512 * 1024)
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--buffer-size", "-1"]
+        with self.assertRaises(SystemExit):
+            extractArguments()
+    
+    def test_extractArguments_with_compress_threads(self):
+        """Test extraction of arguments when the number of compression threads is passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "-z", "bgzip", "--compress-threads", "4"]
+        (inputFile, outputPrefix, separatedFiles, options) = extractArguments()
+        self.assertEqual(options['compressThreads'], 4)
+        for arguments in (["-z", "gzip"], [], ["-z", "bgzip", "--compress-threads", "0"]):
+            sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--compress-threads", "2"] + arguments
+            with self.assertRaises(SystemExit):
+                extractArguments()
+    
+    def test_extractArguments_with_pipeline(self):
+        """Test extraction of arguments when the pipelined mode is passed to function"""
+        sys.argv = ["prog", "-i", "in.txt", "-p", "oneTest_", "--pipeline", "--queue-size", "8"]
+        (inputA, outputB, separatedFiles, options) = extractArguments()
+        self.assertTrue(options['pipeline'])
+        self.assertEqual(options['queueSize'], 8)
+    
+    def test_extractArguments_with_wrong_thresholds(self):
+        """Test extraction of arguments when a threshold is not an integer"""
+        sys.argv = ["prog", "-i", "effect.txt", "-p", "oneTest_", "--mapq", "5,a"]
+        with self.assertRaises(SystemExit):
+            extractArguments()
+    
     def test_extractArguments_with_upper_s_arg(self):
         """Test extraction of arguments when undefined argument passed to function"""
         capturedOutput = StringIO.StringIO()      # A StringIO object
@@ -215,7 +472,7 @@ class ParseMPileupTestCase(unittest.TestCase):
         sys.argv = ["prog", "-p", "test_", "-i", "where.txt", "-S"]
         with self.assertRaises(SystemExit):
             extractArguments()
-        self.assertEqual(capturedOutput.getvalue(), "usage: parsePileup.py -i <inputFile> -p <outputPrefix> [-s] [-h]\n")
+        self.assertEqual(capturedOutput.getvalue(), "usage: parsePileup.py -i <inputFile> -p <outputPrefix> [-s] [-t <threads>] [-z <gzip|bgzip>] [-f <text|columns>] [-r <region>] [-b <bedFile>] [-x] [-c <cacheDir>] [--rebuild-cache] [--cache-limit <MB>] [--pipeline] [--queue-size <blocks>] [--memory] [--samples <number>] [--min-alt-count <count>] [--min-alt-fraction <fraction>] [--bin <size>] [--checkpoint <MB>] [--resume] [--append] [--stats <jsonFile>] [--progress <seconds>] [--profile <profileFile>] [--buffer-size <MB>] [--compress-threads <number>] [--phred <thresholds>] [--mapq <thresholds>] [-h]\n")
         
     def test_extractArguments_help(self):
         """Test extraction of arguments when undefined argument passed to function"""
@@ -224,7 +481,7 @@ class ParseMPileupTestCase(unittest.TestCase):
         sys.argv = ["prog", "-h"]  
         with self.assertRaises(SystemExit):   
             extractArguments()
-        self.assertEqual(capturedOutput.getvalue(), "usage: parsePileup.py -i <inputFile> -p <outputPrefix> [-s] [-h]\n")
+        self.assertEqual(capturedOutput.getvalue(), "usage: parsePileup.py -i <inputFile> -p <outputPrefix> [-s] [-t <threads>] [-z <gzip|bgzip>] [-f <text|columns>] [-r <region>] [-b <bedFile>] [-x] [-c <cacheDir>] [--rebuild-cache] [--cache-limit <MB>] [--pipeline] [--queue-size <blocks>] [--memory] [--samples <number>] [--min-alt-count <count>] [--min-alt-fraction <fraction>] [--bin <size>] [--checkpoint <MB>] [--resume] [--append] [--stats <jsonFile>] [--progress <seconds>] [--profile <profileFile>] [--buffer-size <MB>] [--compress-threads <number>] [--phred <thresholds>] [--mapq <thresholds>] [-h]\n")
     
     def test_extractArguments_no_arg(self):
         """Test extraction of arguments when no argument passed to function"""
@@ -233,7 +490,7 @@ class ParseMPileupTestCase(unittest.TestCase):
         sys.argv = ["prog"]  
         with self.assertRaises(SystemExit):   
             extractArguments()
-        self.assertEqual(capturedOutput.getvalue(), "usage: parsePileup.py -i <inputFile> -p <outputPrefix> [-s] [-h]\n")
+        self.assertEqual(capturedOutput.getvalue(), "usage: parsePileup.py -i <inputFile> -p <outputPrefix> [-s] [-t <threads>] [-z <gzip|bgzip>] [-f <text|columns>] [-r <region>] [-b <bedFile>] [-x] [-c <cacheDir>] [--rebuild-cache] [--cache-limit <MB>] [--pipeline] [--queue-size <blocks>] [--memory] [--samples <number>] [--min-alt-count <count>] [--min-alt-fraction <fraction>] [--bin <size>] [--checkpoint <MB>] [--resume] [--append] [--stats <jsonFile>] [--progress <seconds>] [--profile <profileFile>] [--buffer-size <MB>] [--compress-threads <number>] [--phred <thresholds>] [--mapq <thresholds>] [-h]\n")
     
     def test_parseMPileup_01(self):
         inputfile_path = self.createTempPileup01()
@@ -258,6 +515,763 @@ class ParseMPileupTestCase(unittest.TestCase):
         expected = expected + "chr5\t6916649\t0\t0\t2\t0\t0\t0\n"
         expected = expected + "chr6\t37108587\t0\t3\t0\t0\t0\t1\n"
         self.assertEqual(contents, expected)
+    
+    def test_parseMPileup_thresholds_separated(self):
+        """Test the threshold files when the position file is separated"""
+        inputfile_path = self.createTempPileup01()
+        try:
+            parsePileup(inputfile_path, "toto", True)
+            contents = open("toto_pos.txt").read()
+            contentsThreshold = open("toto_30_10.txt").read()
+        finally:
+            if os.path.exists(inputfile_path):
+                os.unlink(inputfile_path)
+            files = [ f for f in os.listdir(".") if re.match(r'toto.*\.txt', f)]
+            for f in files:
+                if os.path.exists(f):
+                    os.unlink(f)
+        
+        expected = "chr1\t3153345\nchr1\t3800923\nchr2\t4688598\nchr4\t5134371\nchr5\t6916649\nchr6\t37108587\n"
+        self.assertEqual(contents, expected)
+        expected = "0\t0\t0\t0\n1\t0\t0\t0\n0\t0\t0\t0\n0\t0\t0\t0\n0\t0\t1\t0\n0\t0\t0\t0\n"
+        self.assertEqual(contentsThreshold, expected)
+    
+    def test_parseMPileup_user_thresholds(self):
+        """Test the threshold files when the thresholds are given by the user"""
+        inputfile_path = self.createTempPileup01()
+        try:
+            parsePileup(inputfile_path, "toto", False, phreds=(50,), mapqs=(61, 100))
+            createdFiles = sorted([ f for f in os.listdir(".") if re.match(r'toto.*\.txt', f)])
+            contents = open("toto_50_61.txt").read()
+        finally:
+            if os.path.exists(inputfile_path):
+                os.unlink(inputfile_path)
+            files = [ f for f in os.listdir(".") if re.match(r'toto.*\.txt', f)]
+            for f in files:
+                if os.path.exists(f):
+                    os.unlink(f)
+        
+        self.assertEqual(createdFiles, ["toto.txt", "toto_50_100.txt", "toto_50_61.txt"])
+        expected = "Chromosome\tPosition\tA\tC\tG\tT\n"
+        expected = expected + "chr1\t3153345\t0\t0\t0\t1\n"
+        expected = expected + "chr1\t3800923\t1\t0\t0\t1\n"
+        expected = expected + "chr2\t4688598\t0\t1\t1\t0\n"
+        expected = expected + "chr4\t5134371\t0\t2\t0\t0\n"
+        expected = expected + "chr5\t6916649\t0\t0\t2\t0\n"
+        expected = expected + "chr6\t37108587\t0\t2\t0\t0\n"
+        self.assertEqual(contents, expected)
+    
+    def test_splitInputFile(self):
+        """Test that the input file is split on the beginning of the lines"""
+        inputfile_path = self.createTempPileup01()
+        try:
+            content = open(inputfile_path).read()
+            chunks = splitInputFile(inputfile_path, 4)
+            manyChunks = splitInputFile(inputfile_path, 100)
+        finally:
+            os.unlink(inputfile_path)
+        
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(len(manyChunks), 6)
+        for ranges in (chunks, manyChunks):
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(content))
+            for i in range(len(ranges)):
+                self.assertEqual(content[ranges[i][0] - 1:ranges[i][0]], "\n" if i > 0 else "")
+                if i > 0:
+                    self.assertEqual(ranges[i][0], ranges[i - 1][1])
+    
+    def test_parseMPileup_threads(self):
+        """Test that the output files are the same when many processes are used"""
+        inputfile_path = self.createTempPileup01()
+        try:
+            for separatedFiles in (False, True):
+                parsePileup(inputfile_path, "toto", separatedFiles)
+                parsePileup(inputfile_path, "totoThreads", separatedFiles, threads=3)
+                files = [ f for f in os.listdir(".") if re.match(r'toto_.*\.txt', f)] + ["toto.txt"]
+                for f in files:
+                    self.assertEqual(open(f).read(), open(f.replace("toto", "totoThreads")).read())
+        finally:
+            if os.path.exists(inputfile_path):
+                os.unlink(inputfile_path)
+            files = [ f for f in os.listdir(".") if re.match(r'toto.*\.txt', f)]
+            for f in files:
+                if os.path.exists(f):
+                    os.unlink(f)
+    
+    def test_open_read_file_compressed(self):
+        """Test that gzip and bgzip input files are detected and decompressed"""
+        inputfile_path = self.createTempPileup01()
+        content = open(inputfile_path).read()
+        os.unlink(inputfile_path)
+        try:
+            gzFile = gzip.open("toto_input.gz", "wb")
+            gzFile.write(content)
+            gzFile.close()
+            bgzFile = BgzfWriter(open("toto_input.bgz", "wb"))
+            bgzFile.write(content[:100])
+            bgzFile.flush()
+            bgzFile.write(content[100:])
+            bgzFile.close()
+            for name in ("toto_input.gz", "toto_input.bgz"):
+                iFile = open_read_file(name)
+                self.assertEqual(list(iFile), content.splitlines(True))
+                iFile.close()
+            self.assertEqual(gzip.open("toto_input.bgz").read(), content)
+        finally:
+            for name in ("toto_input.gz", "toto_input.bgz"):
+                if os.path.exists(name):
+                    os.unlink(name)
+    
+    def test_parseMPileup_fifo(self):
+        """Test that plain and compressed pileups are read from a named pipe, which cannot be seeked"""
+        inputfile_path = self.createTempPileup01()
+        tempDir = tempfile.mkdtemp()
+        try:
+            content = open(inputfile_path).read()
+            gzFile = gzip.open(os.path.join(tempDir, "input.gz"), "wb")
+            gzFile.write(content)
+            gzFile.close()
+            fifo = os.path.join(tempDir, "fifo")
+            os.mkfifo(fifo)
+            self.assertFalse(is_plain_file(fifo))
+            parsePileup(inputfile_path, os.path.join(tempDir, "file"), False)
+            for (run, data) in enumerate((content, open(os.path.join(tempDir, "input.gz"), "rb").read())):
+                for options in (dict(), dict([('threads', 2)]), dict([('cacheDir', os.path.join(tempDir, "cache"))])):
+                    writer = threading.Thread(target=lambda: open(fifo, "wb").write(data))
+                    writer.daemon = True
+                    writer.start()
+                    parsePileup(fifo, os.path.join(tempDir, "fifo"), False, **options)
+                    writer.join()
+                    for name in [f for f in os.listdir(tempDir) if f.startswith("file")]:
+                        self.assertEqual(open(os.path.join(tempDir, name)).read(), open(os.path.join(tempDir, name.replace("file", "fifo"))).read())
+            self.assertFalse(os.path.exists(os.path.join(tempDir, "cache")) and len(os.listdir(os.path.join(tempDir, "cache"))) > 0)
+        finally:
+            os.unlink(inputfile_path)
+            shutil.rmtree(tempDir)
+    
+    def test_BgzfWriter_compression_pool(self):
+        """Test that the blocks compressed by a thread pool are written as the blocks compressed in order"""
+        rand = random.Random(5)
+        content = "".join(["chr1\t%d\t%d\n" % (i, rand.randint(0, 100)) for i in xrange(60000)])
+        tempDir = tempfile.mkdtemp()
+        pool = ThreadPool(3)
+        try:
+            for (name, writerPool) in (("serial.bgz", None), ("pool.bgz", pool)):
+                bgzFile = BgzfWriter(open(os.path.join(tempDir, name), "wb"), writerPool)
+                for start in xrange(0, len(content), 300000):
+                    bgzFile.write(content[start:start + 300000])
+                bgzFile.flush()
+                bgzFile.write(content[:10])
+                bgzFile.close()
+            self.assertEqual(open(os.path.join(tempDir, "serial.bgz"), "rb").read(), open(os.path.join(tempDir, "pool.bgz"), "rb").read())
+            self.assertEqual(content + content[:10], gzip.open(os.path.join(tempDir, "pool.bgz")).read())
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(tempDir)
+    
+    def test_parseMPileup_stdin_and_compressed_output(self):
+        """Test the parsing of the standard input with compressed output files"""
+        inputfile_path = self.createTempPileup01()
+        try:
+            parsePileup(inputfile_path, "toto", False)
+            for compression in ("gzip", "bgzip"):
+                sys.stdin = open(inputfile_path)
+                try:
+                    parsePileup("-", "totoStdin", False, compression=compression)
+                finally:
+                    sys.stdin.close()
+                    sys.stdin = sys.__stdin__
+                files = [ f for f in os.listdir(".") if re.match(r'toto_.*\.txt$', f)] + ["toto.txt"]
+                for f in files:
+                    self.assertEqual(open(f).read(), gzip.open(f.replace("toto", "totoStdin") + ".gz").read())
+        finally:
+            if os.path.exists(inputfile_path):
+                os.unlink(inputfile_path)
+            files = [ f for f in os.listdir(".") if re.match(r'toto.*\.txt', f)]
+            for f in files:
+                if os.path.exists(f):
+                    os.unlink(f)
+    
+    def test_parseMPileup_columns(self):
+        """Test the columns format of the output files"""
+        inputfile_path = self.createTempPileup01()
+        try:
+            parsePileup(inputfile_path, "toto", False, phreds=(50, 20), mapqs=(61,), outputFormat="columns")
+            columns = loadColumns("toto")
+            parsePileup(inputfile_path, "totoThreads", False, phreds=(50, 20), mapqs=(61,), threads=3, outputFormat="columns")
+            columnsThreads = loadColumns("totoThreads", mmap=False)
+            
+            self.assertEqual(columns['chromosomes'], ["chr1", "chr2", "chr4", "chr5", "chr6"])
+            self.assertEqual(columns['alleles'], ('A', 'C', 'G', 'T', 'O', 'N'))
+            self.assertEqual(columns['phreds'], (50, 20))
+            self.assertEqual(columns['mapqs'], (61,))
+            self.assertEqual(columns['chromosome'].tolist(), [0, 0, 1, 2, 3, 4])
+            self.assertEqual(columns['position'].tolist(), [3153345, 3800923, 4688598, 5134371, 6916649, 37108587])
+            self.assertEqual(columns['counts'].tolist(), [[0, 0, 0, 2, 1, 0], [1, 0, 0, 2, 0, 0], [0, 2, 1, 0, 0, 0],
+                                                          [0, 3, 0, 0, 2, 0], [0, 0, 2, 0, 0, 0], [0, 3, 0, 0, 0, 1]])
+            self.assertEqual(columns['thresholds'].shape, (6, 2, 1, 4))
+            self.assertEqual(columns['thresholds'][:, 0, 0].tolist(), [[0, 0, 0, 1], [1, 0, 0, 1], [0, 1, 1, 0],
+                                                                      [0, 2, 0, 0], [0, 0, 2, 0], [0, 2, 0, 0]])
+            for name in ('chromosomes', 'chromosome', 'position', 'counts', 'thresholds'):
+                self.assertEqual(numpy.asarray(columns[name]).tolist(), numpy.asarray(columnsThreads[name]).tolist())
+            del columns
+        finally:
+            if os.path.exists(inputfile_path):
+                os.unlink(inputfile_path)
+            files = [ f for f in os.listdir(".") if re.match(r'toto.*\.(npy|json)', f)]
+            for f in files:
+                if os.path.exists(f):
+                    os.unlink(f)
+    
+    def test_extractRegions(self):
+        """Test that the regions and the BED intervals are merged"""
+        bedFile = NamedTemporaryFile(delete=False)
+        bedFile.write("track name=test\nchr1\t99\t200\nchr1\t300\t400\nchr2\t0\t10\n")
+        bedFile.close()
+        try:
+            regions = extractRegions(["chr1:1,000-1,100", "chr1:150-250", "chr1:401-500"], bedFile.name)
+        finally:
+            os.unlink(bedFile.name)
+        self.assertEqual(regions.intervals("chr1"), [(100, 250), (301, 500), (1000, 1100)])
+        self.assertEqual(regions.intervals("chr2"), [(1, 10)])
+        self.assertEqual(regions.intervals("chr3"), [])
+        self.assertTrue(regions.contains("chr1", 100))
+        self.assertFalse(regions.contains("chr1", 99))
+        self.assertFalse(regions.contains("chr1", 251))
+        self.assertTrue(regions.contains("chr1", 1100))
+    
+    def test_readInputLines_regions(self):
+        """Test that the same lines are extracted with and without the index"""
+        inputfile_path = self.createTempPileup01()
+        try:
+            lines = open(inputfile_path).readlines()
+            regions = extractRegions(["chr1:3800000-5000000", "chr4", "chr6:1-100", "chr7"])
+            expected = [lines[1], lines[3]]
+            self.assertEqual(list(readInputLines(inputfile_path, regions)), expected)
+            buildIndex(inputfile_path, 1000000)
+            index = open(inputfile_path + INDEX_EXTENSION).read().splitlines()
+            self.assertEqual(index[1:], ["chr1\t3\t0", "chr2\t4\t78", "chr4\t5\t116", "chr5\t6\t159", "chr6\t37\t194"])
+            self.assertEqual(list(readInputLines(inputfile_path, regions)), expected)
+            regions = extractRegions(["chr1:3153345", "chr2:1-4688598", "chr5"])
+            self.assertEqual(list(readInputLines(inputfile_path, regions)), [lines[0], lines[1], lines[2], lines[4]])
+        finally:
+            for name in (inputfile_path, inputfile_path + INDEX_EXTENSION):
+                if os.path.exists(name):
+                    os.unlink(name)
+    
+    def test_parseMPileup_cache(self):
+        """Test that the counts computed from the cache are the same as the counts computed from the input file"""
+        inputfile_path = self.createTempPileup01()
+        cacheDir = tempfile.mkdtemp()
+        try:
+            parsePileup(inputfile_path, "toto", False, phreds=(50, 20), mapqs=(61, 10))
+            os.utime(inputfile_path, (1000000000, 1000000000))
+            parsePileup(inputfile_path, "totoCache", False, cacheDir=cacheDir, threads=2)
+            entries = os.listdir(cacheDir)
+            self.assertEqual(len(entries), 1)
+            self.assertTrue(os.path.exists(os.path.join(cacheDir, entries[0], "entry.json")))
+            
+            ## The input file is not read when the cache is valid
+            content = open(inputfile_path).read()
+            open(inputfile_path, "w").write(content.replace("chr", "CHR"))
+            os.utime(inputfile_path, (1000000000, 1000000000))
+            parsePileup(inputfile_path, "totoCache", False, phreds=(50, 20), mapqs=(61, 10), cacheDir=cacheDir)
+            files = [ f for f in os.listdir(".") if re.match(r'toto_.*\.txt', f)] + ["toto.txt"]
+            for f in files:
+                self.assertEqual(open(f).read(), open(f.replace("toto", "totoCache")).read())
+            
+            ## The limit of the cache is applied when the cache is used
+            os.makedirs(os.path.join(cacheDir, "old"))
+            open(os.path.join(cacheDir, "old", "block.npz"), "w").write("x" * 10000)
+            parsePileup(inputfile_path, "totoCache", False, phreds=(50, 20), mapqs=(61, 10), cacheDir=cacheDir, cacheLimit=5000)
+            self.assertEqual(entries, os.listdir(cacheDir))
+            
+            ## The histograms of another number of samples are not used
+            parsePileup(inputfile_path, "totoCache", False, cacheDir=cacheDir, nbSamples=1)
+            self.assertTrue(open("totoCache.txt").read().find("CHR1") > 0)
+            self.assertEqual(2, len(os.listdir(cacheDir)))
+            
+            ## The entry is rebuilt when requested
+            parsePileup(inputfile_path, "totoCache", False, cacheDir=cacheDir, rebuildCache=True)
+            self.assertTrue(open("totoCache.txt").read().find("CHR1") > 0)
+        finally:
+            shutil.rmtree(cacheDir)
+            if os.path.exists(inputfile_path):
+                os.unlink(inputfile_path)
+            files = [ f for f in os.listdir(".") if re.match(r'toto.*\.txt', f)]
+            for f in files:
+                if os.path.exists(f):
+                    os.unlink(f)
+    
+    def test_evictCacheEntries(self):
+        """Test that the oldest entries of the cache are removed first"""
+        cacheDir = tempfile.mkdtemp()
+        try:
+            for (name, age) in (("old", 1000), ("new", 3000), ("current", 2000)):
+                os.mkdir(os.path.join(cacheDir, name))
+                open(os.path.join(cacheDir, name, "block_000000_000000.npz"), "w").write("x" * 100)
+                open(os.path.join(cacheDir, name, "entry.json"), "w").write("{}")
+                os.utime(os.path.join(cacheDir, name, "entry.json"), (age, age))
+            evictCacheEntries(cacheDir, 250, os.path.join(cacheDir, "current"))
+            self.assertEqual(sorted(os.listdir(cacheDir)), ["current", "new"])
+            evictCacheEntries(cacheDir, 10, os.path.join(cacheDir, "current"))
+            self.assertEqual(sorted(os.listdir(cacheDir)), ["current"])
+        finally:
+            shutil.rmtree(cacheDir)
+    
+    def test_parseMPileup_pipeline(self):
+        """Test that the output files are the same in the pipelined mode"""
+        inputfile_path = self.createTempPileup01()
+        capturedOutput = StringIO.StringIO()
+        sys.stderr = capturedOutput
+        try:
+            parsePileup(inputfile_path, "toto", True)
+            parsePileup(inputfile_path, "totoPipeline", True, pipeline=True, queueSize=1)
+            files = [ f for f in os.listdir(".") if re.match(r'toto_.*\.txt', f)] + ["toto.txt"]
+            for f in files:
+                self.assertEqual(open(f).read(), open(f.replace("toto", "totoPipeline")).read())
+        finally:
+            sys.stderr = sys.__stderr__
+            if os.path.exists(inputfile_path):
+                os.unlink(inputfile_path)
+            files = [ f for f in os.listdir(".") if re.match(r'toto.*\.txt', f)]
+            for f in files:
+                if os.path.exists(f):
+                    os.unlink(f)
+        report = capturedOutput.getvalue().splitlines()
+        self.assertEqual(len(report), 2)
+        self.assertTrue(report[0].startswith("Queue reader -> parser: mean fill "))
+        self.assertTrue(report[1].startswith("Queue parser -> writer: mean fill "))
+    
+    def test_iterPileup(self):
+        """Test the records returned by the streaming API"""
+        inputfile_path = self.createTempPileup01()
+        try:
+            lines = [line.split("\t") for line in open(inputfile_path).read().splitlines()]
+            records = list(iterPileup(inputfile_path, phreds=(50, 20), mapqs=(61, 10)))
+            self.assertEqual(len(records), 6)
+            for (record, data) in zip(records, lines):
+                self.assertTrue(isinstance(record, PileupRecord))
+                self.assertFalse(hasattr(record, "__dict__"))
+                self.assertEqual((record.chromosome, record.position, record.ref), (data[0], int(data[1]), data[2]))
+                info = dict([('chr', data[0]), ('pos', data[1]), ('ref', data[2]), ('NB', data[3])])
+                lettersCount = extractCigarSeq(data[4], data[5], data[6], info)
+                self.assertEqual(list(record.counts), [len(lettersCount[allele]) for allele in ALLELES])
+                self.assertEqual(record.thresholdCounts.shape, (2, 2, 4))
+                for (p, phred) in enumerate((50, 20)):
+                    for (m, mapq) in enumerate((61, 10)):
+                        expected = [len([g for g in lettersCount[allele] if g[0] < phred and g[1] < mapq]) for allele in ALLELES[:4]]
+                        self.assertEqual(list(record.thresholdCounts[p][m]), expected)
+            
+            ## The same records are returned from an open file
+            iFile = open(inputfile_path)
+            fromFile = list(iterPileup(iFile, phreds=(50, 20), mapqs=(61, 10)))
+            iFile.close()
+            self.assertEqual([repr(record) for record in fromFile], [repr(record) for record in records])
+            
+            regions = extractRegions(["chr1:3800000-5000000", "chr4"])
+            self.assertEqual([record.position for record in iterPileup(open(inputfile_path), regions=regions)], [3800923, 5134371])
+            self.assertEqual([record.position for record in iterPileup(inputfile_path, regions=regions)], [3800923, 5134371])
+        finally:
+            os.unlink(inputfile_path)
+    
+    def test_decodePileupBlock_slices(self):
+        """Test that the counts are the same when the columns are decoded by slices"""
+        sequences = [".,,.+2AC", ".AG.<,", "^!T>c$", "", "*.,-1A.N", ",,.." * 20]
+        phreds = ["DF!D", "!F!DG#", "g!6", "", "I5!#", "I5!#" * 20]
+        mapqs = ["]]ac", "]hacb!", "]]!", "", "!]]a", "!]]a" * 20]
+        refs = ["A", "T", "C", "G", "T", "G"]
+        (decoded, weights) = decodePileupBlock(sequences, phreds, mapqs, refs)
+        self.assertTrue(weights is None)
+        for sliceSize in (1, 3, 7, 100):
+            (sliced, slicedWeights) = decodePileupBlock(sequences, phreds, mapqs, refs, sliceSize)
+            self.assertEqual(countAlleles(sliced, 6, slicedWeights).tolist(), countAlleles(decoded, 6).tolist())
+            self.assertEqual(countThresholds(sliced, 6, (10, 40, 70), (20, 65), slicedWeights).tolist(),
+                             countThresholds(decoded, 6, (10, 40, 70), (20, 65)).tolist())
+            self.assertTrue(len(sliced[0]) <= len(decoded[0]))
+    
+    def test_parseMPileup_deep_positions_memory(self):
+        """Test that the peak memory does not grow with the depth of the positions"""
+        tempDir = tempfile.mkdtemp()
+        try:
+            inputfile_path = os.path.join(tempDir, "deep.pileup")
+            peaks = list()
+            for depth in (100, 10000, 1000000):
+                ## The same number of bases is parsed at each depth
+                oFile = open(inputfile_path, "w")
+                for i in range(4000000 // depth):
+                    oFile.write("chr1\t%d\tT\t%d\t%s^!.$\t%s\t%s\n" % (i + 1, depth + 1, ".,A,.C,g<." * (depth // 10) + "+2AC",
+                                                                        "I" * (depth + 1), "]" * (depth + 1)))
+                oFile.close()
+                script = "import resource, parseMPileup; parseMPileup.parsePileup(%r, %r, False); print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss"
+                output = subprocess.check_output([sys.executable, "-c", script % (inputfile_path, os.path.join(tempDir, "deep"))],
+                                                 cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+                peaks.append(int(output.split()[-1]))
+            for peak in peaks[1:]:
+                self.assertTrue(peak < peaks[0] + 20 * 1024, peaks)
+        finally:
+            shutil.rmtree(tempDir)
+    
+    def test_parseMPileup_samples(self):
+        """Test that each sample of a multi-sample pileup gives the same counts as its own pileup"""
+        inputfile_path = self.createTempPileup01()
+        tempDir = tempfile.mkdtemp()
+        try:
+            lines = [line.split("\t") for line in open(inputfile_path).read().splitlines()]
+            groups = ["\t".join(data[3:7]) for data in lines]
+            multiFile = open(os.path.join(tempDir, "multi.pileup"), "w")
+            for (i, data) in enumerate(lines):
+                multiFile.write("\t".join(data[:3] + [groups[(i + k) % len(groups)] for k in range(3)]) + "\n")
+            multiFile.close()
+            for k in range(3):
+                sampleFile = open(os.path.join(tempDir, "sample%d.pileup" % (k + 1)), "w")
+                for (i, data) in enumerate(lines):
+                    sampleFile.write("\t".join(data[:3] + [groups[(i + k) % len(groups)]]) + "\n")
+                sampleFile.close()
+                parsePileup(sampleFile.name, os.path.join(tempDir, "single%d" % (k + 1)), False, phreds=(50, 20), mapqs=(61, 10))
+            
+            for threads in (1, 2):
+                parsePileup(multiFile.name, os.path.join(tempDir, "multi"), False, phreds=(50, 20), mapqs=(61, 10), threads=threads)
+                for k in range(3):
+                    for suffix in (".txt", "_50_61.txt", "_20_10.txt"):
+                        self.assertEqual(open(os.path.join(tempDir, "multi_sample%d%s" % (k + 1, suffix))).read(),
+                                         open(os.path.join(tempDir, "single%d%s" % (k + 1, suffix))).read())
+            self.assertFalse(os.path.exists(os.path.join(tempDir, "multi.txt")))
+            
+            records = list(iterPileup(multiFile.name, phreds=(50, 20), mapqs=(61, 10)))
+            self.assertEqual(records[0].counts.shape, (3, 6))
+            self.assertEqual(records[0].thresholdCounts.shape, (3, 2, 2, 4))
+            for k in range(3):
+                single = list(iterPileup(os.path.join(tempDir, "sample%d.pileup" % (k + 1)), phreds=(50, 20), mapqs=(61, 10)))
+                self.assertEqual([record.counts[k].tolist() for record in records], [record.counts.tolist() for record in single])
+            
+            ## The extra column of the first pileup file is ignored when the number of samples is given
+            parsePileup(inputfile_path, os.path.join(tempDir, "extra"), False, nbSamples=1)
+            parsePileup(os.path.join(tempDir, "sample1.pileup"), os.path.join(tempDir, "noExtra"), False)
+            self.assertEqual(open(os.path.join(tempDir, "extra.txt")).read(), open(os.path.join(tempDir, "noExtra.txt")).read())
+        finally:
+            os.unlink(inputfile_path)
+            shutil.rmtree(tempDir)
+    
+    def test_parseMPileup_samples_change(self):
+        """Test that the parsing stops when the number of samples changes after the first block"""
+        tempDir = tempfile.mkdtemp()
+        try:
+            inputFile = os.path.join(tempDir, "input.pileup")
+            oFile = open(inputFile, "w")
+            for position in xrange(1, 40001):
+                sample = "1\t.\tI\t]"
+                if position > 10000:
+                    sample = sample + "\t" + sample
+                oFile.write("chr1\t%d\tA\t%s\n" % (position, sample))
+            oFile.close()
+            sys.stdout = StringIO.StringIO()
+            for options in (dict(), dict([('pipeline', True), ('queueSize', 1)])):
+                with self.assertRaises(SystemExit):
+                    parsePileup(inputFile, os.path.join(tempDir, "out"), False, **options)
+            self.assertEqual(2, sys.stdout.getvalue().count("Problem with the number of samples: 2 instead of 1"))
+        finally:
+            shutil.rmtree(tempDir)
+    
+    def test_countSamples(self):
+        """Test the detection of the number of samples, refused when the columns match several layouts"""
+        self.assertEqual([1, 1, 1, 2, 2, 3, 3], [countSamples(nbColumns) for nbColumns in (4, 5, 7, 8, 10, 12, 15)])
+        for nbColumns in (13, 20, 40):
+            with self.assertRaises(ValueError):
+                countSamples(nbColumns)
+        ## 4 samples with the positions of the bases in the reads
+        tempDir = tempfile.mkdtemp()
+        try:
+            inputFile = os.path.join(tempDir, "input.pileup")
+            open(inputFile, "w").write("chr1\t10\tA%s\n" % ("\t2\t.C\tII\t]]\t1,5" * 4))
+            sys.stdout = StringIO.StringIO()
+            with self.assertRaises(SystemExit):
+                parsePileup(inputFile, os.path.join(tempDir, "out"), False)
+            self.assertTrue("it must be given with --samples" in sys.stdout.getvalue())
+            parsePileup(inputFile, os.path.join(tempDir, "out"), False, nbSamples=4)
+            self.assertEqual("chr1\t10\t1\t1\t0\t0\t0\t0\n", open(os.path.join(tempDir, "out_sample4.txt")).readlines()[1])
+        finally:
+            shutil.rmtree(tempDir)
+    
+    def createTempPileupBins(self):
+        rand = random.Random(3)
+        tempFile = NamedTemporaryFile(delete=False)
+        for chromosome in ("chr1", "chr2"):
+            position = 1
+            while position < 5000:
+                ref = rand.choice("ACGT")
+                depth = rand.randint(1, 20)
+                sequence = "".join([rand.choice("..,,,.ACGTN") for i in range(depth)])
+                qualities = "".join([chr(rand.randint(33, 73)) for i in range(depth)])
+                mapqs = "".join([chr(rand.randint(33, 93)) for i in range(depth)])
+                tempFile.write("%s\t%d\t%s\t%d\t%s\t%s\t%s\n" % (chromosome, position, ref, depth, sequence, qualities, mapqs))
+                position += rand.randint(1, 30)
+        tempFile.close()
+        return(tempFile.name)
+    
+    def test_parseMPileup_sparse(self):
+        """Test that the sparse mode only writes the positions with enough non-reference bases"""
+        inputfile_path = self.createTempPileupBins()
+        tempDir = tempfile.mkdtemp()
+        try:
+            refs = dict([(tuple(line.split("\t")[:2]), line.split("\t")[2]) for line in open(inputfile_path)])
+            parsePileup(inputfile_path, os.path.join(tempDir, "full"), False)
+            fullLines = open(os.path.join(tempDir, "full.txt")).read().splitlines(True)
+            for (minAltCount, minAltFraction) in ((1, None), (3, None), (None, 0.25), (2, 0.1), (None, 0.0)):
+                expected = list()
+                for line in fullLines[1:]:
+                    data = line.split("\t")
+                    counts = [int(value) for value in data[2:8]]
+                    alt = sum(counts[:5]) - counts["ACGT".index(refs[(data[0], data[1])])]
+                    if alt >= (minAltCount or 1) and alt > (minAltFraction or 0.0) * sum(counts):
+                        expected.append(line)
+                self.assertTrue(0 < len(expected) < len(fullLines) - 1)
+                for threads in (1, 2):
+                    parsePileup(inputfile_path, os.path.join(tempDir, "sparse"), False, threads=threads,
+                                minAltCount=minAltCount, minAltFraction=minAltFraction)
+                    self.assertEqual(fullLines[:1] + expected, open(os.path.join(tempDir, "sparse.txt")).read().splitlines(True))
+                    keys = set([line.split("\t", 2)[1] for line in expected])
+                    self.assertEqual(len(expected), len(open(os.path.join(tempDir, "sparse_20_5.txt")).read().splitlines()) - 1)
+                    for line in open(os.path.join(tempDir, "sparse_20_5.txt")).read().splitlines()[1:]:
+                        self.assertTrue(line.split("\t")[1] in keys)
+        finally:
+            os.unlink(inputfile_path)
+            shutil.rmtree(tempDir)
+    
+    def test_parseMPileup_bin(self):
+        """Test that the binned mode writes the sum of the counts of each window"""
+        inputfile_path = self.createTempPileupBins()
+        tempDir = tempfile.mkdtemp()
+        try:
+            parsePileup(inputfile_path, os.path.join(tempDir, "full"), False)
+            for suffix in (".txt", "_25_1.txt"):
+                expected = collections.OrderedDict()
+                for line in open(os.path.join(tempDir, "full" + suffix)).read().splitlines()[1:]:
+                    data = line.split("\t")
+                    key = (data[0], str((int(data[1]) - 1) // 1000 * 1000 + 1))
+                    counts = expected.setdefault(key, [0] * (len(data) - 2))
+                    expected[key] = [count + int(value) for (count, value) in zip(counts, data[2:])]
+                expected = ["\t".join(list(key) + [str(count) for count in counts]) for (key, counts) in expected.items()]
+                self.assertEqual(10, len(expected))
+                for threads in (1, 3):
+                    parsePileup(inputfile_path, os.path.join(tempDir, "bin"), False, threads=threads, binSize=1000)
+                    self.assertEqual(expected, open(os.path.join(tempDir, "bin" + suffix)).read().splitlines()[1:])
+            
+            ## The windows overlapping two blocks are written once
+            allRecords = list(iterPileup(inputfile_path, phreds=(20,), mapqs=(0,)))
+            binned = createOutput("columns", False, (20,), (0,), os.path.join(tempDir, "blocks"), binSize=1000)
+            for start in range(0, len(allRecords), 7):
+                records = allRecords[start:start + 7]
+                binned.write([record.chromosome for record in records], [record.position for record in records],
+                             numpy.array([record.counts for record in records]), numpy.array([record.thresholdCounts for record in records]))
+            binned.close()
+            columns = loadColumns(os.path.join(tempDir, "blocks"))
+            self.assertEqual(columns['position'].tolist(), [1, 1001, 2001, 3001, 4001] * 2)
+            self.assertEqual(columns['counts'].sum(axis=0).tolist(), numpy.array([record.counts for record in allRecords]).sum(axis=0).tolist())
+        finally:
+            os.unlink(inputfile_path)
+            shutil.rmtree(tempDir)
+    
+    def test_parseMPileup_resume(self):
+        """Test that a parsing killed after a checkpoint and resumed gives the outputs of an uninterrupted parsing"""
+        tempDir = tempfile.mkdtemp()
+        try:
+            rand = random.Random(5)
+            lines = list()
+            for position in xrange(1, 21001):
+                depth = rand.randint(1, 3)
+                lines.append("chr1\t%d\tA\t%d\t%s\t%s\t%s\n" % (position, depth, "".join([rand.choice(".,ACGT") for i in range(depth)]),
+                                                                 "I" * depth, "]" * depth))
+            ## The single process needs several blocks, the processes several chunks
+            inputFiles = [os.path.join(tempDir, "input%d.pileup" % run) for run in range(2)]
+            open(inputFiles[0], "w").write("".join(lines))
+            open(inputFiles[1], "w").write("".join(lines[:3000]))
+            ## The process stops without closing its files at the second block, or second chunk
+            killed = "\n".join(["import os, sys, parseMPileup",
+                                 "function = 'writeChunkResult' if '-t' in sys.argv else 'writeBlock'",
+                                 "original = getattr(parseMPileup, function)",
+                                 "calls = list()",
+                                 "def stop(*arguments):",
+                                 "    calls.append(1)",
+                                 "    if len(calls) == 2:",
+                                 "        os._exit(9)",
+                                 "    original(*arguments)",
+                                 "setattr(parseMPileup, function, stop)",
+                                 "parseMPileup.parsePileup(sys.argv[1], sys.argv[2], False, checkpointSize=1, **eval(sys.argv[3]))"])
+            directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            for (run, options) in enumerate((dict(), dict([('threads', 3), ('compression', "bgzip")]))):
+                inputFile = inputFiles[run]
+                parsePileup(inputFile, os.path.join(tempDir, "single%d" % run), False, checkpointSize=1, **options)
+                process = subprocess.Popen([sys.executable, "-c", killed, inputFile, os.path.join(tempDir, "resumed%d" % run), repr(options)] +
+                                           ["-t"] * ('threads' in options), cwd=directory)
+                self.assertEqual(9, process.wait())
+                self.assertTrue(os.path.exists(os.path.join(tempDir, "resumed%d.checkpoint.json" % run)))
+                
+                sys.stdout = StringIO.StringIO()
+                ## A checkpoint of another parsing is refused
+                with self.assertRaises(SystemExit):
+                    parsePileup(inputFile, os.path.join(tempDir, "resumed%d" % run), True, resume=True, **options)
+                parsePileup(inputFile, os.path.join(tempDir, "resumed%d" % run), False, resume=True, **options)
+                self.assertFalse(os.path.exists(os.path.join(tempDir, "resumed%d.checkpoint.json" % run)))
+                names = [name for name in os.listdir(tempDir) if name.startswith("single%d" % run)]
+                self.assertEqual(17, len(names))
+                for name in names:
+                    self.assertEqual(open(os.path.join(tempDir, name), "rb").read(),
+                                     open(os.path.join(tempDir, name.replace("single", "resumed")), "rb").read())
+
+        finally:
+            shutil.rmtree(tempDir)
+    
+    def test_parseMPileup_append(self):
+        """Test that the lines appended to existing outputs give the outputs of a single parsing"""
+        inputfile_path = self.createTempPileup01()
+        tempDir = tempfile.mkdtemp()
+        try:
+            lines = open(inputfile_path).readlines()
+            inputFiles = [os.path.join(tempDir, "input%d.pileup" % part) for part in range(3)]
+            open(inputFiles[0], "w").write("".join(lines[:3]))
+            ## The lines of chr1 and chr2 are already in the outputs
+            open(inputFiles[1], "w").write("".join(lines[1:]))
+            ## chr1 is followed by other chromosomes in the outputs
+            open(inputFiles[2], "w").write(lines[0].replace("3153345", "3153300"))
+            sys.stdout = StringIO.StringIO()
+            for (run, options) in enumerate((dict([('separatedFiles', False)]), dict([('separatedFiles', True), ('compression', "bgzip")]))):
+                parsePileup(inputfile_path, os.path.join(tempDir, "single%d" % run), **options)
+                outputPrefix = os.path.join(tempDir, "appended%d" % run)
+                for inputFile in inputFiles[:2]:
+                    parsePileup(inputFile, outputPrefix, append=True, **options)
+                self.assertTrue(os.path.exists(outputPrefix + ".ranges.json"))
+                names = [name for name in os.listdir(tempDir) if name.startswith("single%d" % run)]
+                self.assertEqual(17 + run, len(names))
+                contents = dict()
+                for name in names:
+                    contents[name] = open(os.path.join(tempDir, name.replace("single", "appended")), "rb").read()
+                    if name.endswith(".gz"):
+                        self.assertEqual(gzip.open(os.path.join(tempDir, name)).read(),
+                                         gzip.open(os.path.join(tempDir, name.replace("single", "appended"))).read())
+                    else:
+                        self.assertEqual(open(os.path.join(tempDir, name)).read(), contents[name])
+                
+                ## Nothing is written when the lines are in the outputs or cannot be appended
+                parsePileup(inputFiles[0], outputPrefix, append=True, **options)
+                with self.assertRaises(SystemExit):
+                    parsePileup(inputFiles[2], outputPrefix, append=True, **options)
+                with self.assertRaises(SystemExit):
+                    parsePileup(inputFiles[1], outputPrefix, append=True, phreds=(20,), **options)
+                for name in names:
+                    self.assertEqual(contents[name], open(os.path.join(tempDir, name.replace("single", "appended")), "rb").read())
+                self.assertTrue("it does not follow the position chr6:37108587" in sys.stdout.getvalue())
+                
+                ## The ranges no longer describe outputs written again
+                parsePileup(inputFiles[0], outputPrefix, **options)
+                self.assertFalse(os.path.exists(outputPrefix + ".ranges.json"))
+        finally:
+            os.unlink(inputfile_path)
+            shutil.rmtree(tempDir)
+    
+    def test_parseMPileup_append_gap(self):
+        """Test that the lines between the positions of a range of the outputs, or different from its lines, are not skipped"""
+        inputfile_path = self.createTempPileup01()
+        tempDir = tempfile.mkdtemp()
+        try:
+            line = open(inputfile_path).readline()
+            positions = [line.replace("3153345", str(position)) for position in range(1, 6)]
+            inputFiles = [os.path.join(tempDir, "input%d.pileup" % part) for part in range(3)]
+            open(inputFiles[0], "w").write(positions[0] + positions[2] + positions[4])
+            open(inputFiles[1], "w").write("".join(positions))
+            open(inputFiles[2], "w").write(positions[0] + positions[2].replace("]]", "]!") + positions[4])
+            outputPrefix = os.path.join(tempDir, "gap")
+            sys.stdout = StringIO.StringIO()
+            parsePileup(inputFiles[0], outputPrefix, False, append=True)
+            self.assertEqual([["chr1", [[1, 1], [3, 3], [5, 5]]]],
+                             [rangeItem[:2] for rangeItem in json.load(open(outputPrefix + ".ranges.json"))['ranges']])
+            content = open(outputPrefix + ".txt").read()
+            with self.assertRaises(SystemExit):
+                parsePileup(inputFiles[1], outputPrefix, False, append=True)
+            self.assertTrue("Cannot append line 2 (chr1:2)" in sys.stdout.getvalue())
+            with self.assertRaises(SystemExit):
+                parsePileup(inputFiles[2], outputPrefix, False, append=True)
+            self.assertTrue("its lines of the range chr1:1-5 differ" in sys.stdout.getvalue())
+            self.assertEqual(content, open(outputPrefix + ".txt").read())
+            ## The same lines are skipped
+            parsePileup(inputFiles[0], outputPrefix, False, append=True)
+            self.assertTrue("already in the outputs" in sys.stdout.getvalue())
+        finally:
+            os.unlink(inputfile_path)
+            shutil.rmtree(tempDir)
+    
+    def test_parseMPileup_stats(self):
+        """Test the counters and the stage times collected during the parsing"""
+        inputfile_path = self.createTempPileup01()
+        tempDir = tempfile.mkdtemp()
+        try:
+            outputPrefix = os.path.join(tempDir, "stats")
+            expected = dict([('lines', 6), ('bases', 17), ('indels', 3), ('readStarts', 1), ('readEnds', 2), ('referenceSkips', 0)])
+            for options in (dict(), dict([('threads', 2)]), dict([('pipeline', True)])):
+                sys.stderr = StringIO.StringIO()
+                try:
+                    stats = Statistics(progressInterval=1e-6)
+                    parsePileup(inputfile_path, outputPrefix, False, stats=stats, **options)
+                    self.assertTrue(sys.stderr.getvalue().startswith("Parsed "))
+                finally:
+                    sys.stderr = sys.__stderr__
+                self.assertEqual(expected, stats.counters)
+                self.assertTrue(all([stats.timings[stage] > 0 for stage in ('split', 'decode', 'count', 'write')]))
+            
+            stats.writeSummary(os.path.join(tempDir, "stats.json"))
+            summary = json.load(open(os.path.join(tempDir, "stats.json")))
+            self.assertEqual(expected, summary['counters'])
+            self.assertEqual(sorted(['read', 'cache', 'split', 'decode', 'count', 'write']), sorted(summary['timings']))
+            self.assertAlmostEqual(6 / summary['elapsed'], summary['rates']['linesPerSecond'], places=0)
+            
+            ## The positions computed from the cache are counted as lines
+            cacheDir = os.path.join(tempDir, "cache")
+            try:
+                for run in range(2):
+                    sys.stderr = StringIO.StringIO()
+                    stats = Statistics(progressInterval=1e-6)
+                    parsePileup(inputfile_path, outputPrefix, False, cacheDir=cacheDir, stats=stats)
+                self.assertTrue("Parsed 6 lines" in sys.stderr.getvalue())
+            finally:
+                sys.stderr = sys.__stderr__
+            self.assertEqual(6, stats.counters['lines'])
+            self.assertTrue(stats.timings['cache'] > 0 and stats.timings['write'] > 0)
+            self.assertEqual(0, stats.timings['decode'])
+        finally:
+            os.unlink(inputfile_path)
+            shutil.rmtree(tempDir)
+    
+    def test_formatRows(self):
+        """Test that the rows of a block are formatted as one row at a time"""
+        counts = numpy.random.RandomState(3).randint(0, 1000, (50, 4))
+        locations = ["chr%d\t%d\t" % (i % 3, i) for i in range(50)]
+        self.assertEqual("".join(["%d\t%d\t%d\t%d\n" % tuple(row) for row in counts]), formatRows(counts))
+        self.assertEqual("".join([location + "%d\t%d\t%d\t%d\n" % tuple(row) for (location, row) in zip(locations, counts)]),
+                         formatRows(counts, locations))
+        self.assertEqual("", formatRows(counts[:0], locations[:0]))
+    
+    def test_parseMPileup_buffer_size(self):
+        """Test that the output files do not depend on the size of the write buffer"""
+        inputfile_path = self.createTempPileup01()
+        tempDir = tempfile.mkdtemp()
+        try:
+            for separatedFiles in (False, True):
+                for bufferSize in (0, 100, 1024 * 1024):
+                    parsePileup(inputfile_path, os.path.join(tempDir, "buffer%d" % bufferSize), separatedFiles, bufferSize=bufferSize)
+                files = [f for f in os.listdir(tempDir) if f.startswith("buffer0")]
+                self.assertEqual(17 + int(separatedFiles), len(files))
+                for f in files:
+                    content = open(os.path.join(tempDir, f)).read()
+                    self.assertEqual(content, open(os.path.join(tempDir, f.replace("buffer0", "buffer100"))).read())
+                    self.assertEqual(content, open(os.path.join(tempDir, f.replace("buffer0", "buffer1048576"))).read())
+                ## The first position has two T and an insertion
+                self.assertTrue(open(os.path.join(tempDir, "buffer0.txt")).readlines()[1 - int(separatedFiles)].endswith("0\t0\t0\t2\t1\t0\n"))
+        finally:
+            os.unlink(inputfile_path)
+            shutil.rmtree(tempDir)
+    
         
         
 if __name__ == '__main__':
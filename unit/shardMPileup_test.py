@@ -0,0 +1,137 @@
+import unittest
+import sys
+import os
+import json
+import gzip
+import random
+import shutil
+import tempfile
+import StringIO
+import subprocess
+
+import parseMPileup
+
+from shardMPileup import planShards
+from shardMPileup import readManifest
+from shardMPileup import runShard
+from shardMPileup import mergeShards
+from parseMPileup import parsePileup
+
+class ShardMPileupTestCase(unittest.TestCase):
+    """Tests for `shardMPileup.py`."""
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.inputFile = os.path.join(self.tempDir, "input.pileup")
+        rand = random.Random(11)
+        oFile = open(self.inputFile, "w")
+        for chromosome in ("chr1", "chr2", "chr3"):
+            for position in xrange(1000, 1000 + rand.randint(100, 300)):
+                depth = rand.randint(1, 30)
+                sequence = "".join([rand.choice("..,,ACGT") for i in range(depth)])
+                qualities = "".join([chr(rand.randint(33, 73)) for i in range(depth)])
+                mapqs = "".join([chr(rand.randint(33, 93)) for i in range(depth)])
+                oFile.write("%s\t%d\tA\t%d\t%s\t%s\t%s\n" % (chromosome, position, depth, sequence, qualities, mapqs))
+        oFile.close()
+
+    def tearDown(self):
+        sys.stdout = sys.__stdout__
+        shutil.rmtree(self.tempDir)
+
+    def runAllShards(self, manifestFile):
+        """Run each shard of a manifest in its own process"""
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shardMPileup.py")
+        manifest = json.load(open(manifestFile))
+        processes = [subprocess.Popen([sys.executable, script, "run-shard", "-m", manifestFile, "-k", str(entry['shard'])])
+                     for entry in manifest['shards']]
+        self.assertEqual([0] * len(processes), [process.wait() for process in processes])
+
+    def test_planShards_lines(self):
+        """Test that the shards cover the input file without overlap"""
+        manifestFile = os.path.join(self.tempDir, "manifest.json")
+        planShards(self.inputFile, os.path.join(self.tempDir, "out"), manifestFile, 4, phreds=(20,), mapqs=(5, 10))
+        manifest = readManifest(manifestFile)
+        self.assertEqual(4, len(manifest['shards']))
+        self.assertEqual(0, manifest['shards'][0]['start'])
+        self.assertEqual(os.path.getsize(self.inputFile), manifest['shards'][-1]['end'])
+        content = open(self.inputFile).read()
+        for entry in manifest['shards']:
+            self.assertTrue(entry['start'] == 0 or content[entry['start'] - 1] == "\n")
+        self.assertEqual((20,), manifest['options']['phreds'])
+        self.assertEqual(1, manifest['options']['nbSamples'])
+
+    def test_planShards_chromosomes(self):
+        """Test that each chromosome is kept in a single shard"""
+        manifestFile = os.path.join(self.tempDir, "manifest.json")
+        planShards(self.inputFile, os.path.join(self.tempDir, "out"), manifestFile, 5, "chromosomes")
+        manifest = readManifest(manifestFile)
+        content = open(self.inputFile).read()
+        self.assertEqual(3, len(manifest['shards']))
+        self.assertEqual(["chr1", "chr2", "chr3"], [content[entry['start']:entry['start'] + 4] for entry in manifest['shards']])
+
+    def test_mergeShards_same_as_single_run(self):
+        """Test that the merged shards are identical to the outputs of a single run"""
+        for (options, nbShards) in ((dict(), 3), (dict([('separatedFiles', True)]), 7), (dict([('compression', "bgzip")]), 2)):
+            singlePrefix = os.path.join(self.tempDir, "single")
+            parsePileup(self.inputFile, singlePrefix, options.get('separatedFiles', False), compression=options.get('compression'))
+            manifestFile = os.path.join(self.tempDir, "manifest.json")
+            planShards(self.inputFile, os.path.join(self.tempDir, "merged"), manifestFile, nbShards, **options)
+            self.runAllShards(manifestFile)
+            mergeShards(manifestFile, True)
+            files = sorted([name for name in os.listdir(self.tempDir) if name.startswith("merged")])
+            self.assertEqual(sorted([name.replace("single", "merged") for name in os.listdir(self.tempDir) if name.startswith("single")]), files)
+            for name in files:
+                if name.endswith(".gz"):
+                    self.assertEqual(gzip.open(os.path.join(self.tempDir, name.replace("merged", "single"))).read(),
+                                     gzip.open(os.path.join(self.tempDir, name)).read())
+                else:
+                    self.assertEqual(open(os.path.join(self.tempDir, name.replace("merged", "single"))).read(),
+                                     open(os.path.join(self.tempDir, name)).read())
+                os.remove(os.path.join(self.tempDir, name))
+                os.remove(os.path.join(self.tempDir, name.replace("merged", "single")))
+
+    def test_mergeShards_columns_slices(self):
+        """Test that the columns of the shards copied by slices give the columns of a single run"""
+        parsePileup(self.inputFile, os.path.join(self.tempDir, "single"), False, outputFormat="columns")
+        manifestFile = os.path.join(self.tempDir, "manifest.json")
+        planShards(self.inputFile, os.path.join(self.tempDir, "merged"), manifestFile, 3, outputFormat="columns")
+        self.runAllShards(manifestFile)
+        copyRows = parseMPileup.COPY_ROWS
+        parseMPileup.COPY_ROWS = 7
+        try:
+            mergeShards(manifestFile, True)
+        finally:
+            parseMPileup.COPY_ROWS = copyRows
+        files = sorted([name for name in os.listdir(self.tempDir) if name.startswith("merged")])
+        self.assertEqual(5, len(files))
+        for name in files:
+            self.assertEqual(open(os.path.join(self.tempDir, name.replace("merged", "single")), "rb").read(),
+                             open(os.path.join(self.tempDir, name), "rb").read())
+
+    def test_mergeShards_missing_shard(self):
+        """Test that the merge stops when a shard is not complete"""
+        sys.stdout = StringIO.StringIO()
+        manifestFile = os.path.join(self.tempDir, "manifest.json")
+        planShards(self.inputFile, os.path.join(self.tempDir, "out"), manifestFile, 3)
+        runShard(manifestFile, 0)
+        runShard(manifestFile, 2)
+        with self.assertRaises(SystemExit):
+            mergeShards(manifestFile)
+        self.assertTrue("shard 1 is not complete" in sys.stdout.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self.tempDir, "out.txt")))
+
+    def test_readManifest_overlapping_shards(self):
+        """Test that a manifest with overlapping or missing ranges is refused"""
+        sys.stdout = StringIO.StringIO()
+        manifestFile = os.path.join(self.tempDir, "manifest.json")
+        manifest = planShards(self.inputFile, os.path.join(self.tempDir, "out"), manifestFile, 3)
+        for (shard, key, delta) in ((1, 'start', -10), (1, 'start', 10), (2, 'end', -1)):
+            entries = [dict(entry) for entry in manifest['shards']]
+            entries[shard][key] += delta
+            json.dump(dict(manifest, shards=entries), open(manifestFile, "w"))
+            with self.assertRaises(SystemExit):
+                readManifest(manifestFile)
+
+
+if __name__ == '__main__':
+    unittest.main()